@@ -0,0 +1 @@
+# Benchmarks, run from the repo root with `python -m bench.<name>`
@@ -0,0 +1,77 @@
+"""
+Cost per broadcast vs channel size
+
+    python -m bench.broadcast [--rounds N]
+
+legacy:   Message.pack as it was before header caching (full header + CRC per recipient)
+prepared: Message.pack with the cached header / incremental CRC
+group:    group-key mode, one GROUP ciphertext shared by every member
+
+legacy and prepared both run one AEAD seal per member, so they grow
+linearly with the channel and the header cache only trims a few percent
+off each recipient. group is the path that actually changes the cost:
+one seal per broadcast, every member gets the same packed frame.
+"""
+import argparse
+import time
+
+from aronanet.protocol.crypto import SecureChannel, KeyExchange, GroupKey
+from aronanet.protocol.messages import Message, MessageType
+
+from .legacy import legacy_pack
+
+SIZES = (1, 10, 50, 200, 1000)
+PAYLOAD = b"[cheese] the quick brown fox jumps over the lazy dog"
+
+
+def make_channels(n: int) -> list[SecureChannel]:
+    channels = []
+    for _ in range(n):
+        ch = SecureChannel()
+        ch.setup_shared_key(KeyExchange().derive_shared_key(KeyExchange().get_public_bytes()))
+        channels.append(ch)
+    return channels
+
+
+def run_legacy(channels):
+    msg = Message(msg_type=MessageType.TEXT, payload=PAYLOAD)
+    for ch in channels:
+        legacy_pack(msg, ch)
+
+
+def run_prepared(channels):
+    msg = Message(msg_type=MessageType.TEXT, payload=PAYLOAD)
+    for ch in channels:
+        msg.pack(ch)
+
+
+def run_group(channels, key=GroupKey()):
+    msg = Message(msg_type=MessageType.GROUP, payload=key.seal(MessageType.TEXT, PAYLOAD))
+    for ch in channels:
+        msg.pack(ch)
+
+
+def bench(fn, channels, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn(channels)
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'members':>8} {'legacy us':>12} {'prepared us':>12} {'group us':>12}")
+    for n in SIZES:
+        channels = make_channels(n)
+        rounds = max(1, args.rounds * 10 // n)
+        legacy = bench(run_legacy, channels, rounds)
+        prepared = bench(run_prepared, channels, rounds)
+        group = bench(run_group, channels, rounds)
+        print(f"{n:>8} {legacy:>12.1f} {prepared:>12.1f} {group:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
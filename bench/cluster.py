@@ -0,0 +1,139 @@
+"""
+Multi-worker scaling: the loadgen chat swarm against 1, 2, 4... workers
+
+    python -m bench.cluster [--workers 1 2 4] [--clients N] [--messages M] [--rate R] [--drivers D]
+
+The server runs as a real cluster (master + hub + worker processes on one
+SO_REUSEPORT port, bore off). Clients are split over D driver processes so
+the load generator isn't the single-core bottleneck. Every message fans
+out to all other clients, so most deliveries cross the worker bus.
+Reports delivered messages/sec, fan-out latency and speedup over 1 worker.
+
+Speedup only means something with a core per process (workers + drivers
++ the master's hub). With fewer cores the processes time-share and more
+workers mostly add bus hops. When delivered < expected, the server was
+overloaded and shed chat frames (overflow_policy), so compare msg/s only
+between complete rows.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import tempfile
+import time
+from pathlib import Path
+
+from bench.loadgen import drive
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve_cluster(settings: dict, ready):
+    """Cluster master process entry point"""
+    from aronanet.server.cluster import AronaCluster
+    from aronanet.utils.config import AronaSettings
+
+    # Workers inherit fd 1, so silence it at the fd level
+    os.dup2(os.open(os.devnull, os.O_WRONLY), 1)
+    config = AronaSettings(config_path=Path(tempfile.mkdtemp()) / "config.yaml")
+    for key, value in settings.items():
+        config.set(key, value, save=False)
+
+    async def run():
+        cluster = AronaCluster(config)
+        await cluster.launch()
+        while len(cluster.hub.workers) < cluster.worker_count:
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(0.2)  # workers bind right after joining the bus
+        ready.set()
+
+        try:
+            await cluster.supervise()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            await cluster.stop()
+
+    asyncio.run(run())
+
+
+def driver(port: int, index: int, clients: int, peers: int, args, barrier, results):
+    """Client process: its share of the swarm, blasting once every driver is connected"""
+    results.put(asyncio.run(drive(
+        port, clients, args.messages, args.rate, peers=peers, name=f"d{index}u", ready=barrier.wait
+    )))
+
+
+def run_cluster(workers: int, args) -> dict:
+    ctx = multiprocessing.get_context("spawn")
+    port = free_port()
+    settings = {
+        "host": "127.0.0.1", "port": port, "workers": workers,
+        "max_connections": 100_000, "max_pending": 100_000, "loop": "default", "log_level": "WARNING",
+    }
+
+    ready = ctx.Event()
+    master = ctx.Process(target=serve_cluster, args=(settings, ready))
+    master.start()
+    try:
+        if not ready.wait(30):
+            raise RuntimeError("Cluster didn't come up")
+
+        shares = [args.clients // args.drivers + (i < args.clients % args.drivers) for i in range(args.drivers)]
+        barrier, results = ctx.Barrier(args.drivers), ctx.Queue()
+        drivers = [
+            ctx.Process(target=driver, args=(port, i, share, args.clients, args, barrier, results))
+            for i, share in enumerate(shares)
+        ]
+        start = time.perf_counter()
+        for proc in drivers:
+            proc.start()
+        parts = [results.get(timeout=300) for _ in drivers]
+        for proc in drivers:
+            proc.join()
+        wall = time.perf_counter() - start
+
+    finally:
+        master.terminate()
+        master.join()
+
+    return {
+        "delivered": sum(p["delivered"] for p in parts),
+        "expected": sum(p["expected"] for p in parts),
+        "msgs_per_sec": sum(p["msgs_per_sec"] for p in parts),
+        "p50_ms": max(p["p50_ms"] for p in parts),
+        "p99_ms": max(p["p99_ms"] for p in parts),
+        "wall_s": wall,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=50.0, help="messages/sec per client")
+    parser.add_argument("--drivers", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="client processes")
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} cores, {args.clients} clients over {args.drivers} driver processes")
+    needed = max(args.workers) + args.drivers + 1
+    if (os.cpu_count() or 1) < needed:
+        print(f"warning: {needed} processes on {os.cpu_count()} cores, speedup won't reflect scaling")
+    print(f"{'workers':>7} {'delivered':>16} {'msg/s':>10} {'speedup':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    base = None
+    for workers in args.workers:
+        r = run_cluster(workers, args)
+        base = base or r["msgs_per_sec"]
+        print(f"{workers:>7} {r['delivered']:>8}/{r['expected']:<7} {r['msgs_per_sec']:>10,.0f} "
+              f"{r['msgs_per_sec'] / base:>7.2f}x {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Bytes on the wire and CPU cost of payload compression
+
+    python -m bench.compression [--log-dir DIR] [--min-size N] [--count N]
+
+Replays a chat trace through each available compressor and reports wire
+bytes (length prefix + v2 header + body + AEAD tag, counter nonces) against
+no compression, plus compress + decompress time per message. With
+--log-dir the trace is every channel of a server's message log (the
+history/ directory), otherwise a seeded synthetic session: joins, leaves,
+`[username] ...` lines, the odd pasted link, and a 50 message HISTORY
+catch-up for everyone who joins.
+"""
+import argparse
+import random
+import time
+from pathlib import Path
+
+from aronanet.protocol.compression import ZlibCompressor, ZstdCompressor
+from aronanet.protocol.messages import MessageType, V2_HEADER, history_payload
+from aronanet.server.message_log import MessageLog
+
+# 4 byte length prefix + Poly1305 tag, the nonce is implicit with counter nonces
+OVERHEAD = 4 + V2_HEADER + 16
+
+USERS = ["arona", "plana", "shiroko", "hoshino", "yuuka", "noa", "aris", "momoi", "midori", "yuzu"]
+LINES = [
+    "hey everyone", "lol", "did anyone get the new update working?", "brb", "yeah that's what I thought",
+    "can you send the link again", "ok it works now thanks :)", "idk, works on my machine",
+    "I'm going to bed, gn", "what time is the raid tonight?", "has anyone tried the bore tunnel from termux yet",
+    "haha", "no way", "that's so cool", "let me check", "the server restarted again :/",
+    "https://github.com/XeonXE534/AronaNET/issues", "ok", "thanks!", "I think it's a firewall thing tbh",
+]
+
+
+def synthetic_trace(count: int, seed: int = 534) -> list[tuple[MessageType, bytes]]:
+    rng = random.Random(seed)
+    trace, texts = [], []
+    for _ in range(count):
+        user = rng.choice(USERS)
+        roll = rng.random()
+        if roll < 0.05:
+            trace.append((MessageType.ONLINE, f"{user} joined".encode()))
+            first = max(0, len(texts) - 50)
+            records = [(seq + 1, MessageType.TEXT, texts[seq]) for seq in range(first, len(texts))]
+            trace.append((MessageType.HISTORY, history_payload(len(texts), records)))
+        elif roll < 0.10:
+            trace.append((MessageType.OFFLINE, f"{user} left".encode()))
+        else:
+            line = " ".join(rng.choice(LINES) for _ in range(rng.choice((1, 1, 1, 2, 3))))
+            texts.append(f"[{user}] {line}".encode())
+            trace.append((MessageType.TEXT, texts[-1]))
+    return trace
+
+
+def log_trace(log_dir: Path) -> list[tuple[MessageType, bytes]]:
+    log = MessageLog(log_dir)
+    return [(msg_type, payload) for channel in log.channels for _, msg_type, payload in log.read(channel, 0)]
+
+
+def measure(compressor, trace, min_size: int) -> tuple[int, float]:
+    """Wire bytes and microseconds per message spent compressing + decompressing"""
+    wire = 0
+    start = time.perf_counter()
+    for _, payload in trace:
+        body = compressor.compress(payload) if compressor and len(payload) >= min_size else None
+        if body is not None:
+            assert compressor.decompress(body) == payload
+        wire += OVERHEAD + len(body if body is not None else payload)
+    elapsed = time.perf_counter() - start
+    return wire, elapsed / len(trace) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--log-dir", type=Path, help="replay a message log instead of the synthetic trace")
+    parser.add_argument("--min-size", type=int, default=64, help="compress_min_size")
+    parser.add_argument("--count", type=int, default=100_000, help="synthetic trace length")
+    args = parser.parse_args()
+
+    trace = log_trace(args.log_dir) if args.log_dir else synthetic_trace(args.count)
+    if not trace:
+        raise SystemExit("Empty trace :/")
+
+    compressors = [("off", None), ("zlib", ZlibCompressor(args.min_size))]
+    try:
+        compressors.append(("zstd", ZstdCompressor(args.min_size)))
+    except ImportError:
+        print("(zstandard not installed, skipping zstd)")
+
+    # min 0 also compresses the short lines, where the preset dictionary does all the work
+    print(f"{len(trace)} messages, payloads avg {sum(len(p) for _, p in trace) / len(trace):.1f} bytes")
+    print(f"{'codec':>6} {'min':>5} {'wire bytes':>12} {'saved':>7} {'us/msg':>8}")
+    baseline, _ = measure(None, trace, args.min_size)
+    for name, compressor in compressors:
+        for min_size in sorted({0, args.min_size}):
+            if compressor is None and min_size != args.min_size:
+                continue
+            wire, cost = measure(compressor, trace, min_size)
+            print(f"{name:>6} {min_size:>5} {wire:>12} {1 - wire / baseline:>7.1%} {cost:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Frame pack/unpack copies and throughput
+
+    python -m bench.frames [--seconds S]
+
+Compares the old slicing implementation (bytes concatenation in pack,
+bytes slices in unpack) with pack_into + memoryview unpack, for 1 KB,
+64 KB and 4 MB payloads. "copied" is bytes allocated per round trip as
+reported by tracemalloc, which is what every slice/concat costs.
+"""
+import argparse
+import time
+import tracemalloc
+import zlib
+
+from aronanet.protocol.crypto import SecureChannel
+from aronanet.protocol.messages import Message, MessageType, logger
+
+from .legacy import legacy_pack
+
+SIZES = {"1 KB": 1024, "64 KB": 64 * 1024, "4 MB": 4 * 1024 * 1024}
+
+
+def legacy_unpack(data: bytes, secure_channel: SecureChannel) -> bytes:
+    length = int.from_bytes(data[2:6], "big")
+    body = data[8:8 + length]
+    if zlib.crc32(data[0:8 + length]) != int.from_bytes(data[8 + length:12 + length], "big"):
+        raise ValueError("Checksum mismatch")
+
+    payload = secure_channel.decrypt(body[:12], body[12:])
+    logger.debug(f"Unpacked msg_id: {int.from_bytes(data[6:8], 'big')}, type: {MessageType(data[1]).name} :)")
+    return payload
+
+
+def legacy_roundtrip(msg, channel):
+    packed = legacy_pack(msg, channel)
+    frame = len(packed).to_bytes(4, "big") + packed
+    return legacy_unpack(frame[4:], channel)
+
+
+def view_roundtrip(msg, channel):
+    size = msg.packed_size(channel)
+    frame = bytearray(4 + size)
+    frame[:4] = size.to_bytes(4, "big")
+    msg.pack_into(frame, 4, secure_channel=channel)
+    return Message.unpack(memoryview(frame)[4:], channel).payload
+
+
+def allocated(fn, msg, channel) -> int:
+    tracemalloc.start()
+    fn(msg, channel)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def throughput(fn, msg, channel, seconds: float) -> float:
+    done = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        fn(msg, channel)
+        done += 1
+    return done * len(msg.payload) / (time.perf_counter() - start) / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=1.0)
+    args = parser.parse_args()
+
+    channel = SecureChannel()
+    channel.setup_shared_key(b"k" * 32)
+
+    print(f"{'payload':>8} {'impl':>8} {'copied':>14} {'MB/s':>10}")
+    for label, size in SIZES.items():
+        msg = Message(msg_type=MessageType.IMAGE, payload=b"\xab" * size)
+        for name, fn in (("legacy", legacy_roundtrip), ("view", view_roundtrip)):
+            copied = allocated(fn, msg, channel)
+            mbps = throughput(fn, msg, channel, args.seconds)
+            print(f"{label:>8} {name:>8} {copied:>14,} {mbps:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Message latency for connected clients during a reconnect storm
+
+    python -m bench.handshakes [--clients N] [--storm S] [--messages M] [--rate R]
+
+N clients chat in #general (bench.loadgen traffic) while S more clients
+connect, handshake and AUTH all at once, like everyone coming back after
+a bore tunnel restart. Compared with the handshake gate off (crypto on the
+event loop, no keypool, no cap) and on (config defaults). The storm comes
+from 127.0.0.1 so the per-IP rate limit doesn't kick in.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import threading
+import time
+
+from .loadgen import LoadClient, drive, local_server
+
+INLINE = {"handshake_threads": 0, "keypool_size": 0, "handshake_concurrency": 100_000}
+
+
+async def storm(port: int, clients: int, go: threading.Event) -> float:
+    """Wait for the chatter to start, then reconnect `clients` at once -> seconds taken"""
+    await asyncio.to_thread(go.wait)
+    swarm = [LoadClient("127.0.0.1", port) for _ in range(clients)]
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        await asyncio.gather(*(c.setup(f"storm{i}") for i, c in enumerate(swarm)))
+    elapsed = time.perf_counter() - start
+
+    await asyncio.gather(*(c.close() for c in swarm))
+    return elapsed
+
+
+async def measure(port: int, args) -> dict:
+    go = threading.Event()
+    r, took = await asyncio.gather(
+        drive(port, args.clients, args.messages, args.rate, ready=go.set),
+        storm(port, args.storm, go)
+    )
+    r["storm_s"] = took
+    return r
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--storm", type=int, default=500)
+    parser.add_argument("--messages", type=int, default=60)
+    parser.add_argument("--rate", type=float, default=20.0, help="messages/sec per client")
+    args = parser.parse_args()
+
+    print(f"{'gate':>6} {'storm s':>8} {'msg/s':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, settings in (("off", INLINE), ("on", {})):
+        with local_server(**settings) as port:
+            r = asyncio.run(measure(port, args))
+        print(f"{name:>6} {r['storm_s']:>8.2f} {r['msgs_per_sec']:>10,.0f} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
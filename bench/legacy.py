@@ -0,0 +1,19 @@
+"""Message.pack as it was before header caching and pack_into, for the benches to compare against"""
+import zlib
+
+from aronanet.protocol.crypto import SecureChannel
+from aronanet.protocol.messages import Message, logger
+
+
+def legacy_pack(msg: Message, secure_channel: SecureChannel) -> bytes:
+    nonce, enc_payload = secure_channel.encrypt(msg.payload)
+    body = nonce + enc_payload
+    header = (
+            bytes([msg.version, msg.msg_type]) +
+            len(body).to_bytes(4, "big") +
+            msg.msg_id.to_bytes(2, "big")
+    )
+    checksum = zlib.crc32(header + body).to_bytes(4, "big")
+
+    logger.debug(f"Packing msg_id: {msg.msg_id}, type: {msg.msg_type.name}, length: {len(body)} :)")
+    return header + body + checksum
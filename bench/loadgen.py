@@ -0,0 +1,164 @@
+"""
+Load generator: N clients chatting in #general against a local server
+
+    python -m bench.loadgen [--engine streams|protocol|both] [--clients N] [--messages M] [--rate R]
+
+The server runs in its own process (bore off, config in a temp dir).
+Every client sends M TEXT messages carrying a send timestamp at R msg/s,
+so each message fans out to the other N-1 clients. Reports delivered
+messages/sec and fan-out latency percentiles per engine.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from aronanet.clients.client import AronaClient
+from aronanet.protocol.messages import MessageType
+
+
+def serve(settings: dict, port_queue):
+    """Server process entry point"""
+    from aronanet.server.server import AronaServer
+    from aronanet.utils.config import AronaSettings
+    from aronanet.utils.loop import run as run_loop
+
+    sys.stdout = open(os.devnull, "w")
+    config = AronaSettings(config_path=Path(tempfile.mkdtemp()) / "config.yaml")
+    for key, value in settings.items():
+        config.set(key, value, save=False)
+
+    async def run():
+        server = await AronaServer(config).listen()
+        port_queue.put(server.sockets[0].getsockname()[1])
+        await server.serve_forever()
+
+    run_loop(run(), config.get("loop", "default"))
+
+
+@contextlib.contextmanager
+def server_process(target=serve, **settings):
+    """Start a server process on a free port, yields (process, port) (target: serve or a wrapper of it)"""
+    ctx = multiprocessing.get_context("spawn")
+    port_queue = ctx.Queue()
+    settings.setdefault("host", "127.0.0.1")
+    settings.setdefault("port", 0)
+    settings.setdefault("max_connections", 100_000)
+    settings.setdefault("max_pending", 100_000)
+    settings.setdefault("loop", "default")
+
+    proc = ctx.Process(target=target, args=(settings, port_queue), daemon=True)
+    proc.start()
+    try:
+        yield proc, port_queue.get(timeout=30)
+    finally:
+        proc.terminate()
+        proc.join()
+
+
+@contextlib.contextmanager
+def local_server(target=serve, **settings):
+    """server_process() when only the port matters"""
+    with server_process(target, **settings) as (_, port):
+        yield port
+
+
+class LoadClient(AronaClient):
+    """AronaClient that records fan-out latency of TEXT frames"""
+    def __init__(self, host: str, port: int):
+        super().__init__(host, port, reconnect=False)
+
+    async def setup(self, username: str):
+        self.username = username
+        await self.connect()
+
+    async def pump(self, latencies: list, counter: list):
+        async for msg in self:
+            if msg.msg_type == MessageType.TEXT:
+                sent = int(msg.payload.split(b"] ", 1)[1])
+                latencies.append(time.perf_counter_ns() - sent)
+                counter[0] += 1
+
+    async def blast(self, messages: int, rate: float):
+        for _ in range(messages):
+            await self.send_text(str(time.perf_counter_ns()))
+            await asyncio.sleep(1 / rate)
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct))]
+
+
+async def drive(port: int, clients: int, messages: int, rate: float,
+                peers: int = 0, name: str = "load", ready=None) -> dict:
+    """
+    peers: total clients in the room when several drivers share one server (default: just ours)
+    ready: blocking callable run before blasting, e.g. a multiprocessing.Barrier().wait
+    """
+    peers = peers or clients
+    swarm = [LoadClient("127.0.0.1", port) for _ in range(clients)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        await asyncio.gather(*(c.setup(f"{name}{i}") for i, c in enumerate(swarm)))
+
+    latencies, counter = [], [0]
+    pumps = [asyncio.create_task(c.pump(latencies, counter)) for c in swarm]
+    await asyncio.sleep(0.5)  # let ONLINE notifications settle
+    if ready:
+        await asyncio.to_thread(ready)
+
+    expected = clients * messages * (peers - 1)
+    start = time.perf_counter()
+    await asyncio.gather(*(c.blast(messages, rate) for c in swarm))
+
+    # Wait for the tail of the fan-out, give up after 10s of silence
+    last, idle = counter[0], 0.0
+    while counter[0] < expected and idle < 10:
+        await asyncio.sleep(0.1)
+        idle = idle + 0.1 if counter[0] == last else 0.0
+        last = counter[0]
+    elapsed = time.perf_counter() - start
+
+    await asyncio.gather(*(c.close() for c in swarm))
+    await asyncio.gather(*pumps)
+
+    latencies.sort()
+    return {
+        "delivered": counter[0],
+        "expected": expected,
+        "msgs_per_sec": counter[0] / elapsed,
+        "p50_ms": percentile(latencies, 0.50) / 1e6,
+        "p99_ms": percentile(latencies, 0.99) / 1e6,
+    }
+
+
+def run_engine(engine: str, args, **settings) -> dict:
+    with local_server(engine=engine, **settings) as port:
+        return asyncio.run(drive(port, args.clients, args.messages, args.rate))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--engine", choices=("streams", "protocol", "both"), default="both")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=20.0, help="messages/sec per client")
+    args = parser.parse_args()
+
+    engines = ("streams", "protocol") if args.engine == "both" else (args.engine,)
+    print(f"{'engine':>9} {'delivered':>12} {'msg/s':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for engine in engines:
+        r = run_engine(engine, args)
+        print(f"{engine:>9} {r['delivered']:>6}/{r['expected']:<5} {r['msgs_per_sec']:>10,.0f} "
+              f"{r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Delivered messages/sec for each log level
+
+    python -m bench.log_levels [--clients N] [--messages M] [--rate R]
+
+bench.loadgen traffic against a server with:
+  sync:  every logger at DEBUG with a FileHandler written from the event
+         loop, like before log_level was honored
+  DEBUG: same records, written by the QueueListener thread
+  INFO:  the default, no per-frame records at all
+
+msg/s is delivered / elapsed, so a row that didn't get every message
+through (the server fell behind and shed chat) reads better than it was.
+"""
+import argparse
+import asyncio
+import logging
+
+from .loadgen import drive, local_server, serve
+
+
+def serve_sync(settings: dict, port_queue):
+    """serve() with the old logging: DEBUG straight to the file on the calling thread"""
+    import aronanet.server.server  # noqa: F401, creates the loggers
+    from aronanet.utils import logger as log_utils
+
+    fh = logging.FileHandler(str(log_utils.LOG_PATH), mode="a")
+    fh.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(name)s - %(message)s"))
+    for logger in log_utils._loggers.values():
+        logger.handlers = [fh]
+
+    serve(settings, port_queue)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=20.0, help="messages/sec per client")
+    args = parser.parse_args()
+
+    print(f"{'logging':>8} {'delivered':>12} {'msg/s':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, target, level in (("sync", serve_sync, "DEBUG"), ("DEBUG", serve, "DEBUG"), ("INFO", serve, "INFO")):
+        with local_server(target=target, log_level=level) as port:
+            r = asyncio.run(drive(port, args.clients, args.messages, args.rate))
+        print(f"{name:>8} {r['delivered']:>6}/{r['expected']:<5} {r['msgs_per_sec']:>10,.0f} "
+              f"{r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
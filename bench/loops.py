@@ -0,0 +1,58 @@
+"""
+Default asyncio loop vs uvloop on the server
+
+    python -m bench.loops [--clients N] [--messages M] [--rate R]
+
+For each loop the server is started in its own process, then:
+  accept:    N clients connect, handshake and AUTH at once -> connections/sec
+  broadcast: bench.loadgen traffic in #general -> delivered msg/s, p99
+uvloop is skipped if it isn't installed.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import time
+
+from aronanet.utils.loop import loop_factory
+
+from .loadgen import LoadClient, drive, local_server
+
+
+async def accept_rate(port: int, clients: int) -> float:
+    swarm = [LoadClient("127.0.0.1", port) for _ in range(clients)]
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        await asyncio.gather(*(c.setup(f"acc{i}") for i, c in enumerate(swarm)))
+    elapsed = time.perf_counter() - start
+
+    await asyncio.gather(*(c.close() for c in swarm))
+    return clients / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=20.0)
+    args = parser.parse_args()
+
+    loops = ["default"]
+    if loop_factory("auto") is not None:
+        loops.append("uvloop")
+    else:
+        print("[!] uvloop not installed, only measuring the default loop")
+
+    print(f"{'loop':>8} {'engine':>9} {'accept/s':>10} {'msg/s':>10} {'p99 ms':>8}")
+    for loop in loops:
+        for engine in ("streams", "protocol"):
+            with local_server(loop=loop, engine=engine) as port:
+                accepted = asyncio.run(accept_rate(port, args.clients))
+            with local_server(loop=loop, engine=engine) as port:
+                r = asyncio.run(drive(port, args.clients, args.messages, args.rate))
+            print(f"{loop:>8} {engine:>9} {accepted:>10,.0f} {r['msgs_per_sec']:>10,.0f} {r['p99_ms']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
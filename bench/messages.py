@@ -0,0 +1,109 @@
+"""
+Message construction and unpack cost
+
+    python -m bench.messages [--count N]
+
+Compares the old Message (plain dataclass with a __dict__, global Lock
+around the msg_id counter, MessageType(byte) on unpack) with the slots
+dataclass + lock-free counter + type table. For N messages (1M by
+default) reports the time to create them, the time to unpack N plaintext
+frames, and the memory held per live message as measured by tracemalloc.
+"""
+import argparse
+import time
+import tracemalloc
+import zlib
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import ClassVar
+
+from aronanet.protocol.messages import Message, MessageType, logger
+
+
+@dataclass
+class LegacyMessage:
+    version: int = 1
+    msg_type: MessageType = MessageType.TEXT
+    payload: bytes = b''
+    msg_id: int = field(default=None, init=False)
+    _header_cache: tuple = field(default=None, init=False, repr=False, compare=False)
+    _packed_cache: tuple = field(default=None, init=False, repr=False, compare=False)
+
+    _counter: ClassVar[int] = 0
+    _lock: ClassVar[Lock] = Lock()
+
+    def __post_init__(self):
+        if self.msg_id is None:
+            with LegacyMessage._lock:
+                self.msg_id = LegacyMessage._counter
+                LegacyMessage._counter = (LegacyMessage._counter + 1) % 65536
+
+
+def legacy_unpack(frame: bytes) -> LegacyMessage:
+    """Message.unpack's plaintext v2 path as it was: enum constructor, __post_init__ lock"""
+    view = memoryview(frame)
+    version = view[0]
+    msg_type = MessageType(view[1])
+    msg_id = int.from_bytes(view[3:5], "big")
+    end = len(view) - 4
+
+    if zlib.crc32(view[:end]) != int.from_bytes(view[end:], "big"):
+        raise ValueError("Checksum mismatch :(")
+    payload = bytes(view[5:end])
+
+    logger.debug(f"Unpacked msg_id: {msg_id}, type: {msg_type.name} :)")
+    msg = LegacyMessage(version=version, msg_type=msg_type, payload=payload)
+    msg.msg_id = msg_id
+    return msg
+
+
+def timed(fn, count: int) -> float:
+    start = time.perf_counter()
+    fn(count)
+    return time.perf_counter() - start
+
+
+def held_per_message(cls, count: int = 100_000) -> float:
+    """Bytes still allocated per message while `count` of them are alive"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    keep = [cls(msg_type=MessageType.TEXT, payload=b"hi") for _ in range(count)]
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del keep
+    return held / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    logger.disabled = True  # measure the data path, not the debug log
+    frame = Message(version=3, msg_type=MessageType.TEXT, payload=b"hello there").pack()
+
+    def create_legacy(n):
+        for _ in range(n):
+            LegacyMessage(msg_type=MessageType.TEXT, payload=b"hi")
+
+    def create_new(n):
+        for _ in range(n):
+            Message(msg_type=MessageType.TEXT, payload=b"hi")
+
+    def unpack_legacy(n):
+        for _ in range(n):
+            legacy_unpack(frame)
+
+    def unpack_new(n):
+        for _ in range(n):
+            Message.unpack(frame)
+
+    print(f"{'':>8} {'create s':>10} {'unpack s':>10} {'bytes/msg':>10}")
+    for name, cls, create, unpack in (("legacy", LegacyMessage, create_legacy, unpack_legacy),
+                                      ("slots", Message, create_new, unpack_new)):
+        print(f"{name:>8} {timed(create, args.count):>10.2f} {timed(unpack, args.count):>10.2f} "
+              f"{held_per_message(cls):>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Random vs counter nonces
+
+    python -m bench.nonces [--count N]
+
+Packs and unpacks N small TEXT messages with a random-nonce channel
+(os.urandom per message, 12 bytes on the wire) and with counter-nonce
+session keys (implicit nonces), and reports messages/sec and wire bytes.
+"""
+import argparse
+import time
+
+from aronanet.protocol.crypto import SecureChannel
+from aronanet.protocol.messages import Message, MessageType, PROTOCOL_VERSION
+
+PAYLOAD = b"[cheese] hi :3"
+
+
+def random_pair():
+    sender, receiver = SecureChannel(), SecureChannel()
+    sender.setup_shared_key(b"k" * 32)
+    receiver.setup_shared_key(b"k" * 32)
+    return sender, receiver
+
+
+def counter_pair():
+    sender, receiver = SecureChannel(), SecureChannel()
+    sender.setup_session_keys(b"k" * 32, is_server=False)
+    receiver.setup_session_keys(b"k" * 32, is_server=True)
+    return sender, receiver
+
+
+def run(sender, receiver, count: int) -> tuple[float, int]:
+    msgs = [Message(msg_type=MessageType.TEXT, payload=PAYLOAD) for _ in range(count)]
+    wire = 0
+
+    start = time.perf_counter()
+    for msg in msgs:
+        packed = msg.pack(sender, PROTOCOL_VERSION)
+        wire += len(packed)
+        Message.unpack(packed, receiver)
+    elapsed = time.perf_counter() - start
+
+    return count / elapsed, wire
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=10_000)
+    args = parser.parse_args()
+
+    print(f"{'mode':>8} {'msg/s':>12} {'wire bytes':>12}")
+    for name, pair in (("random", random_pair), ("counter", counter_pair)):
+        rate, wire = run(*pair(), args.count)
+        print(f"{name:>8} {rate:>12,.0f} {wire:>12,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+"""
+Load test: a client swarm with a TEXT/DM/SUP mix, results as JSON
+
+    python -m bench.swarm [--clients N] [--channels C] [--messages M] [--rate R]
+                          [--mix text=80,dm=15,sup=5] [--seed S] [--engine streams|protocol]
+                          [--set key=value ...] [--out run.json] [--compare base.json]
+
+The server runs in its own process on localhost (bore off, config in a
+temp dir), all N clients run in this one, spread over C channels. Each
+client sends M messages at R msg/s, picking TEXT, DM or SUP by the mix
+weights from a seeded RNG, so runs with the same arguments send the same
+traffic. Reports:
+  throughput  messages sent and delivered per second
+  latency     TEXT fan-out, DM delivery and SUP round trip percentiles
+  server      CPU % over the run, RSS now and at peak (from /proc)
+  swarm       this process's CPU %, near 100 means the swarm is the limit
+
+--out writes all of it, arguments and server settings included, as JSON.
+--compare prints every number next to the same one from an earlier --out.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import time
+from typing import Dict, List
+
+import yaml
+
+from aronanet.protocol.messages import MessageType
+from aronanet.utils.metrics import Histogram
+
+from .loadgen import LoadClient, serve, server_process
+
+KINDS = ("text", "dm", "sup")
+PERCENTILES = {"p50": 50, "p90": 90, "p99": 99, "p99.9": 99.9}
+
+
+def raise_fd_limit():
+    """Thousands of sockets don't fit the usual soft limit of 1024"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    with contextlib.suppress(ValueError, OSError):
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def serve_unlimited(settings: dict, port_queue):
+    """serve() with the open file limit raised"""
+    raise_fd_limit()
+    serve(settings, port_queue)
+
+
+def proc_stats(pid: int) -> dict:
+    """CPU seconds and RSS of a process, empty without /proc"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/status") as f:
+            status = dict(line.split(":", 1) for line in f if ":" in line)
+
+    except OSError:
+        return {}
+
+    ticks = os.sysconf("SC_CLK_TCK")
+    return {
+        "cpu_s": (int(fields[11]) + int(fields[12])) / ticks,
+        "rss_mb": int(status["VmRSS"].split()[0]) / 1024,
+        "peak_rss_mb": int(status["VmHWM"].split()[0]) / 1024,
+    }
+
+
+def own_cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+class SwarmClient(LoadClient):
+    """LoadClient that also sends DMs and hops channels, timing what comes back"""
+    def __init__(self, port: int, index: int, seed: int):
+        super().__init__("127.0.0.1", port)
+        self.index = index
+        self.rng = random.Random(seed * 1_000_003 + index)
+        self.sup_sent = 0
+
+    async def pump(self, latency: Dict[str, Histogram], delivered: Dict[str, int]):
+        async for msg in self:
+            now = time.perf_counter_ns()
+            if msg.msg_type in (MessageType.TEXT, MessageType.DM):
+                kind = "text" if msg.msg_type == MessageType.TEXT else "dm"
+                latency[kind].record(now - int(msg.payload.split(b"] ", 1)[1]))
+                delivered[kind] += 1
+
+            elif msg.msg_type == MessageType.SUP and self.sup_sent:
+                latency["sup"].record(now - self.sup_sent)
+                delivered["sup"] += 1
+                self.sup_sent = 0
+
+    async def play(self, plan: List[str], names: List[str], channels: List[str], rate: float):
+        # Spread the first sends over one interval so the swarm isn't in lockstep
+        await asyncio.sleep(self.rng.random() / rate)
+        for kind in plan:
+            stamp = str(time.perf_counter_ns())
+            if kind == "text":
+                await self.send_text(stamp)
+
+            elif kind == "dm":
+                peer = self.rng.randrange(len(names) - 1)
+                peer += peer >= self.index
+                await self.dm(names[peer], stamp)
+
+            else:
+                self.sup_sent = time.perf_counter_ns()
+                await self.join(self.rng.choice(channels), wait=False)
+
+            await asyncio.sleep(1 / rate)
+
+
+async def run_swarm(port: int, pid: int, args, weights: List[float]) -> dict:
+    raise_fd_limit()
+    channels = ["general"] + [f"room{i}" for i in range(1, args.channels)]
+    names = [f"swarm{i}" for i in range(args.clients)]
+    swarm = [SwarmClient(port, i, args.seed) for i in range(args.clients)]
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        # In waves, so connecting doesn't overrun the listen backlog
+        for first in range(0, len(swarm), args.connect_batch):
+            await asyncio.gather(*(c.setup(names[c.index]) for c in swarm[first:first + args.connect_batch]))
+
+    # Pumps first, a full inbox would hold up the join confirmations
+    latency = {kind: Histogram() for kind in KINDS}
+    delivered = dict.fromkeys(KINDS, 0)
+    pumps = [asyncio.create_task(c.pump(latency, delivered)) for c in swarm]
+    await asyncio.gather(*(c.join(channels[c.index % len(channels)]) for c in swarm if c.index % len(channels)))
+    connect_s = time.perf_counter() - start
+    await asyncio.sleep(0.5)  # let ONLINE notifications settle
+
+    plans = [c.rng.choices(KINDS, weights, k=args.messages) if len(names) > 1 else ["text"] * args.messages
+             for c in swarm]
+    server_before, swarm_before = proc_stats(pid), own_cpu()
+    start = time.perf_counter()
+    await asyncio.gather(*(c.play(plan, names, channels, args.rate) for c, plan in zip(swarm, plans)))
+    sent_s = time.perf_counter() - start
+
+    # Tail of the fan-out: over after a second without deliveries, or 10s in all
+    last, last_change = sum(delivered.values()), time.perf_counter()
+    while time.perf_counter() - last_change < 1.0 and time.perf_counter() - start - sent_s < 10:
+        await asyncio.sleep(0.1)
+        if sum(delivered.values()) != last:
+            last, last_change = sum(delivered.values()), time.perf_counter()
+    delivered_s = last_change - start
+    wall = time.perf_counter() - start
+    server_after, swarm_after = proc_stats(pid), own_cpu()
+
+    await asyncio.gather(*(c.close() for c in swarm))
+    await asyncio.gather(*pumps)
+
+    sent = {kind: sum(plan.count(kind) for plan in plans) for kind in KINDS}
+    server = {}
+    if server_before and server_after:
+        server = {
+            "cpu_pct": (server_after["cpu_s"] - server_before["cpu_s"]) / wall * 100,
+            "rss_mb": server_after["rss_mb"],
+            "peak_rss_mb": server_after["peak_rss_mb"],
+        }
+
+    return {
+        "connect_s": connect_s,
+        "sent": sent,
+        "delivered": delivered,
+        "sent_per_sec": sum(sent.values()) / sent_s,
+        "delivered_per_sec": sum(delivered.values()) / delivered_s,
+        "latency_ms": {
+            kind: {name: h.percentile(q) * 1e3 for name, q in PERCENTILES.items()}
+            for kind, h in latency.items() if h.count
+        },
+        "server": server,
+        "swarm": {"cpu_pct": (swarm_after - swarm_before) / wall * 100},
+    }
+
+
+def parse_mix(mix: str) -> List[float]:
+    """text=80,dm=15,sup=5 -> weights in KINDS order, missing kinds are 0"""
+    weights = dict.fromkeys(KINDS, 0.0)
+    for part in mix.split(","):
+        kind, _, weight = part.partition("=")
+        if kind.strip() not in weights:
+            raise argparse.ArgumentTypeError(f"unknown message kind {kind!r}, pick from {', '.join(KINDS)}")
+        weights[kind.strip()] = float(weight)
+    if not any(weights.values()):
+        raise argparse.ArgumentTypeError("mix needs at least one non-zero weight")
+    return list(weights.values())
+
+
+def parse_setting(item: str):
+    key, _, value = item.partition("=")
+    return key, yaml.safe_load(value)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def flatten(tree: dict, prefix: str = "") -> Dict[str, float]:
+    out = {}
+    for key, value in tree.items():
+        if isinstance(value, dict):
+            out.update(flatten(value, f"{prefix}{key}."))
+        else:
+            out[prefix + key] = value
+    return out
+
+
+def show(result: dict, clients: int):
+    print(f"connect    {result['connect_s']:.2f} s for {clients} clients")
+    print(f"sent       {sum(result['sent'].values()):,} msgs, {result['sent_per_sec']:,.0f}/s  {result['sent']}")
+    print(f"delivered  {sum(result['delivered'].values()):,} msgs, {result['delivered_per_sec']:,.0f}/s")
+    print(f"{'latency ms':<10} " + " ".join(f"{name:>8}" for name in PERCENTILES))
+    for kind, row in result["latency_ms"].items():
+        print(f"  {kind:<8} " + " ".join(f"{value:>8.2f}" for value in row.values()))
+    server = result["server"]
+    if server:
+        print(f"server     cpu {server['cpu_pct']:.0f}%, rss {server['rss_mb']:.0f} MB "
+              f"(peak {server['peak_rss_mb']:.0f} MB)")
+    print(f"swarm      cpu {result['swarm']['cpu_pct']:.0f}%")
+
+
+def compare(result: dict, path: str):
+    with open(path, encoding="utf-8") as f:
+        base = flatten(json.load(f)["result"])
+
+    print(f"\n{'vs ' + path:<32} {'base':>12} {'now':>12} {'change':>8}")
+    for key, now in flatten(result).items():
+        before = base.get(key)
+        if before is None:
+            continue
+        change = f"{(now - before) / before * 100:+.1f}%" if before else ""
+        print(f"{key:<32} {before:>12,.2f} {now:>12,.2f} {change:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--channels", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=20, help="messages per client")
+    parser.add_argument("--rate", type=float, default=2.0, help="messages/sec per client")
+    parser.add_argument("--mix", type=parse_mix, default="text=80,dm=15,sup=5")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--engine", choices=("streams", "protocol"), default="streams")
+    parser.add_argument("--connect-batch", type=int, default=200, help="clients connecting at once")
+    parser.add_argument("--set", type=parse_setting, action="append", default=[], metavar="KEY=VALUE",
+                        help="extra server setting, value parsed as YAML (repeatable)")
+    parser.add_argument("--out", help="write the run as JSON here")
+    parser.add_argument("--compare", metavar="JSON", help="an earlier --out to compare against")
+    args = parser.parse_args()
+
+    settings = {"engine": args.engine, **dict(args.set)}
+    with server_process(serve_unlimited, **settings) as (proc, port):
+        result = asyncio.run(run_swarm(port, proc.pid, args, args.mix))
+
+    show(result, args.clients)
+    if args.compare:
+        compare(result, args.compare)
+
+    if args.out:
+        run = {
+            "args": {**{k: v for k, v in vars(args).items() if k not in ("set", "out", "compare")},
+                     "mix": dict(zip(KINDS, args.mix))},
+            "settings": settings,
+            "env": {"python": platform.python_version(), "platform": platform.platform(),
+                    "cpus": os.cpu_count(), "commit": git_commit()},
+            "result": result,
+        }
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(run, f, indent=2)
+        print(f"\nWrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
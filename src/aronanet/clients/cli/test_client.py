@@ -3,85 +3,148 @@
 # SPAM `ctrl+c` TO EXIT!!!!!!!
 
 import asyncio
+import os
 import sys
-from aronanet.protocol.messages import Message, MessageType
-from aronanet.protocol.crypto import SecureChannel, KeyExchange
+from pathlib import Path
+from typing import Optional
+from aronanet.clients.client import AronaClient, AuthFailed
+from aronanet.protocol.messages import Message, MessageType, parse_history
+from aronanet.protocol.transfer import (
+    ABORT, IncomingTransfer, OutgoingTransfer, DEFAULT_CHUNK, parse_chunk, parse_start
+)
+from aronanet.utils.config import AronaSettings
+from aronanet.utils.loop import run
+from aronanet.utils.logger import set_level
 
 class SimpleClient:
-    def __init__(self, host: str, port: int):
+    """input()/print() front end, the protocol side is all AronaClient"""
+    def __init__(self, host: str, port: int, chunk_size: int = DEFAULT_CHUNK, window: int = 8,
+                 compression: str = "auto"):
         self.host = host
         self.port = port
-        self.reader = None
-        self.writer = None
-        self.secure_channel = SecureChannel()
-        self.key_exchange = KeyExchange()
-        self.username = None
+        self.compression = compression
+        self.chunk_size = chunk_size
+        self.window = window
+        self.client: Optional[AronaClient] = None
+        self.last_seq = {}  # channel -> newest HISTORY seq we've seen
+        # Channel the HISTORY frames we're reading belong to. HISTORY doesn't name it and
+        # client.channel moves on as soon as we ask to join, so follow the SUP confirms in order
+        self.history_channel = "general"
+        self.uploads = {}  # our transfer id -> OutgoingTransfer
+        self.downloads = {}  # server transfer id -> IncomingTransfer
+        self.download_dir = Path.home() / "AronaNET" / "downloads"
+        self._next_upload = 0
         self.running = False
         self._receiver_task = None
         self._input_task = None
 
-    async def connect(self):
-        print(f"[*] Connecting to {self.host}:{self.port}...")
-        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
-        print("[✓] Connected")
-
-    async def handshake(self):
-        print("[*] Starting handshake...")
-        our_pubkey = self.key_exchange.get_public_bytes()
-        hi_msg = Message(msg_type=MessageType.HI, payload=our_pubkey)
-        packed = hi_msg.pack()
-
-        self.writer.write(len(packed).to_bytes(4, 'big') + packed)
-        await self.writer.drain()
-
-        length = await self.reader.readexactly(4)
-        data = await self.reader.readexactly(int.from_bytes(length, 'big'))
-        server_hi = Message.unpack(data)
-
-        if server_hi.msg_type != MessageType.HI:
-            raise Exception(f"Expected HI, got {server_hi.msg_type.name}")
+    @property
+    def channel(self) -> str:
+        return self.client.channel if self.client else "general"
+
+    async def request_history(self):
+        """Ask for whatever our channel got since the last seq we saw"""
+        await self.client.request_history(self.last_seq.get(self.history_channel, 0))
+
+    def show_history(self, msg: Message):
+        head, records = parse_history(msg.payload)
+        seen = self.last_seq.get(self.history_channel, 0)
+        for seq, _, payload in records:
+            # A head behind what we saw means the server restarted (or we're on another worker), show it all
+            if seq > seen or head < seen:
+                print(f"\r{payload.decode()}\n>>> ", end='', flush=True)
+        self.last_seq[self.history_channel] = head
+
+    async def send_file(self, path: str):
+        """Announce the file with IMAGE, then stream it as the acks come back"""
+        self._next_upload += 1
+        upload = OutgoingTransfer(self._next_upload, Path(path).expanduser(), self.chunk_size, self.window)
+        self.uploads[upload.transfer_id] = upload
+        print(f"[*] Sending {upload.path.name} ({upload.size} bytes)...")
+        await self.write_msgs([upload.start_message()] + upload.ready_chunks())
+        if upload.done:
+            del self.uploads[upload.transfer_id]  # empty file, there's nothing to ack
+
+    async def write_msgs(self, msgs):
+        for msg in msgs:
+            await self.client.send(msg)
+
+    async def on_chunk_ack(self, msg: Message):
+        tid, index, _ = parse_chunk(msg.payload)
+        upload = self.uploads.get(tid)
+        if not upload:
+            return
+
+        upload.ack(index)
+        if upload.aborted:
+            print(f"\r[!] Server refused {upload.path.name}\n>>> ", end='', flush=True)
+        elif upload.done:
+            print(f"\r[✓] Sent {upload.path.name}\n>>> ", end='', flush=True)
+        else:
+            await self.write_msgs(upload.ready_chunks())
+            return
+        del self.uploads[tid]
+
+    def on_image(self, msg: Message):
+        tid, size, digest, chunk_size, name = parse_start(msg.payload)
+        sender, _, filename = name.partition("] ")
+        path = self.download_dir / Path(filename).name
+        print(f"\r{sender}] is sending {path.name} ({size} bytes)\n>>> ", end='', flush=True)
+        download = IncomingTransfer(path, size, digest, chunk_size)
+        if size == 0:
+            download.finish()
+            return
+        self.downloads[tid] = download
+
+    def on_chunk(self, msg: Message):
+        tid, index, data = parse_chunk(msg.payload)
+        download = self.downloads.get(tid)
+        if not download:
+            return
+
+        if index == ABORT:
+            download.abort()
+            print(f"\r[!] Transfer of {download.path.name} was cancelled\n>>> ", end='', flush=True)
+            del self.downloads[tid]
+            return
 
-        shared_key = self.key_exchange.derive_shared_key(server_hi.payload)
-        self.secure_channel.setup_shared_key(shared_key)
-        print("[✓] Handshake complete")
+        try:
+            if download.write(index, data):
+                print(f"\r[✓] Saved {download.path}\n>>> ", end='', flush=True)
+                del self.downloads[tid]
+        except ValueError as e:
+            print(f"\r[!] {e}\n>>> ", end='', flush=True)
+            del self.downloads[tid]
 
-    async def authenticate(self, username: str):
-        print(f"[*] Authenticating as '{username}'...")
-        auth_msg = Message(msg_type=MessageType.AUTH, payload=username.encode())
-        packed = auth_msg.pack(self.secure_channel)
+    async def receive_messages(self):
+        try:
+            async for msg in self.client:
+                if msg.msg_type == MessageType.TEXT:
+                    print(f"\r{msg.payload.decode()}\n>>> ", end='', flush=True)
 
-        self.writer.write(len(packed).to_bytes(4, 'big') + packed)
-        await self.writer.drain()
+                elif msg.msg_type == MessageType.CHUNK:
+                    self.on_chunk(msg)
 
-        length = await self.reader.readexactly(4)
-        data = await self.reader.readexactly(int.from_bytes(length, 'big'))
-        reply = Message.unpack(data, self.secure_channel)
+                elif msg.msg_type == MessageType.CHUNK_ACK:
+                    await self.on_chunk_ack(msg)
 
-        if reply.msg_type == MessageType.AUTH_OK:
-            self.username = username
-            print(f"[✓] {reply.payload.decode()}")
-            return True
+                elif msg.msg_type == MessageType.IMAGE:
+                    self.on_image(msg)
 
-        else:
-            print(f"[!] Auth failed: {reply.payload.decode()}")
-            return False
+                elif msg.msg_type == MessageType.HISTORY:
+                    self.show_history(msg)
 
-    async def send_text(self, text: str):
-        msg = Message(msg_type=MessageType.TEXT, payload=text.encode())
-        packed = msg.pack(self.secure_channel)
+                elif msg.msg_type == MessageType.SUP:
+                    if msg.payload.startswith(b"Refused #"):
+                        print(f"\r[!] Server refused that channel name\n>>> ", end='', flush=True)
+                    else:
+                        self.history_channel = msg.payload.decode().removeprefix("Joined #")
+                        await self.request_history()
 
-        self.writer.write(len(packed).to_bytes(4, 'big') + packed)
-        await self.writer.drain()
-
-    async def receive_messages(self):
-        try:
-            while self.running:
-                length = await self.reader.readexactly(4)
-                data = await self.reader.readexactly(int.from_bytes(length, 'big'))
-                msg = Message.unpack(data, self.secure_channel)
-
-                if msg.msg_type == MessageType.TEXT:
-                    print(f"\r{msg.payload.decode()}\n>>> ", end='', flush=True)
+                elif msg.msg_type == MessageType.TYPING:
+                    typers = [u for u in msg.payload.decode().split("\n") if u and u != self.client.username]
+                    if typers:
+                        print(f"\r[...] {', '.join(typers)} typing\n>>> ", end='', flush=True)
 
                 elif msg.msg_type == MessageType.DM:
                     print(f"\r[DM: {msg.payload.decode()}]\n>>> ", end='', flush=True)
@@ -90,7 +153,6 @@ class SimpleClient:
                     prefix = "[+]" if msg.msg_type == MessageType.ONLINE else "[-]"
                     print(f"\r{prefix} {msg.payload.decode()}\n>>> ", end='', flush=True)
 
-        except asyncio.IncompleteReadError:
             print("\n[!] Server disconnected")
 
         except asyncio.CancelledError:
@@ -101,6 +163,22 @@ class SimpleClient:
 
         finally:
             self.running = False
+            for download in self.downloads.values():
+                download.abort()
+
+    async def on_disconnected(self):
+        print("\r[!] Connection lost, reconnecting...\n>>> ", end='', flush=True)
+        # Transfers don't survive the socket
+        for download in self.downloads.values():
+            download.abort()
+        self.downloads.clear()
+        self.uploads.clear()
+
+    async def on_reconnected(self, resumed: bool):
+        print(f"\r[✓] Reconnected{' (resumed)' if resumed else ''}\n>>> ", end='', flush=True)
+        # A new session starts in #general, the re-join's confirm moves us on from there
+        self.history_channel = self.channel if resumed else "general"
+        await self.request_history()
 
     async def input_loop(self):
         loop = asyncio.get_event_loop()
@@ -117,7 +195,7 @@ class SimpleClient:
                     await self.handle_command(text)
 
                 else:
-                    await self.send_text(text)
+                    await self.client.send_text(text)
         except asyncio.CancelledError:
             pass
 
@@ -133,13 +211,7 @@ class SimpleClient:
 
                 return
             channel = parts[1].strip()
-
-            msg = Message(msg_type=MessageType.SUP, payload=channel.encode())
-            packed = msg.pack(self.secure_channel)
-
-            self.writer.write(len(packed).to_bytes(4, 'big') + packed)
-            await self.writer.drain()
-
+            await self.client.join(channel, wait=False)
             print(f"[*] Joining #{channel}...")
 
         elif cmd.startswith('/dm '):
@@ -149,14 +221,14 @@ class SimpleClient:
                 return
 
             _, user, usr_msg = parts
+            await self.client.dm(user, usr_msg)
 
-            formatted = f'{user}:{usr_msg}'
-            msg = Message(msg_type=MessageType.DM, payload=formatted.encode())
-
-            packed = msg.pack(self.secure_channel)
-
-            self.writer.write(len(packed).to_bytes(4, 'big') + packed)
-            await self.writer.drain()
+        elif cmd.startswith('/img ') or cmd.startswith('/send '):
+            path = cmd.split(maxsplit=1)[1].strip()
+            if not os.path.isfile(os.path.expanduser(path)):
+                print(f"[!] No such file: {path}")
+                return
+            await self.send_file(path)
 
         elif cmd == '/clear' or cmd == '/cl':
             print("\033[2J\033[3J\033[1;1H", end='', flush=True)
@@ -165,13 +237,16 @@ class SimpleClient:
             print(f"[!] Unknown command: {cmd}")
 
     async def run(self, username: str):
+        self.client = AronaClient(self.host, self.port, username, compression=self.compression)
+        self.client.on_disconnected = self.on_disconnected
+        self.client.on_reconnected = self.on_reconnected
         try:
-            await self.connect()
-            await self.handshake()
-            if not await self.authenticate(username):
-                return
+            print(f"[*] Connecting to {self.host}:{self.port} as '{username}'...")
+            await self.client.connect()
+            print(f"[✓] Connected (wire v{self.client.version})")
 
             self.running = True
+            await self.request_history()
             self._receiver_task = asyncio.create_task(self.receive_messages())
             self._input_task = asyncio.create_task(self.input_loop())
 
@@ -182,6 +257,9 @@ class SimpleClient:
         except ConnectionRefusedError:
             print("[!] Connection refused - is server running?")
 
+        except AuthFailed as e:
+            print(f"[!] Auth failed: {e}")
+
         except Exception as e:
             print(f"[!] Error: {e}")
 
@@ -203,16 +281,11 @@ class SimpleClient:
         if tasks:
             await asyncio.gather(*tasks, return_exceptions=True)
 
-        if self.writer:
-            self.writer.close()
-            try:
-                await self.writer.wait_closed()
-
-            except Exception:
-                pass
+        if self.client:
+            await self.client.close()
         print("[*] Client cleanup complete")
 
-async def _main():
+async def _main(settings: AronaSettings):
     if len(sys.argv) != 3:
         print("Usage: aonet-client HOST PORT")
         sys.exit(1)
@@ -223,12 +296,17 @@ async def _main():
         print("[!] Username required")
         sys.exit(1)
 
-    client = SimpleClient(host, port)
+    client = SimpleClient(
+        host, port, settings.get("chunk_size", DEFAULT_CHUNK), settings.get("transfer_window", 8),
+        settings.get("compression", "auto")
+    )
     await client.run(username)
 
 def main():
     try:
-        asyncio.run(_main())
+        settings = AronaSettings()
+        set_level(settings.get("log_level", "INFO"))
+        run(_main(settings), settings.get("loop", "auto"))
 
     except KeyboardInterrupt:
         print("\n[*] Exiting...")
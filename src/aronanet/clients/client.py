@@ -0,0 +1,375 @@
+import asyncio
+import os
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from ..protocol.messages import (
+    Message, MessageType, PROTOCOL_VERSION, CAP_COUNTER_NONCE, CAP_RESUME, RESUME_RANDOM, hi_payload, parse_hi
+)
+from ..protocol.crypto import SecureChannel, KeyExchange, GroupKey
+from ..protocol.compression import compressor_for, supported_caps
+from ..protocol.framing import DEFAULT_MAX_FRAME, FrameReader, open_frame_connection
+from ..utils.logger import get_logger
+
+logger = get_logger("AronaClient")
+
+class AuthFailed(Exception):
+    """The server answered AUTH with AUTH_FAIL, the payload is the reason"""
+
+
+class AronaClient:
+    """
+    Headless AoNET client for bots, the TUI and load tests
+
+        async with AronaClient(host, port, "arona") as client:
+            await client.join("lobby")
+            await client.send_text("hi")
+            async for msg in client:
+                ...
+
+    Handles the handshake, AUTH, session tickets, PING, group keys and
+    reconnects, and hands everything else to the async iterator (GROUP
+    frames arrive already opened). Sends are pipelined: frames queued in
+    the same loop tick go out in one write, and send() only waits when
+    `flush_bytes` are buffered or the socket is backed up.
+
+    A dropped connection is retried with backoff, resuming the session
+    with the last ticket when there is one and re-joining the channel when
+    not. Frames not written before a drop are lost, sends are at most once.
+    Iteration ends when the client is closed or gives up reconnecting.
+    """
+    def __init__(self, host: str, port: int, username: str = "", compression: str = "auto",
+                 reconnect: bool = True, reconnect_delay: float = 1.0, max_reconnect_delay: float = 30.0,
+                 max_frame_size: int = DEFAULT_MAX_FRAME, flush_bytes: int = 64 * 1024, inbox_size: int = 1024):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.compression = supported_caps(compression)
+        self.reconnect = reconnect
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.max_frame_size = max_frame_size
+        self.flush_bytes = flush_bytes
+
+        self.conn: Optional[FrameReader] = None
+        self.secure_channel = SecureChannel()
+        self.version = 1
+        self.channel = "general"
+        self.session = None  # (ticket, secret) from the server's last TICKET
+        self.group_keys: Dict[bytes, GroupKey] = {}
+        self.connected = asyncio.Event()
+        self.reconnects = 0
+
+        # Optional callbacks, e.g. for the TUI to say what's going on
+        self.on_disconnected: Optional[Callable[[], Awaitable[None]]] = None
+        self.on_reconnected: Optional[Callable[[bool], Awaitable[None]]] = None
+
+        self._inbox: asyncio.Queue = asyncio.Queue(maxsize=inbox_size)
+        self._out = bytearray()
+        self._flush_handle: Optional[asyncio.Handle] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._joins: Dict[str, List[asyncio.Future]] = {}
+        self._closed = False
+
+    async def __aenter__(self) -> "AronaClient":
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    # Connecting
+
+    async def connect(self):
+        """Connect and log in, raises AuthFailed if the server refuses the name"""
+        await self._open()
+        self._reader_task = asyncio.create_task(self._read_loop())
+
+    async def _open(self) -> bool:
+        """New socket + session, True if an old session was resumed"""
+        self.conn = await open_frame_connection(self.host, self.port, self.max_frame_size)
+        self._out = bytearray()
+        self.group_keys.clear()
+
+        try:
+            resumed = bool(self.session) and await self._resume()
+            if not resumed:
+                await self._handshake()
+                await self._authenticate()
+
+        except BaseException:
+            self.conn.close()
+            raise
+
+        self.connected.set()
+        return resumed
+
+    async def _write_now(self, msg: Message, encrypted: bool = True):
+        """Handshake-time write, before the pipelined path is up (HI and RESUME carry their own version)"""
+        packed = msg.pack(self.secure_channel, self.version) if encrypted else msg.pack()
+        self.conn.write(len(packed).to_bytes(4, "big") + packed)
+        await self.conn.drain()
+
+    async def _handshake(self):
+        self.secure_channel = SecureChannel()
+        key_exchange = KeyExchange()
+        hi = Message(
+            version=PROTOCOL_VERSION,
+            msg_type=MessageType.HI,
+            payload=hi_payload(key_exchange.get_public_bytes(), PROTOCOL_VERSION,
+                               CAP_COUNTER_NONCE | CAP_RESUME | self.compression)
+        )
+        await self._write_now(hi, encrypted=False)
+
+        reply = Message.unpack(await self.conn.read_frame())
+        if reply.msg_type != MessageType.HI:
+            raise ConnectionError(f"Expected HI, got {reply.msg_type.name}")
+
+        server_pubkey, caps = parse_hi(reply.payload)
+        shared_key = key_exchange.derive_shared_key(server_pubkey)
+        if caps & CAP_COUNTER_NONCE:
+            self.secure_channel.setup_session_keys(shared_key, is_server=False)
+        else:
+            self.secure_channel.setup_shared_key(shared_key)
+        self.secure_channel.compressor = compressor_for(caps)
+        self.version = min(reply.version, PROTOCOL_VERSION)
+
+    async def _resume(self) -> bool:
+        """Skip HI + AUTH with the last ticket, False means carry on with a full handshake on this socket"""
+        ticket, secret = self.session
+        self.session = None
+        client_random = os.urandom(RESUME_RANDOM)
+        await self._write_now(
+            Message(version=PROTOCOL_VERSION, msg_type=MessageType.RESUME, payload=client_random + ticket),
+            encrypted=False
+        )
+
+        reply = Message.unpack(await self.conn.read_frame())
+        if reply.msg_type != MessageType.RESUME or len(reply.payload) <= RESUME_RANDOM:
+            logger.info(f"Server refused the ticket for {self.username}, doing a full handshake :|")
+            return False
+
+        server_random, caps = reply.payload[:RESUME_RANDOM], reply.payload[RESUME_RANDOM]
+        self.secure_channel = SecureChannel()
+        self.secure_channel.setup_resumed_keys(
+            secret, client_random + server_random, bool(caps & CAP_COUNTER_NONCE), is_server=False
+        )
+        self.secure_channel.compressor = compressor_for(caps)
+        self.version = min(reply.version, PROTOCOL_VERSION)
+
+        reply = Message.unpack(await self.conn.read_frame(), self.secure_channel)
+        if reply.msg_type != MessageType.AUTH_OK:
+            raise ConnectionError(f"Expected AUTH_OK, got {reply.msg_type.name}")
+        return True
+
+    async def _authenticate(self):
+        await self._write_now(Message(msg_type=MessageType.AUTH, payload=self.username.encode()))
+        reply = Message.unpack(await self.conn.read_frame(), self.secure_channel)
+        if reply.msg_type != MessageType.AUTH_OK:
+            raise AuthFailed(reply.payload.decode(errors="replace"))
+
+    async def _reconnect(self) -> bool:
+        """Retry with backoff until connected, False once closed or the name is refused"""
+        delay = self.reconnect_delay
+        while not self._closed:
+            await asyncio.sleep(delay)
+            try:
+                resumed = await self._open()
+
+            except AuthFailed as e:
+                logger.warning(f"Reconnected but AUTH failed for {self.username}: {e} :(")
+                return False
+
+            except (OSError, asyncio.IncompleteReadError, ConnectionError) as e:
+                logger.info(f"Reconnect to {self.host}:{self.port} failed: {e}, retrying in {delay:.0f}s :/")
+                delay = min(delay * 2, self.max_reconnect_delay)
+                continue
+
+            self.reconnects += 1
+            if not resumed and self.channel != "general":
+                # A fresh session starts in #general
+                self._queue(Message(msg_type=MessageType.SUP, payload=self.channel.encode()))
+            logger.info(f"Reconnected {self.username} ({'resumed' if resumed else 'new session'}) :3")
+            if self.on_reconnected:
+                await self.on_reconnected(resumed)
+            return True
+
+        return False
+
+    # Receiving
+
+    async def _read_loop(self):
+        try:
+            while True:
+                try:
+                    while True:
+                        msg = self._handle(Message.unpack(await self.conn.read_frame(), self.secure_channel))
+                        if msg is not None:
+                            await self._inbox.put(msg)
+
+                except asyncio.CancelledError:
+                    raise
+
+                except Exception as e:
+                    if not self._closed:
+                        logger.info(f"Lost connection to {self.host}:{self.port}: {e!r} :/")
+
+                self.connected.clear()
+                self.conn.close()
+                if self._closed or not self.reconnect:
+                    break
+                if self.on_disconnected:
+                    await self.on_disconnected()
+                if not await self._reconnect():
+                    break
+
+        finally:
+            self._closed = True
+            self.connected.set()  # wake senders waiting on a reconnect, they'll see _closed
+            for waiters in self._joins.values():
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_exception(ConnectionError("Client is closed"))
+            self._joins.clear()
+            self._end_inbox()
+
+    def _end_inbox(self):
+        try:
+            self._inbox.put_nowait(None)
+        except asyncio.QueueFull:
+            # Consumer is behind, make room for the end marker
+            self._inbox.get_nowait()
+            self._inbox.put_nowait(None)
+
+    def _handle(self, msg: Message) -> Optional[Message]:
+        """Deal with protocol housekeeping, returns what the caller should see"""
+        if msg.msg_type == MessageType.TICKET:
+            self.session = (msg.payload, self.secure_channel.resumption_secret())
+            return None
+
+        if msg.msg_type == MessageType.PING:
+            self._queue(Message(msg_type=MessageType.PONG, payload=msg.payload))
+            return None
+
+        if msg.msg_type == MessageType.GROUP_KEY:
+            key, _ = GroupKey.from_payload(msg.payload)
+            self.group_keys[key.key_id] = key
+            return None
+
+        if msg.msg_type == MessageType.GROUP:
+            key = self.group_keys.get(msg.payload[:4])
+            if not key:
+                return None
+            inner_type, inner_payload = key.open(msg.payload)
+            return Message(msg_type=MessageType(inner_type), payload=inner_payload)
+
+        if msg.msg_type == MessageType.SUP:
+            text = msg.payload.decode(errors="replace")
+            if text.startswith("Refused #"):
+                channel = text.removeprefix("Refused #")
+                for waiter in self._joins.pop(channel, ()):
+                    if not waiter.done():
+                        waiter.set_exception(ValueError(f"Server refused channel name {channel!r}"))
+                return msg
+
+            channel = text.removeprefix("Joined #")
+            self.channel = channel
+            for waiter in self._joins.pop(channel, ()):
+                if not waiter.done():
+                    waiter.set_result(None)
+
+        return msg
+
+    def __aiter__(self) -> "AronaClient":
+        return self
+
+    async def __anext__(self) -> Message:
+        msg = await self._inbox.get()
+        if msg is None:
+            self._inbox.put_nowait(None)  # any other iterator ends too
+            raise StopAsyncIteration
+        return msg
+
+    # Sending
+
+    def _queue(self, msg: Message):
+        """Pack msg onto the pending buffer, written at the end of this loop tick"""
+        packed = msg.pack(self.secure_channel, self.version)
+        self._out += len(packed).to_bytes(4, "big")
+        self._out += packed
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_soon(self._flush)
+
+    def _flush(self):
+        self._flush_handle = None
+        if self._out and self.conn and not self.conn.transport.is_closing():
+            # Hand the buffer over whole, the transport may hold on to it
+            self.conn.write(self._out)
+        self._out = bytearray()
+
+    async def send(self, msg: Message):
+        """Queue msg for the server, waits while reconnecting or when the socket is backed up"""
+        while not self.connected.is_set():
+            await self.connected.wait()
+        if self._closed:
+            raise ConnectionError("Client is closed")
+
+        self._queue(msg)
+        if len(self._out) >= self.flush_bytes:
+            self._flush()
+            await self.conn.drain()
+
+    async def flush(self):
+        """Write whatever is queued now and wait for the socket to take it"""
+        self._flush()
+        if self.conn:
+            await self.conn.drain()
+
+    async def send_text(self, text: str):
+        await self.send(Message(msg_type=MessageType.TEXT, payload=text.encode()))
+
+    async def dm(self, username: str, text: str):
+        await self.send(Message(msg_type=MessageType.DM, payload=f"{username}:{text}".encode()))
+
+    async def join(self, channel: str, wait: bool = True):
+        """Switch channel, by default returning once the server confirms (ValueError if it refuses the name)"""
+        waiter = None
+        if wait:
+            waiter = asyncio.get_running_loop().create_future()
+            self._joins.setdefault(channel, []).append(waiter)
+        previous, self.channel = self.channel, channel  # so a reconnect re-joins it even before the confirmation
+        await self.send(Message(msg_type=MessageType.SUP, payload=channel.encode()))
+        if waiter:
+            try:
+                await waiter
+            except ValueError:
+                if self.channel == channel:
+                    self.channel = previous
+                raise
+
+    async def typing(self):
+        await self.send(Message(msg_type=MessageType.TYPING))
+
+    async def request_history(self, since: int = 0):
+        """HISTORY for the current channel, everything after seq `since`"""
+        await self.send(Message(msg_type=MessageType.HISTORY, payload=since.to_bytes(8, "big")))
+
+    async def close(self):
+        """Say ADIOS if still connected, then stop reading and close the socket"""
+        if self.connected.is_set() and not self._closed:
+            self._queue(Message(msg_type=MessageType.ADIOS))
+            self._flush()
+        self._closed = True
+
+        if self._reader_task and not self._reader_task.done():
+            self._reader_task.cancel()
+            await asyncio.gather(self._reader_task, return_exceptions=True)
+        else:
+            self.connected.set()
+            self._end_inbox()
+
+        if self.conn:
+            self.conn.close()
+            try:
+                await self.conn.wait_closed()
+            except Exception:
+                pass
@@ -6,12 +6,13 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
 from src.aronanet.protocol.messages import Message, MessageType
+from src.aronanet.protocol.framing import open_frame_connection
 
 async def run_client(host, port):
     print(f"[*] Connecting to {host}:{port}")
 
     try:
-        reader, writer = await asyncio.open_connection(host, port)
+        reader = writer = await open_frame_connection(host, port)
         print("[✓] Connected!")
 
         # Initial message
@@ -23,9 +24,7 @@ async def run_client(host, port):
 
         # Read server response properly
         while True:
-            resp_len_bytes = await reader.readexactly(4)
-            resp_len = int.from_bytes(resp_len_bytes, 'big')
-            resp_data = await reader.readexactly(resp_len)
+            resp_data = await reader.read_frame()
             resp_msg = Message.unpack(resp_data)
             print(f"[<] {resp_msg.payload.decode()}")
 
@@ -0,0 +1,142 @@
+import zlib
+from abc import ABC, abstractmethod
+from typing import Optional
+
+from .messages import CAP_ZLIB, CAP_ZSTD
+from ..utils.logger import get_logger
+
+logger = get_logger("Compression")
+
+COMPRESSIONS = ("auto", "zstd", "zlib", "off")
+
+# Both sides prime every message with this, so even a short line compresses.
+# Strings the server itself sends go last, deflate finds the end of a dictionary cheapest.
+PRESET_DICT = (
+    b"the be to of and a in that have I it for not on with he as you do at this but his by from they we say "
+    b"her she or an will my one all would there their what so up out if about who get which go me when make "
+    b"can like time no just him know take people into year your good some could them see other than then now "
+    b"look only come its over think also back after use two how our work first well way even new want because "
+    b"any these give day most us is are was were been has had did does doing lol lmao ok okay yeah yes nah "
+    b"thanks thank you please sorry hello hi hey bye gn gm brb idk imo tbh btw haha :) :( :3 :/ :| xD "
+    b"what's that's it's I'm don't can't won't didn't isn't you're they're let's ? ! ... "
+    b"https://www. .com .png .jpg github "
+    b"Welcome ! Joined #general Joined # left joined ] [ "
+)
+
+
+class Compressor(ABC):
+    """
+    Compresses message payloads one by one, before encryption
+
+    Every message stands alone (fresh stream, shared preset dictionary), so
+    the same compressed body can go to every recipient of a broadcast and a
+    lost or reordered frame doesn't break the next one.
+    """
+    cap = 0
+    name = "none"
+
+    def __init__(self, min_size: int = 64, max_size: int = 16 * 1024 * 1024):
+        self.min_size = min_size
+        self.max_size = max_size
+
+    @abstractmethod
+    def compress(self, data: bytes) -> Optional[bytes]:
+        """Compressed data, or None when it isn't smaller"""
+
+    @abstractmethod
+    def decompress(self, data: bytes) -> bytes:
+        """Original data, ValueError if it's corrupt or decompresses past max_size"""
+
+
+class ZlibCompressor(Compressor):
+    """Raw deflate with PRESET_DICT, always available"""
+    cap = CAP_ZLIB
+    name = "zlib"
+
+    # 4 KiB window and memLevel 4: chat lines don't need more, and setting up the
+    # default 32 KiB / memLevel 8 state costs several times the compression itself
+    # at this size. Copying a primed stream beats loading the dictionary each time.
+    WBITS = -12
+    _template = zlib.compressobj(6, zlib.DEFLATED, WBITS, 4, zlib.Z_DEFAULT_STRATEGY, PRESET_DICT)
+
+    def compress(self, data: bytes) -> Optional[bytes]:
+        stream = self._template.copy()
+        out = stream.compress(data) + stream.flush()
+        return out if len(out) < len(data) else None
+
+    def decompress(self, data: bytes) -> bytes:
+        stream = zlib.decompressobj(self.WBITS, PRESET_DICT)
+        out = stream.decompress(data, self.max_size)
+        if stream.unconsumed_tail or not stream.eof:
+            raise ValueError("Bad or oversized compressed payload :(")
+        return out
+
+
+class ZstdCompressor(Compressor):
+    """zstd with PRESET_DICT as a raw-content dictionary, needs `zstandard` (the `fast` extra)"""
+    cap = CAP_ZSTD
+    name = "zstd"
+
+    def __init__(self, min_size: int = 64, max_size: int = 16 * 1024 * 1024):
+        super().__init__(min_size, max_size)
+        import zstandard
+
+        dictionary = zstandard.ZstdCompressionDict(PRESET_DICT, dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+        self._compressor = zstandard.ZstdCompressor(
+            level=3, dict_data=dictionary, write_checksum=False, write_dict_id=False
+        )
+        self._decompressor = zstandard.ZstdDecompressor(dict_data=dictionary)
+
+    def compress(self, data: bytes) -> Optional[bytes]:
+        out = self._compressor.compress(data)
+        return out if len(out) < len(data) else None
+
+    def decompress(self, data: bytes) -> bytes:
+        try:
+            return self._decompressor.decompress(data, max_output_size=self.max_size)
+        except Exception as e:
+            raise ValueError(f"Bad compressed payload: {e} :(")
+
+
+def supported_caps(setting: str = "auto") -> int:
+    """
+    Compression capability bits for the `compression` setting
+
+    auto: zstd if it's installed, plus zlib for clients without it
+    zstd: same, but warns when it isn't there
+    """
+    if setting not in COMPRESSIONS:
+        logger.warning(f"Unknown compression '{setting}', turning it off :/")
+        return 0
+
+    if setting == "off":
+        return 0
+
+    if setting == "zlib":
+        return CAP_ZLIB
+
+    try:
+        import zstandard
+
+    except ImportError:
+        if setting == "zstd":
+            logger.warning("zstandard not installed, using zlib :/")
+        return CAP_ZLIB
+
+    return CAP_ZSTD | CAP_ZLIB
+
+
+def agree(caps: int) -> int:
+    """Keep only one compression bit of the agreed caps, zstd wins"""
+    if caps & CAP_ZSTD:
+        return caps & ~CAP_ZLIB
+    return caps
+
+
+def compressor_for(caps: int, min_size: int = 64, max_size: int = 16 * 1024 * 1024) -> Optional[Compressor]:
+    """Compressor for the agreed caps, None when compression is off"""
+    if caps & CAP_ZSTD:
+        return ZstdCompressor(min_size, max_size)
+    if caps & CAP_ZLIB:
+        return ZlibCompressor(min_size, max_size)
+    return None
@@ -1,17 +1,36 @@
 from cryptography.hazmat.primitives.asymmetric import x25519
 from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
-from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives import serialization, hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from typing import Optional, Set
 import os
+import time
 
 from ..utils.logger import get_logger
+from ..utils.metrics import registry
 
 logger = get_logger("Crypto")
 
+DECRYPT = registry.histogram("aronanet_decrypt_seconds", "AEAD open per received frame")
+
+# Only newer cryptography releases have AEAD.encrypt_into, checked once instead of on every frame
+ENCRYPT_INTO = hasattr(ChaCha20Poly1305, "encrypt_into")
+
 class SecureChannel:
     """Encryption channel for one connection"""
     def __init__(self):
         self.cipher = None
+        self.recv_cipher = None
         self.shared_key = None
+
+        # Counter mode: implicit per-direction nonces, nothing sent on the wire
+        self.counter_nonces = False
+        self.nonce_size = 12
+        self.send_counter = 0
+        self.recv_counter = 0
+
+        # Set once compression is agreed, Message compresses before encrypting with it
+        self.compressor = None
         logger.debug("SecureChannel init :3")
 
     def setup_shared_key(self, shared_key: bytes):
@@ -22,31 +41,122 @@ class SecureChannel:
 
         self.shared_key = shared_key[:32]
         self.cipher = ChaCha20Poly1305(self.shared_key)
+        self.recv_cipher = self.cipher
         logger.info("Cipher init with shared key :3")
 
-    def encrypt(self, data: bytes) -> tuple[bytes, bytes]:
-        """Encrypt payload -> (nonce, ciphertext)"""
+    def setup_session_keys(self, shared_key: bytes, is_server: bool):
+        """
+        Initialize counter-nonce mode: one HKDF-derived key per direction
+
+        Each side numbers the frames it sends from 0 and the peer expects
+        exactly the next number, so replayed, dropped or reordered frames
+        fail authentication instead of being accepted.
+        """
+        if len(shared_key) < 32:
+            logger.error("Shared key too short :(")
+            raise ValueError("Shared key too short :(")
+
+        c2s = _hkdf(shared_key, b"AronaNET c2s")
+        s2c = _hkdf(shared_key, b"AronaNET s2c")
+        send_key, recv_key = (s2c, c2s) if is_server else (c2s, s2c)
+
+        self.shared_key = shared_key
+        self.cipher = ChaCha20Poly1305(send_key)
+        self.recv_cipher = ChaCha20Poly1305(recv_key)
+        self.counter_nonces = True
+        self.nonce_size = 0
+        self.send_counter = 0
+        self.recv_counter = 0
+        logger.info("Cipher init with per-direction keys and counter nonces :3")
+
+    def setup_resumed_keys(self, secret: bytes, randoms: bytes, counter_nonces: bool, is_server: bool):
+        """Fresh keys for a resumed session: the ticket secret mixed with both sides' randoms"""
+        shared_key = _hkdf(secret, b"AronaNET resumed", salt=randoms)
+        if counter_nonces:
+            self.setup_session_keys(shared_key, is_server)
+        else:
+            self.setup_shared_key(shared_key)
+
+    def resumption_secret(self) -> bytes:
+        """Secret a resumption ticket carries, both sides can work it out from the session key"""
+        if not self.shared_key:
+            raise RuntimeError("Cipher not init :(")
+        return _hkdf(self.shared_key, b"AronaNET resume")
+
+    def _next_send_nonce(self) -> bytes:
+        if not self.counter_nonces:
+            return os.urandom(12)
+
+        counter = self.send_counter
+        if counter >= MAX_COUNTER:
+            raise RuntimeError("Send counter exhausted, reconnect to rekey :(")
+        self.send_counter = counter + 1
+        return _counter_nonce(counter)
+
+    def encrypt(self, data: bytes, aad: Optional[bytes] = None) -> tuple[bytes, bytes]:
+        """Encrypt payload -> (nonce, ciphertext), nonce is empty in counter mode"""
         if not self.cipher:
             logger.error("Cipher not init :(")
             raise RuntimeError("Cipher not init :(")
 
-        nonce = os.urandom(12)
-        ciphertext = self.cipher.encrypt(nonce, data, None)
+        nonce = self._next_send_nonce()
+        ciphertext = self.cipher.encrypt(nonce, data, aad)
 
-        logger.debug(f"Encrypted {len(data)} bytes -> {len(ciphertext)} bytes :3")
-        return nonce, ciphertext
+        logger.debug("Encrypted %d bytes -> %d bytes :3", len(data), len(ciphertext))
+        return (b"" if self.counter_nonces else nonce), ciphertext
 
-    def decrypt(self, nonce: bytes, ciphertext:bytes) -> bytes:
-        """Decrypt payload"""
+    def sealed_size(self, plain_len: int) -> int:
+        """Wire size of an encrypted payload: nonce (if sent) + ciphertext + tag"""
+        return self.nonce_size + plain_len + 16
+
+    def encrypt_into(self, data: bytes, out: memoryview, aad: Optional[bytes] = None) -> int:
+        """Encrypt payload straight into out as nonce + ciphertext, returns bytes written"""
         if not self.cipher:
             logger.error("Cipher not init :(")
             raise RuntimeError("Cipher not init :(")
 
-        plaintext = self.cipher.decrypt(nonce, ciphertext, None)
+        size = self.sealed_size(len(data))
+        start = self.nonce_size
+        nonce = self._next_send_nonce()
+        out[:start] = nonce[:start]
+
+        if ENCRYPT_INTO:
+            self.cipher.encrypt_into(nonce, data, aad, out[start:size])
+        else:
+            out[start:size] = self.cipher.encrypt(nonce, data, aad)
 
-        logger.debug(f"Decrypted {len(ciphertext)} bytes -> {len(ciphertext)} bytes :3")
+        logger.debug("Encrypted %d bytes -> %d bytes :3", len(data), size - start)
+        return size
+
+    def decrypt(self, nonce: bytes, ciphertext:bytes, aad: Optional[bytes] = None) -> bytes:
+        """Decrypt payload, nonce and ciphertext may be memoryviews (nonce is ignored in counter mode)"""
+        if not self.recv_cipher:
+            logger.error("Cipher not init :(")
+            raise RuntimeError("Cipher not init :(")
+
+        start = time.perf_counter_ns()
+        if self.counter_nonces:
+            # Only advance once the frame authenticated, a bad frame can't skip numbers
+            plaintext = self.recv_cipher.decrypt(_counter_nonce(self.recv_counter), ciphertext, aad)
+            self.recv_counter += 1
+
+        else:
+            plaintext = self.recv_cipher.decrypt(nonce, ciphertext, aad)
+
+        DECRYPT.since(start)
+        logger.debug("Decrypted %d bytes -> %d bytes :3", len(ciphertext), len(plaintext))
         return plaintext
 
+
+MAX_COUNTER = 2 ** 64 - 1
+
+def _counter_nonce(counter: int) -> bytes:
+    """96-bit nonce: 4 zero bytes + 64-bit big-endian counter"""
+    return b"\x00\x00\x00\x00" + counter.to_bytes(8, "big")
+
+def _hkdf(secret: bytes, info: bytes, salt: Optional[bytes] = None) -> bytes:
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=salt, info=info).derive(secret)
+
 class KeyExchange:
     def __init__(self):
         """X25519 key exchange for connection setup"""
@@ -72,4 +182,71 @@ class KeyExchange:
 
         except Exception as e:
             logger.error(f"Key exchange failed: {e} :(")
-            raise
\ No newline at end of file
+            raise
+
+class GroupKey:
+    """Channel-wide key so a broadcast is encrypted once for every member"""
+    def __init__(self, key: Optional[bytes] = None, key_id: Optional[bytes] = None):
+        self.key = key or ChaCha20Poly1305.generate_key()
+        self.key_id = key_id or os.urandom(4)
+        self.cipher = ChaCha20Poly1305(self.key)
+        self.holders: Set[str] = set()
+
+    def to_payload(self, channel: str) -> bytes:
+        """GROUP_KEY payload: key_id(4) + key(32) + channel"""
+        return self.key_id + self.key + channel.encode()
+
+    @classmethod
+    def from_payload(cls, payload: bytes) -> tuple["GroupKey", str]:
+        if len(payload) < 36:
+            raise ValueError("Group key payload too short :(")
+        return cls(key=payload[4:36], key_id=payload[:4]), payload[36:].decode()
+
+    def seal(self, msg_type: int, payload: bytes) -> bytes:
+        """GROUP payload: key_id(4) + nonce(12) + ciphertext of type(1) + payload"""
+        nonce = os.urandom(12)
+        ciphertext = self.cipher.encrypt(nonce, bytes([msg_type]) + payload, self.key_id)
+        return self.key_id + nonce + ciphertext
+
+    def open(self, sealed: bytes) -> tuple[int, bytes]:
+        """Reverse of seal -> (msg_type, payload)"""
+        if sealed[:4] != self.key_id:
+            raise ValueError("Group key id mismatch :/")
+        plaintext = self.cipher.decrypt(sealed[4:16], sealed[16:], self.key_id)
+        return plaintext[0], plaintext[1:]
+
+
+class TicketKey:
+    """
+    Seals session resumption tickets
+
+    The ticket is opaque to the client: issued(8) + caps(1) + secret(32) +
+    username, encrypted under a key only the server holds, so the server
+    keeps no per-session state. Tickets from another key or older than
+    `lifetime` seconds don't open.
+    """
+    def __init__(self, key: Optional[bytes] = None, lifetime: float = 3600):
+        self.key = key or ChaCha20Poly1305.generate_key()
+        self.cipher = ChaCha20Poly1305(self.key)
+        self.lifetime = lifetime
+
+    def issue(self, username: str, secret: bytes, caps: int) -> bytes:
+        """TICKET payload: nonce(12) + sealed(issued(8) + caps(1) + secret(32) + username)"""
+        plain = int(time.time()).to_bytes(8, "big") + bytes([caps]) + secret + username.encode()
+        nonce = os.urandom(12)
+        return nonce + self.cipher.encrypt(nonce, plain, b"AronaNET ticket")
+
+    def open(self, ticket: bytes) -> tuple[str, bytes, int]:
+        """Reverse of issue -> (username, secret, caps), ValueError if it's bad or expired"""
+        if len(ticket) < 12 + 41 + 16:
+            raise ValueError("Ticket too short :(")
+
+        try:
+            plain = self.cipher.decrypt(ticket[:12], ticket[12:], b"AronaNET ticket")
+        except Exception:
+            raise ValueError("Ticket doesn't open :(")
+
+        issued = int.from_bytes(plain[:8], "big")
+        if time.time() - issued > self.lifetime:
+            raise ValueError("Ticket expired :/")
+        return plain[41:].decode(), plain[9:41], plain[8]
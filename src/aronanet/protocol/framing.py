@@ -0,0 +1,266 @@
+import asyncio
+from typing import Callable, Optional
+
+from ..utils.logger import get_logger
+
+logger = get_logger("Framing")
+
+PREFIX = 4
+DEFAULT_MAX_FRAME = 16 * 1024 * 1024
+DEFAULT_BUFFER = 64 * 1024
+
+class FrameTooLarge(ValueError):
+    """Length prefix bigger than we're willing to allocate"""
+
+
+class FrameDecoder:
+    """
+    Splits length-prefixed frames out of one reusable receive buffer
+
+    Frames come back as memoryviews into the buffer, valid until the next
+    call to next_frame(). Several pipelined frames from a single read are
+    handed out one after another without touching the socket again.
+    """
+    def __init__(self, max_frame_size: int = DEFAULT_MAX_FRAME, buffer_size: int = DEFAULT_BUFFER):
+        self.max_frame_size = max_frame_size
+        self.buffer_size = buffer_size
+        self._buf = bytearray(buffer_size)
+        self._start = 0
+        self._end = 0
+        self._held = False
+        self._pending = 0
+
+    @property
+    def buffered(self) -> int:
+        """Bytes received but not handed out yet"""
+        return self._end - self._start
+
+    def get_buffer(self, sizehint: int = -1) -> memoryview:
+        """Free space at the end of the buffer to receive into"""
+        want = max(sizehint, 4096)
+        free = len(self._buf) - self._end
+
+        # While filling in a frame we already made room for, any free space will do
+        filling = self._end < self._start + self._pending
+        if free < want and not (free and filling):
+            self._relocate(self.buffered + want)
+        return memoryview(self._buf)[self._end:]
+
+    def buffer_updated(self, nbytes: int):
+        """Mark nbytes of the last get_buffer() view as filled"""
+        self._end += nbytes
+
+    def feed(self, data: bytes):
+        """Copy received bytes in, for readers that don't support get_buffer()"""
+        data = memoryview(data)
+        while data:
+            view = self.get_buffer(len(data))
+            n = min(len(view), len(data))
+            view[:n] = data[:n]
+            self.buffer_updated(n)
+            data = data[n:]
+
+    def next_frame(self) -> Optional[memoryview]:
+        """Next complete frame without its length prefix, or None if more bytes are needed"""
+        # The caller is done with the previous frame once it asks for the next one
+        self._held = False
+
+        if self.buffered < PREFIX:
+            self._shrink()
+            return None
+
+        start = self._start
+        size = int.from_bytes(self._buf[start:start + PREFIX], "big")
+        if size > self.max_frame_size:
+            logger.warning(f"Rejecting {size} byte frame, limit is {self.max_frame_size} :/")
+            raise FrameTooLarge(f"Frame of {size} bytes exceeds limit of {self.max_frame_size}")
+
+        end = start + PREFIX + size
+        if end > self._end:
+            self._pending = PREFIX + size
+            if end > len(self._buf):
+                # Make room for the whole frame now, the prefix has already been checked
+                self._relocate(PREFIX + size)
+            return None
+
+        self._pending = 0
+        self._start = end
+        self._held = True
+        return memoryview(self._buf)[start + PREFIX:end]
+
+    def _relocate(self, capacity: int):
+        """Move unread bytes to the front, into a new buffer if a handed-out frame still points at this one"""
+        pending = self.buffered
+        if self._held or capacity > len(self._buf):
+            new = bytearray(max(capacity, self.buffer_size))
+            new[:pending] = self._buf[self._start:self._end]
+            self._buf = new
+
+        else:
+            self._buf[:pending] = self._buf[self._start:self._end]
+
+        self._start = 0
+        self._end = pending
+
+    def _shrink(self):
+        """Drop back to the normal buffer size after a big frame went through"""
+        if len(self._buf) > self.buffer_size * 4 and not self._held:
+            pending = bytes(self._buf[self._start:self._end])
+            self._buf = bytearray(self.buffer_size)
+            self._buf[:len(pending)] = pending
+            self._start = 0
+            self._end = len(pending)
+
+
+class StreamFrames:
+    """FrameDecoder fed from an asyncio.StreamReader"""
+    def __init__(self, reader: asyncio.StreamReader, max_frame_size: int = DEFAULT_MAX_FRAME):
+        self.reader = reader
+        self.decoder = FrameDecoder(max_frame_size)
+
+    async def read_frame(self) -> memoryview:
+        while True:
+            frame = self.decoder.next_frame()
+            if frame is not None:
+                return frame
+
+            data = await self.reader.read(self.decoder.buffer_size)
+            if not data:
+                raise asyncio.IncompleteReadError(b"", None)
+            self.decoder.feed(data)
+
+
+class FrameReader(asyncio.BufferedProtocol):
+    """
+    Protocol that reads frames straight into a FrameDecoder buffer
+
+    Also stands in for a StreamWriter (write/drain/close/wait_closed/get_extra_info)
+    so one object can be passed wherever a reader/writer pair is expected.
+    """
+    def __init__(self, max_frame_size: int = DEFAULT_MAX_FRAME,
+                 on_connect: Optional[Callable[["FrameReader"], None]] = None):
+        self.decoder = FrameDecoder(max_frame_size)
+        self.on_connect = on_connect
+        self.transport: Optional[asyncio.Transport] = None
+
+        self._loop = asyncio.get_running_loop()
+        self._read_waiter: Optional[asyncio.Future] = None
+        self._drain_waiter: Optional[asyncio.Future] = None
+        self._closed = self._loop.create_future()
+        self._eof = False
+        self._exc: Optional[BaseException] = None
+        self._write_paused = False
+        self._read_paused = False
+        self._high_water = 4 * self.decoder.buffer_size
+
+    # asyncio.BufferedProtocol
+
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+        if self.on_connect:
+            self.on_connect(self)
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        return self.decoder.get_buffer(sizehint)
+
+    def buffer_updated(self, nbytes: int):
+        self.decoder.buffer_updated(nbytes)
+
+        # Consumer is busy and falling behind, stop reading until it catches up
+        if self._read_waiter is None and self.decoder.buffered > self._high_water and not self._read_paused:
+            self._read_paused = True
+            self.transport.pause_reading()
+
+        self._wake(self._read_waiter)
+
+    def eof_received(self):
+        self._eof = True
+        self._wake(self._read_waiter)
+        return False
+
+    def connection_lost(self, exc: Optional[BaseException]):
+        self._eof = True
+        self._exc = exc
+        self._wake(self._read_waiter)
+        self._wake(self._drain_waiter)
+        if not self._closed.done():
+            self._closed.set_result(None)
+
+    def pause_writing(self):
+        self._write_paused = True
+
+    def resume_writing(self):
+        self._write_paused = False
+        self._wake(self._drain_waiter)
+
+    # Reading
+
+    async def read_frame(self) -> memoryview:
+        """Next frame (without length prefix), valid until the next read_frame() call"""
+        while True:
+            frame = self.decoder.next_frame()
+            if frame is not None:
+                if self._read_paused and self.decoder.buffered < self._high_water:
+                    self._read_paused = False
+                    self.transport.resume_reading()
+                return frame
+
+            if self._eof:
+                if self._exc:
+                    raise self._exc
+                raise asyncio.IncompleteReadError(b"", None)
+
+            if self._read_paused:
+                self._read_paused = False
+                self.transport.resume_reading()
+
+            self._read_waiter = self._loop.create_future()
+            try:
+                await self._read_waiter
+            finally:
+                self._read_waiter = None
+
+    # StreamWriter stand-ins
+
+    def write(self, data):
+        self.transport.write(data)
+
+    async def drain(self):
+        if self._exc:
+            raise self._exc
+
+        if self.transport.is_closing():
+            # Let connection_lost run so we raise the real error
+            await asyncio.sleep(0)
+            if self._exc:
+                raise self._exc
+            raise ConnectionResetError("Connection lost")
+
+        if self._write_paused:
+            self._drain_waiter = self._loop.create_future()
+            try:
+                await self._drain_waiter
+            finally:
+                self._drain_waiter = None
+
+    def close(self):
+        if self.transport:
+            self.transport.close()
+
+    async def wait_closed(self):
+        await self._closed
+
+    def get_extra_info(self, name: str, default=None):
+        return self.transport.get_extra_info(name, default)
+
+    @staticmethod
+    def _wake(waiter: Optional[asyncio.Future]):
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+
+async def open_frame_connection(host: str, port: int, max_frame_size: int = DEFAULT_MAX_FRAME) -> FrameReader:
+    """Like asyncio.open_connection, but returns one FrameReader acting as reader and writer"""
+    loop = asyncio.get_running_loop()
+    _, protocol = await loop.create_connection(lambda: FrameReader(max_frame_size), host, port)
+    return protocol
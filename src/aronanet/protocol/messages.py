@@ -1,7 +1,7 @@
 from enum import IntEnum
 from dataclasses import dataclass, field
-from threading import Lock
-from typing import ClassVar
+from itertools import count
+from typing import Optional
 import zlib
 
 from ..utils.logger import get_logger
@@ -14,58 +14,244 @@ class MessageType(IntEnum):
     AUTH = 0x02
     AUTH_OK = 0x03
     AUTH_FAIL = 0x04
+    RESUME = 0x05
+    TICKET = 0x06
     TEXT = 0x10
     IMAGE = 0x11
     TYPING = 0x12
     DM = 0x13
+    GROUP_KEY = 0x14
+    GROUP = 0x15
+    HISTORY = 0x16
+    CHUNK = 0x17
+    CHUNK_ACK = 0x18
     ONLINE = 0x20
     OFFLINE = 0x21
     SUP = 0x30
     ADIOS = 0x31
+    PING = 0x32
+    PONG = 0x33
     SHIT = 0xFF
 
-@dataclass
+# Highest wire format we speak, offered in the HI header
+#   v1: version(1) type(1) length(4) msg_id(2) | body | crc32(4)
+#   v2: version(1) type(1) flags(1) msg_id(2) | body [| crc32(4) for plaintext types]
+#       encrypted bodies use the header as AEAD associated data
+#   v3: v2 + optional capability byte after the X25519 key in both HI payloads
+PROTOCOL_VERSION = 3
+V1_HEADER = 8
+V2_HEADER = 5
+CHECKSUM = 4
+
+# Capability bits, offered by the client and answered with the agreed subset
+CAP_COUNTER_NONCE = 0x01
+CAP_RESUME = 0x02
+CAP_ZLIB = 0x04
+CAP_ZSTD = 0x08
+
+# v2 header flag bits
+FLAG_COMPRESSED = 0x01  # body was compressed with the agreed compressor before encryption
+
+# Bytes of fresh randomness each side puts in a RESUME
+RESUME_RANDOM = 32
+
+# Types whose payload is not run through the per-connection cipher
+# GROUP carries its own channel-key ciphertext, see crypto.GroupKey
+PLAINTEXT_TYPES = frozenset({MessageType.HI, MessageType.RESUME, MessageType.AUTH, MessageType.GROUP})
+
+# Never compressed: key material (no size side channel) and file chunks (usually compressed already)
+UNCOMPRESSED_TYPES = frozenset({MessageType.TICKET, MessageType.GROUP_KEY, MessageType.CHUNK})
+
+# Bodies under this many bytes are packed by bytes concatenation, above it into
+# one preallocated buffer (fewer copies once the payload dominates). pack_into
+# has to copy the concatenated frame into the caller's buffer, so it only pays
+# off there for chat-line sized bodies
+SMALL_FRAME = 4096
+SMALL_WRITE = 512
+
+# Byte -> MessageType, indexing a list is much cheaper than MessageType(byte) on every unpack
+_TYPE_TABLE: list = [None] * 256
+for _type in MessageType:
+    _TYPE_TABLE[_type] = _type
+
+def message_type(value: int) -> MessageType:
+    """MessageType for a wire byte, ValueError if it isn't one"""
+    msg_type = _TYPE_TABLE[value]
+    if msg_type is None:
+        raise ValueError(f"{value} is not a valid MessageType")
+    return msg_type
+
+def _frame_size(body_len: int, secure_channel, v2: bool) -> int:
+    """Wire size of a frame around a body_len body, secure_channel None means plaintext"""
+    if secure_channel is None:
+        return (V2_HEADER if v2 else V1_HEADER) + body_len + CHECKSUM
+    if v2:
+        return V2_HEADER + secure_channel.sealed_size(body_len)
+    return V1_HEADER + secure_channel.sealed_size(body_len) + CHECKSUM
+
+# next() on a C counter is atomic under the GIL, no lock needed
+_msg_ids = count()
+
+def _next_msg_id() -> int:
+    return next(_msg_ids) & 0xFFFF
+
+@dataclass(slots=True)
 class Message:
     """Does shit related to messages"""
     version: int = 1
     msg_type: MessageType = MessageType.TEXT
     payload: bytes = b''
-    msg_id: int = field(default=None, init=False)
+    msg_id: int = field(default_factory=_next_msg_id, init=False)
+    _header_cache: tuple = field(default=None, init=False, repr=False, compare=False)
+    _packed_cache: tuple = field(default=None, init=False, repr=False, compare=False)
+    _compressed_cache: tuple = field(default=None, init=False, repr=False, compare=False)
 
-    _counter: ClassVar[int] = 0
-    _lock: ClassVar[Lock] = Lock()
+    def pack(self, secure_channel= None, version: Optional[int] = None) -> bytes:
+        """
+        Pack message into wire
 
+        Args:
+            secure_channel: SecureChannel instance for encryption
+            version: Wire format to use, defaults to self.version
+        """
+        version = version or self.version
+        encrypted = bool(secure_channel) and self.msg_type not in PLAINTEXT_TYPES
+
+        cached = self._packed_cache
+        if not encrypted and cached is not None and cached[0] == version:
+            return cached[1]
+
+        v2 = _is_v2(version, self.msg_type)
+        channel = secure_channel if encrypted else None
+        body, flags = self._body(channel, v2) if encrypted else (self.payload, 0)
+
+        if len(body) < SMALL_FRAME:
+            packed = self._concat(body, flags, channel, version, v2)
+        else:
+            buf = bytearray(_frame_size(len(body), channel, v2))
+            self._write(buf, 0, body, flags, channel, version, v2)
+            packed = bytes(buf)
+
+        if not encrypted:
+            self._packed_cache = (version, packed)
+        return packed
 
-    def __post_init__(self):
-        if self.msg_id is None:
-            with Message._lock:
-                self.msg_id = Message._counter
-                Message._counter = (Message._counter +1) % 65536
+    def packed_size(self, secure_channel=None, version: Optional[int] = None) -> int:
+        """Size of pack() output without building it"""
+        version = version or self.version
+        encrypted = bool(secure_channel) and self.msg_type not in PLAINTEXT_TYPES
+        v2 = _is_v2(version, self.msg_type)
 
-    def pack(self, secure_channel= None):
+        if encrypted:
+            return _frame_size(len(self._body(secure_channel, v2)[0]), secure_channel, v2)
+        return _frame_size(len(self.payload), None, v2)
+
+    def pack_into(self, buf: bytearray, offset: int = 0, secure_channel=None, version: Optional[int] = None) -> int:
         """
-        Pack message into wire
+        Pack message into a preallocated buffer, returns bytes written
 
         Args:
+            buf: Writable buffer with at least packed_size() bytes free at offset
+            offset: Where the header starts
             secure_channel: SecureChannel instance for encryption
+            version: Wire format to use, defaults to self.version
         """
-        if secure_channel and self.msg_type not in (MessageType.HI, MessageType.AUTH):
-            nonce, enc_payload = secure_channel.encrypt(self.payload)
-            body = nonce + enc_payload
+        version = version or self.version
+        encrypted = bool(secure_channel) and self.msg_type not in PLAINTEXT_TYPES
+        v2 = _is_v2(version, self.msg_type)
+
+        if encrypted:
+            body, flags = self._body(secure_channel, v2)
+            return self._write(buf, offset, body, flags, secure_channel, version, v2)
+        return self._write(buf, offset, self.payload, 0, None, version, v2)
+
+    def _concat(self, body: bytes, flags: int, secure_channel, version: int, v2: bool) -> bytes:
+        """Whole frame as bytes concatenation, cheaper than a buffer + views for small bodies"""
+        if secure_channel is None:
+            header, header_crc = self._header(version, len(body), flags)
+            sealed = body
+        else:
+            header, header_crc = self._header(version, secure_channel.sealed_size(len(body)), flags)
+            nonce, ciphertext = secure_channel.encrypt(body, aad=header if v2 else None)
+            if v2:
+                # v2 authenticates the header instead of checksumming the frame
+                return header + nonce + ciphertext
+            sealed = nonce + ciphertext
+
+        logger.debug("Packing msg_id: %d, type: %s, length: %d :)", self.msg_id, self.msg_type.name, len(sealed))
+        return header + sealed + zlib.crc32(sealed, header_crc).to_bytes(4, "big")
+
+    def _write(self, buf: bytearray, offset: int, body: bytes, flags: int, secure_channel, version: int, v2: bool) -> int:
+        """Frame for an already built body into buf at offset, secure_channel None means plaintext"""
+        if len(body) < SMALL_WRITE:
+            frame = self._concat(body, flags, secure_channel, version, v2)
+            buf[offset:offset + len(frame)] = frame
+            return len(frame)
+
+        encrypted = secure_channel is not None
+        length = secure_channel.sealed_size(len(body)) if encrypted else len(body)
+
+        header, header_crc = self._header(version, length, flags)
+        view = memoryview(buf)
+        start = offset + len(header)
+        end = start + length
+        view[offset:start] = header
+
+        if encrypted:
+            # v2 authenticates the header instead of checksumming the frame
+            secure_channel.encrypt_into(body, view[start:end], aad=header if v2 else None)
 
         else:
-            body = self.payload
+            view[start:end] = body
+
+        if not (v2 and encrypted):
+            view[end:end + CHECKSUM] = zlib.crc32(view[start:end], header_crc).to_bytes(4, "big")
+            end += CHECKSUM
 
-        length = len(body)
-        header = (
-                bytes([self.version, self.msg_type]) +
-                length.to_bytes(4, "big") +
-                self.msg_id.to_bytes(2, "big")
-        )
-        checksum = zlib.crc32(header + body).to_bytes(4, "big")
+        logger.debug("Packing msg_id: %d, type: %s, length: %d :)", self.msg_id, self.msg_type.name, length)
+        return end - offset
+
+    def _body(self, secure_channel, v2: bool) -> tuple[bytes, int]:
+        """
+        Plaintext to encrypt and the header flags for it
+
+        With compression agreed, payloads of min_size and up are compressed
+        once and the result is reused for every recipient using the same
+        algorithm. Payloads that don't get smaller go out as they are.
+        """
+        compressor = secure_channel.compressor
+        if (compressor is None or not v2 or len(self.payload) < compressor.min_size
+                or self.msg_type in UNCOMPRESSED_TYPES):
+            return self.payload, 0
 
-        logger.debug(f"Packing msg_id: {self.msg_id}, type: {self.msg_type.name}, length: {length} :)")
-        return header + body + checksum
+        cached = self._compressed_cache
+        if cached is None or cached[0] != compressor.cap:
+            cached = self._compressed_cache = (compressor.cap, compressor.compress(self.payload))
+
+        if cached[1] is None:
+            return self.payload, 0
+        return cached[1], FLAG_COMPRESSED
+
+    def _header(self, version: int, length: int, flags: int = 0) -> tuple[bytes, int]:
+        """
+        Header bytes and their CRC for a body of `length` bytes
+
+        Encrypted bodies are the same size for every recipient, so a broadcast
+        builds the header once and only the ciphertext differs per connection.
+        """
+        cached = self._header_cache
+        if cached is None or cached[0] != (version, length, flags):
+            if _is_v2(version, self.msg_type):
+                header = bytes([version, self.msg_type, flags]) + self.msg_id.to_bytes(2, "big")
+            else:
+                header = (
+                        bytes([version, self.msg_type]) +
+                        length.to_bytes(4, "big") +
+                        self.msg_id.to_bytes(2, "big")
+                )
+            cached = self._header_cache = ((version, length, flags), header, zlib.crc32(header))
+
+        return cached[1], cached[2]
 
     @classmethod
     def unpack(cls, data: bytes, secure_channel= None):
@@ -73,39 +259,111 @@ class Message:
         Unpack message from wire
 
         Args:
-            data: Raw bytes from network
+            data: One complete frame, any bytes-like object (sliced as a memoryview, not copied)
             secure_channel: SecureChannel instance for decryption
         """
-        if len(data) < 8:
+        view = memoryview(data)
+        if len(view) < 2:
             raise ValueError("Data too short for header")
 
-        version = data[0]
-        msg_type = MessageType(data[1])
-        length = int.from_bytes(data[2:6], "big")
-        msg_id = int.from_bytes(data[6:8], "big")
+        version = view[0]
+        msg_type = message_type(view[1])
+        encrypted = bool(secure_channel) and msg_type not in PLAINTEXT_TYPES
+        v2 = _is_v2(version, msg_type)
+        flags = 0
 
-        if len(data) < 8 + length + 4:
-            logger.error(f"Data too short message :/")
-            raise ValueError("Data too short message")
+        if v2:
+            start = V2_HEADER
+            end = len(view) if encrypted else len(view) - CHECKSUM
+            if end < start:
+                raise ValueError("Data too short for header")
+            flags = view[2]
+            msg_id = int.from_bytes(view[3:5], "big")
 
-        body = data[8:8 + length]
+        else:
+            if len(view) < V1_HEADER:
+                raise ValueError("Data too short for header")
+            start = V1_HEADER
+            end = start + int.from_bytes(view[2:6], "big")
+            msg_id = int.from_bytes(view[6:8], "big")
 
-        checksum_recv = int.from_bytes(data[8 + length:12 + length], "big")
-        checksum_calc = zlib.crc32(data[0:8 + length])
-        if checksum_calc != checksum_recv:
-            raise ValueError("Checksum mismatch :(")
+            if len(view) < end + CHECKSUM:
+                logger.error(f"Data too short message :/")
+                raise ValueError("Data too short message")
 
-        if secure_channel and msg_type not in (MessageType.HI, MessageType.AUTH):
-            if len(body) < 12:
+        body = view[start:end]
+
+        if not (v2 and encrypted):
+            checksum_recv = int.from_bytes(view[end:end + CHECKSUM], "big")
+            checksum_calc = zlib.crc32(view[:end])
+            if checksum_calc != checksum_recv:
+                raise ValueError("Checksum mismatch :(")
+
+        if encrypted:
+            nonce_size = secure_channel.nonce_size
+            if len(body) < nonce_size + 16:
                 raise ValueError("Encrypted body too short :(")
-            nonce = body[:12]
-            ciphertext = body[12:]
-            payload = secure_channel.decrypt(nonce, ciphertext)
+            aad = bytes(view[:start]) if v2 else None
+            payload = secure_channel.decrypt(body[:nonce_size], body[nonce_size:], aad=aad)
+
+            if flags & FLAG_COMPRESSED:
+                if secure_channel.compressor is None:
+                    raise ValueError("Compressed frame but no compression agreed :(")
+                payload = secure_channel.compressor.decompress(payload)
 
         else:
-            payload = body
+            # Only copy: the view may point into a reused receive buffer
+            payload = bytes(body)
 
-        logger.debug(f"Unpacked msg_id: {msg_id}, type: {msg_type.name} :)")
+        logger.debug("Unpacked msg_id: %d, type: %s :)", msg_id, msg_type.name)
         msg = cls(version=version, msg_type=msg_type, payload=payload)
         msg.msg_id = msg_id
-        return msg
\ No newline at end of file
+        return msg
+
+
+def hi_payload(pubkey: bytes, version: int, caps: int = 0) -> bytes:
+    """HI payload: X25519 public key, plus the capability byte from v3 on"""
+    if version >= 3:
+        return pubkey + bytes([caps])
+    return pubkey
+
+def parse_hi(payload: bytes) -> tuple[bytes, int]:
+    """HI payload -> (public key, capability bits)"""
+    if len(payload) not in (32, 33):
+        raise ValueError("Invalid HI payload length :(")
+    return payload[:32], (payload[32] if len(payload) == 33 else 0)
+
+
+def history_payload(head: int, records) -> bytes:
+    """HISTORY payload: head seq(8) + records of seq(8) type(1) length(4) payload"""
+    parts = [head.to_bytes(8, "big")]
+    for seq, msg_type, payload in records:
+        parts.append(seq.to_bytes(8, "big") + bytes([msg_type]) + len(payload).to_bytes(4, "big"))
+        parts.append(payload)
+    return b"".join(parts)
+
+def parse_history(payload: bytes) -> tuple[int, list[tuple[int, MessageType, bytes]]]:
+    """HISTORY payload -> (head seq, [(seq, type, payload), ...])"""
+    if len(payload) < 8:
+        raise ValueError("HISTORY payload too short :(")
+
+    head = int.from_bytes(payload[:8], "big")
+    records, offset = [], 8
+    while offset < len(payload):
+        if len(payload) < offset + 13:
+            raise ValueError("Truncated HISTORY record :(")
+        seq = int.from_bytes(payload[offset:offset + 8], "big")
+        msg_type = message_type(payload[offset + 8])
+        end = offset + 13 + int.from_bytes(payload[offset + 9:offset + 13], "big")
+        if end > len(payload):
+            raise ValueError("Truncated HISTORY record :(")
+
+        records.append((seq, msg_type, payload[offset + 13:end]))
+        offset = end
+
+    return head, records
+
+
+def _is_v2(version: int, msg_type: MessageType) -> bool:
+    """HI and RESUME always use the v1 layout so their version byte can be read by any peer"""
+    return version >= 2 and msg_type not in (MessageType.HI, MessageType.RESUME)
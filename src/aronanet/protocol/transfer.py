@@ -0,0 +1,153 @@
+import hashlib
+import os
+from pathlib import Path
+from typing import BinaryIO, List, Optional
+
+from .messages import Message, MessageType
+from ..utils.logger import get_logger
+
+logger = get_logger("Transfer")
+
+# CHUNK / CHUNK_ACK index meaning "this transfer is off"
+ABORT = 0xFFFFFFFF
+DEFAULT_CHUNK = 64 * 1024
+
+def start_payload(transfer_id: int, size: int, digest: bytes, chunk_size: int, name: str) -> bytes:
+    """IMAGE payload: transfer_id(4) size(8) sha256(32) chunk_size(4) name"""
+    return (
+            transfer_id.to_bytes(4, "big") + size.to_bytes(8, "big") + digest +
+            chunk_size.to_bytes(4, "big") + name.encode()
+    )
+
+def parse_start(payload: bytes) -> tuple[int, int, bytes, int, str]:
+    """IMAGE payload -> (transfer_id, size, sha256, chunk_size, name)"""
+    if len(payload) < 48:
+        raise ValueError("IMAGE payload too short :(")
+    return (
+        int.from_bytes(payload[:4], "big"), int.from_bytes(payload[4:12], "big"), bytes(payload[12:44]),
+        int.from_bytes(payload[44:48], "big"), bytes(payload[48:]).decode()
+    )
+
+def chunk_payload(transfer_id: int, index: int, data: bytes = b"") -> bytes:
+    """CHUNK payload: transfer_id(4) index(4) data, CHUNK_ACK is the same without data"""
+    return transfer_id.to_bytes(4, "big") + index.to_bytes(4, "big") + data
+
+def parse_chunk(payload: bytes) -> tuple[int, int, bytes]:
+    """CHUNK / CHUNK_ACK payload -> (transfer_id, index, data)"""
+    if len(payload) < 8:
+        raise ValueError("CHUNK payload too short :(")
+    return int.from_bytes(payload[:4], "big"), int.from_bytes(payload[4:8], "big"), payload[8:]
+
+
+class IncomingTransfer:
+    """
+    Reassembles one transfer straight into a file
+
+    Chunks arrive in order (one TCP stream, one queue), so they're appended
+    and hashed as they come and never held in memory. The file only keeps
+    its name if the SHA-256 matches at the end.
+    """
+    def __init__(self, path: Path, size: int, digest: bytes, chunk_size: int):
+        self.path = Path(path)
+        self.size = size
+        self.digest = digest
+        self.chunk_size = chunk_size
+        self.received = 0
+        self.next_index = 0
+        self._hash = hashlib.sha256()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._part = self.path.with_name(self.path.name + ".part")
+        self._file: Optional[BinaryIO] = open(self._part, "wb")
+
+    @property
+    def done(self) -> bool:
+        return self.received == self.size
+
+    def write(self, index: int, data: bytes) -> bool:
+        """Add one chunk, True once the file is complete and verified"""
+        if index != self.next_index or len(data) > self.chunk_size or self.received + len(data) > self.size:
+            self.abort()
+            raise ValueError(f"Bad chunk {index} for {self.path.name} :(")
+
+        self._file.write(data)
+        self._hash.update(data)
+        self.received += len(data)
+        self.next_index += 1
+        return self.finish() if self.done else False
+
+    def finish(self) -> bool:
+        """Check the hash and move the .part file into place"""
+        self._file.close()
+        self._file = None
+        if self._hash.digest() != self.digest:
+            self._part.unlink(missing_ok=True)
+            raise ValueError(f"Hash mismatch for {self.path.name} :(")
+
+        os.replace(self._part, self.path)
+        logger.info(f"Received {self.path.name} ({self.size} bytes) :)")
+        return True
+
+    def abort(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+        self._part.unlink(missing_ok=True)
+
+
+class OutgoingTransfer:
+    """
+    Sends one file as CHUNK frames, at most `window` of them unacknowledged
+
+    The server acks a chunk once every recipient has room for it, so a slow
+    room slows the upload down instead of piling chunks up in memory.
+    """
+    def __init__(self, transfer_id: int, path: Path, chunk_size: int = DEFAULT_CHUNK, window: int = 8):
+        self.transfer_id = transfer_id
+        self.path = Path(path)
+        self.chunk_size = chunk_size
+        self.window = window
+        self.size = self.path.stat().st_size
+        self.count = -(-self.size // chunk_size)
+        self.next_index = 0
+        self.acked = 0
+        self.aborted = False
+
+        digest = hashlib.sha256()
+        with open(self.path, "rb") as f:
+            for block in iter(lambda: f.read(chunk_size), b""):
+                digest.update(block)
+        self.digest = digest.digest()
+        self._file: Optional[BinaryIO] = open(self.path, "rb")
+
+    @property
+    def done(self) -> bool:
+        return self.aborted or self.acked >= self.count
+
+    def start_message(self) -> Message:
+        payload = start_payload(self.transfer_id, self.size, self.digest, self.chunk_size, self.path.name)
+        return Message(msg_type=MessageType.IMAGE, payload=payload)
+
+    def ready_chunks(self) -> List[Message]:
+        """Chunks the window allows right now"""
+        chunks = []
+        while not self.aborted and self.next_index < self.count and self.next_index - self.acked < self.window:
+            payload = chunk_payload(self.transfer_id, self.next_index, self._file.read(self.chunk_size))
+            chunks.append(Message(msg_type=MessageType.CHUNK, payload=payload))
+            self.next_index += 1
+
+        if self.next_index >= self.count:
+            self.close()
+        return chunks
+
+    def ack(self, index: int):
+        if index == ABORT:
+            self.aborted = True
+            self.close()
+            return
+        self.acked = max(self.acked, index + 1)
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
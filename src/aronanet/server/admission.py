@@ -0,0 +1,65 @@
+from dataclasses import dataclass, asdict
+
+from ..utils.logger import get_logger
+
+logger = get_logger("Admission")
+
+@dataclass
+class Admission:
+    """
+    Live socket counts from accept to close, and the caps on them
+
+    admit() runs before anything is allocated for a socket, so a flood of
+    handshakes is turned away for the price of a close. Sockets count as
+    pending until AUTH, where promote() moves them to authenticated (or
+    refuses if that side is full), and release() gives the slot back
+    whatever happened. A full server still lets sockets in as pending: it
+    can't know at accept who's reconnecting to replace their own session.
+    """
+    max_pending: int = 64
+    max_authenticated: int = 10
+    pending: int = 0
+    authenticated: int = 0
+    peak: int = 0
+    accepted: int = 0
+    rejected_pending: int = 0
+    rejected_full: int = 0
+
+    @property
+    def live(self) -> int:
+        return self.pending + self.authenticated
+
+    def admit(self) -> bool:
+        """New socket: True if it may start a handshake"""
+        if self.pending >= self.max_pending:
+            self.rejected_pending += 1
+            return False
+
+        self.pending += 1
+        self.accepted += 1
+        self.peak = max(self.peak, self.live)
+        return True
+
+    def promote(self, replacing: bool = False) -> bool:
+        """AUTH succeeded: True if there's room for one more session
+
+        replacing means the user already has a session here that this one is
+        about to kick, so it doesn't need a slot of its own.
+        """
+        if self.authenticated >= self.max_authenticated and not replacing:
+            self.rejected_full += 1
+            return False
+
+        self.pending -= 1
+        self.authenticated += 1
+        return True
+
+    def release(self, authenticated: bool):
+        """Socket closed, whether or not it got past AUTH"""
+        if authenticated:
+            self.authenticated -= 1
+        else:
+            self.pending -= 1
+
+    def snapshot(self) -> dict:
+        return {**asdict(self), "live": self.live}
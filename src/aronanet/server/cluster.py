@@ -0,0 +1,276 @@
+import asyncio
+import multiprocessing
+import os
+import signal
+import tempfile
+from enum import IntEnum
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from rich.console import Console
+
+from ..utils.logger import get_logger, set_level
+from ..utils.config import AronaSettings
+from ..protocol.framing import PREFIX, StreamFrames
+from .bore_manager import BoreManager
+
+console = Console()
+logger = get_logger("Cluster")
+
+class BusKind(IntEnum):
+    CHANNEL = 0x01  # channel, exclude, type, payload
+    USER = 0x02  # username, type, payload
+    PRESENCE = 0x03  # username, channel ("" = offline)
+    HELLO = 0x04  # worker introduces itself, hub answers with a presence snapshot
+
+
+def pack_bus(kind: BusKind, origin: int, *fields: bytes) -> bytes:
+    """One length-prefixed bus frame: kind(1) origin(1) then (len(2) + field)*"""
+    body = bytearray((kind, origin))
+    for field in fields:
+        body += len(field).to_bytes(2, "big")
+        body += field
+    return len(body).to_bytes(PREFIX, "big") + body
+
+
+def unpack_bus(frame) -> tuple[BusKind, int, List[bytes]]:
+    """Inverse of pack_bus, takes the frame without its length prefix"""
+    frame = memoryview(frame)
+    kind, origin = BusKind(frame[0]), frame[1]
+    fields, pos = [], 2
+    while pos < len(frame):
+        size = int.from_bytes(frame[pos:pos + 2], "big")
+        fields.append(bytes(frame[pos + 2:pos + 2 + size]))
+        pos += 2 + size
+    return kind, origin, fields
+
+
+class BusHub:
+    """
+    Master side of the inter-worker bus
+
+    Every worker keeps one Unix socket to the hub, the hub relays each frame
+    to all the other workers. It also remembers presence so a worker that
+    (re)starts late gets the current user list.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.workers: Dict[int, asyncio.StreamWriter] = {}
+        self.presence: Dict[str, tuple[int, str]] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        self._server = await asyncio.start_unix_server(self._handle_worker, self.path)
+        logger.info(f"Bus hub listening on {self.path} :3")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+        for writer in self.workers.values():
+            writer.close()
+
+    async def _handle_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        frames = StreamFrames(reader)
+        worker_id = None
+        try:
+            while True:
+                frame = await frames.read_frame()
+                kind, origin, fields = unpack_bus(frame)
+
+                if kind == BusKind.HELLO:
+                    worker_id = origin
+                    self.workers[worker_id] = writer
+                    # A restarted worker comes back empty, its old users are gone for everyone else too
+                    self._announce_gone(worker_id)
+                    for username, (owner, channel) in self.presence.items():
+                        writer.write(pack_bus(BusKind.PRESENCE, owner, username.encode(), channel.encode()))
+                    logger.info(f"Worker {worker_id} joined the bus :3")
+                    continue
+
+                if kind == BusKind.PRESENCE:
+                    self._track(origin, fields)
+
+                data = len(frame).to_bytes(PREFIX, "big") + bytes(frame)
+                for other, other_writer in list(self.workers.items()):
+                    if other != origin:
+                        other_writer.write(data)
+
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+        finally:
+            if worker_id is not None and self.workers.get(worker_id) is writer:
+                del self.workers[worker_id]
+                # Users on a dead worker are gone, tell everyone else
+                self._announce_gone(worker_id)
+                logger.warning(f"Worker {worker_id} left the bus :/")
+            writer.close()
+
+    def _track(self, origin: int, fields: List[bytes]):
+        username, channel = fields[0].decode(), fields[1].decode()
+        if channel:
+            self.presence[username] = (origin, channel)
+        elif self.presence.get(username, (None,))[0] == origin:
+            del self.presence[username]
+
+    def _announce_gone(self, worker_id: int):
+        """Forget a worker's users and send PRESENCE offline for each to the other workers"""
+        for username in self._forget_worker(worker_id):
+            data = pack_bus(BusKind.PRESENCE, worker_id, username.encode(), b"")
+            for other, other_writer in self.workers.items():
+                if other != worker_id:
+                    other_writer.write(data)
+
+    def _forget_worker(self, worker_id: int) -> List[str]:
+        gone = [u for u, (owner, _) in self.presence.items() if owner == worker_id]
+        for username in gone:
+            del self.presence[username]
+        return gone
+
+
+class WorkerBus:
+    """Worker side of the bus, publishes local events and feeds remote ones to a callback"""
+    def __init__(self, path: str, worker_id: int):
+        self.path = path
+        self.worker_id = worker_id
+        self.on_message: Optional[Callable[[BusKind, int, List[bytes]], asyncio.Future]] = None
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def connect(self, retries: int = 50):
+        for _ in range(retries):
+            try:
+                self._reader, self._writer = await asyncio.open_unix_connection(self.path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                await asyncio.sleep(0.1)
+        else:
+            raise ConnectionError(f"Bus hub at {self.path} not reachable")
+
+        self.publish(BusKind.HELLO)
+        self._task = asyncio.create_task(self._listen())
+        logger.info(f"Worker {self.worker_id} connected to bus :3")
+
+    def publish(self, kind: BusKind, *fields: bytes):
+        """Fire and forget, the hub is a local socket so we don't wait for drain"""
+        if self._writer is not None and not self._writer.is_closing():
+            self._writer.write(pack_bus(kind, self.worker_id, *fields))
+
+    async def _listen(self):
+        frames = StreamFrames(self._reader)
+        try:
+            while True:
+                kind, origin, fields = unpack_bus(await frames.read_frame())
+                if self.on_message:
+                    try:
+                        await self.on_message(kind, origin, fields)
+                    except Exception as e:
+                        logger.error(f"Bus message {kind.name} failed: {e} :(")
+
+        except (asyncio.IncompleteReadError, ConnectionError):
+            logger.warning(f"Worker {self.worker_id} lost the bus :(")
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+        if self._writer:
+            self._writer.close()
+
+
+def worker_main(config: AronaSettings, worker_id: int, bus_path: str):
+    """Worker process entry point"""
+    from .server import AronaServer
+    from ..utils.loop import run
+
+    try:
+        run(AronaServer(config, worker_id=worker_id).serve_worker(bus_path), config.get("loop", "auto"))
+    except KeyboardInterrupt:
+        pass
+
+
+class AronaCluster:
+    """Master process: runs the bus hub and bore, keeps `workers` AronaServer processes alive"""
+    def __init__(self, config: AronaSettings):
+        self.config = config
+        set_level(self.config.get("log_level", "INFO"))
+        self.port = self.config.get("port")
+        self.worker_count = self.config.get("workers", 1)
+        self.bus_path = str(Path(tempfile.mkdtemp(prefix="aronanet-")) / "bus.sock")
+        self.hub = BusHub(self.bus_path)
+        self.procs: Dict[int, multiprocessing.Process] = {}
+        self._ctx = multiprocessing.get_context("spawn")
+
+        # One ticket key for every worker, a resume can land on any of them
+        if not self.config.get("ticket_key"):
+            self.config.set("ticket_key", os.urandom(32).hex(), save=False)
+
+        self.bore = BoreManager(local_port=self.port, auto_reconn=True, reconn_delay=5.0)
+
+    def _spawn(self, worker_id: int):
+        proc = self._ctx.Process(
+            target=worker_main, args=(self.config, worker_id, self.bus_path),
+            name=f"aronanet-worker-{worker_id}", daemon=True
+        )
+        proc.start()
+        self.procs[worker_id] = proc
+        logger.info(f"Started worker {worker_id} (pid {proc.pid}) :3")
+
+    async def launch(self):
+        """Start the hub, then the workers"""
+        await self.hub.start()
+        for worker_id in range(self.worker_count):
+            self._spawn(worker_id)
+
+    async def start(self):
+        await self.launch()
+        console.print(f"[*] {self.worker_count} workers sharing port {self.port}")
+
+        console.print("[*] Starting bore tunnel...")
+        public_url = await self.bore.start()
+        if public_url:
+            console.print(f"[✓] Public URL: {public_url}")
+        else:
+            console.print("[!] Failed to start bore - server only accessible locally")
+
+        console.print("\n[*] Server ready! Press Ctrl+C to stop\n")
+
+        try:
+            await self.supervise()
+
+        except asyncio.CancelledError:
+            pass
+
+        finally:
+            await self.stop()
+
+    async def supervise(self, interval: float = 1.0):
+        """Restart workers that die"""
+        # SIGTERM would otherwise kill us before we get to stop() the workers
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+
+        while True:
+            await asyncio.sleep(interval)
+            for worker_id, proc in list(self.procs.items()):
+                if not proc.is_alive():
+                    logger.error(f"Worker {worker_id} died (exit {proc.exitcode}), restarting :(")
+                    console.print(f"[!] Worker {worker_id} died, restarting")
+                    self._spawn(worker_id)
+
+    async def stop(self):
+        console.print("\n[*] Shutting down workers...")
+        await self.bore.stop()
+
+        for proc in self.procs.values():
+            proc.terminate()
+        for proc in self.procs.values():
+            await asyncio.to_thread(proc.join, 5)
+
+        await self.hub.stop()
+        try:
+            os.unlink(self.bus_path)
+            os.rmdir(os.path.dirname(self.bus_path))
+        except OSError:
+            pass
+        console.print("[✓] Shutdown complete")
@@ -1,50 +1,131 @@
 import asyncio
-from typing import Optional
+import contextlib
+import os
+import time
+from concurrent.futures import Executor
+from typing import Callable, Optional
 
-from ..protocol.messages import Message, MessageType
-from ..protocol.crypto import SecureChannel, KeyExchange
+from ..protocol.messages import (
+    Message, MessageType, PROTOCOL_VERSION, CAP_COUNTER_NONCE, CAP_RESUME, RESUME_RANDOM, hi_payload, parse_hi
+)
+from ..protocol.crypto import SecureChannel, KeyExchange, TicketKey
+from ..protocol.compression import agree, compressor_for
+from ..protocol.framing import StreamFrames, DEFAULT_MAX_FRAME
 from ..utils.logger import get_logger
+from ..utils.metrics import registry
 
 logger = get_logger("Connection")
 
+OVERFLOW_POLICIES = ("drop_oldest", "disconnect", "block")
+
+# What drop_oldest may throw away: chat a client can live without. Anything
+# else (GROUP_KEY, AUTH_OK, TICKET, SUP, PONG, transfer control...) changes
+# client state and is never dropped.
+DROPPABLE_TYPES = frozenset({
+    MessageType.TEXT, MessageType.DM, MessageType.GROUP, MessageType.HISTORY,
+    MessageType.TYPING, MessageType.ONLINE, MessageType.OFFLINE,
+})
+
+FRAMES_IN = registry.counter("aronanet_frames_in_total", "Frames read from clients")
+BYTES_IN = registry.counter("aronanet_bytes_in_total", "Bytes read from clients, length prefixes included")
+UNPACK = registry.histogram("aronanet_unpack_seconds", "Message.unpack per frame read, decrypt included")
+
 class ClientConnection:
     """Represents one client connection with encryption state"""
-    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 queue_size: int = 256, overflow_policy: str = "drop_oldest",
+                 capabilities: int = CAP_COUNTER_NONCE,
+                 flush_window: float = 0.0, batch_bytes: int = 64 * 1024,
+                 max_frame_size: int = DEFAULT_MAX_FRAME,
+                 key_exchange: Optional[KeyExchange] = None, executor: Optional[Executor] = None,
+                 tickets: Optional[TicketKey] = None, bulk_queue_size: int = 16,
+                 compress_min_size: int = 64, handshake_slots: Optional[asyncio.Semaphore] = None):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy} :/")
+
         self.reader =reader
         self.writer = writer
+        # A FrameReader protocol already yields frames, plain streams get a decoder in front
+        self.frames = reader if hasattr(reader, "read_frame") else StreamFrames(reader, max_frame_size)
         self.user = writer.get_extra_info("peername")
 
         self.username : Optional[str] = None
         self.authenticated = False
         self.channel: Optional[str] = None
+        self.version = 1
+        self.capabilities = capabilities
+        self.caps = 0
+        self.compress_min_size = compress_min_size
+        self.max_frame_size = max_frame_size
 
         self.secure_channel = SecureChannel()
-        self.key_exchange = KeyExchange()
+        self.key_exchange = key_exchange or KeyExchange()
+        # X25519 + HKDF run here when set, instead of on the event loop
+        self.executor = executor
+        # Caps how many connections run the key agreement at once, waiting for HI doesn't hold one
+        self.handshake_slots = handshake_slots
+        # Set when the client may skip HI + AUTH with a resumption ticket
+        self.tickets = tickets
+        self.resumed: Optional[str] = None
+
+        self.outbox: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.overflow_policy = overflow_policy
+        self.dropped = 0
+        self.flush_window = flush_window
+        self.batch_bytes = batch_bytes
+        # File chunks wait here, the writer sends at most one per write after any chat
+        self.bulk: asyncio.Queue = asyncio.Queue(maxsize=bulk_queue_size)
+        self._ready = asyncio.Event()
+        self._writer_task: Optional[asyncio.Task] = None
+
+        # Keepalive bookkeeping: last frame in, the pending wheel timer, and whether we're done
+        self.last_seen = time.monotonic()
+        self.timer = None
+        self.closed = False
 
         logger.info(f"New connection object for {self.user}")
 
     async def do_handshake(self) -> bool:
         """Perform key exchange handshake"""
         try:
-            logger.debug(f"Waiting for HI from {self.user}")
+            logger.debug("Waiting for HI from %s", self.user)
             msg = await self.read_msg(encrypted=False)
 
+            if msg.msg_type == MessageType.RESUME:
+                if await self._resume(msg):
+                    return True
+                # Turned down, the client carries on with a full HI on the same socket
+                msg = await self.read_msg(encrypted=False)
+
             if msg.msg_type != MessageType.HI:
                 logger.warning(f"Expected HI, got {msg.msg_type.name} from {self.user}")
                 return False
 
-            if len(msg.payload) != 32:
+            try:
+                client_pubkey, client_caps = parse_hi(msg.payload)
+
+            except ValueError:
                 logger.error(f"Invalid pubkey length from {self.user}")
                 return False
 
-            client_pubkey = msg.payload
-            shared_key = self.key_exchange.derive_shared_key(client_pubkey)
-            self.secure_channel.setup_shared_key(shared_key)
+            # Client offers its highest wire format in the HI header, we answer with what we'll both use
+            self.version = min(msg.version, PROTOCOL_VERSION)
+            self._agree(client_caps if self.version >= 3 else 0)
 
-            logger.info(f"Key exchange complete with {self.user} :)")
+            async with self.handshake_slots or contextlib.nullcontext():
+                if self.executor is None:
+                    self._derive_keys(client_pubkey)
+                else:
+                    await asyncio.get_running_loop().run_in_executor(self.executor, self._derive_keys, client_pubkey)
+
+            logger.info(f"Key exchange complete with {self.user}, wire v{self.version}, caps {self.caps:#04x} :)")
 
             server_pubkey = self.key_exchange.get_public_bytes()
-            reply = Message(msg_type=MessageType.HI, payload=server_pubkey)
+            reply = Message(
+                version=self.version,
+                msg_type=MessageType.HI,
+                payload=hi_payload(server_pubkey, self.version, self.caps)
+            )
             await self.send_msg(reply, encrypted=False)
 
             return True
@@ -53,28 +134,268 @@ class ClientConnection:
             logger.error(f"Handshake failed with {self.user}: {e}")
             return False
 
+    async def _resume(self, msg: Message) -> bool:
+        """
+        RESUME: client_random(32) + ticket -> server_random(32) + caps(1)
+
+        Keys come from the ticket secret and both randoms, so no X25519 and no
+        AUTH. An empty RESUME back means the ticket was no good.
+        """
+        self.version = min(msg.version, PROTOCOL_VERSION)
+        client_random, ticket = msg.payload[:RESUME_RANDOM], msg.payload[RESUME_RANDOM:]
+
+        try:
+            if self.tickets is None:
+                raise ValueError("Resumption is off")
+            username, secret, caps = self.tickets.open(ticket)
+
+        except ValueError as e:
+            logger.info(f"Refused resumption from {self.user}: {e}")
+            await self.send_msg(Message(version=self.version, msg_type=MessageType.RESUME), encrypted=False)
+            return False
+
+        self._agree(caps)
+        server_random = os.urandom(RESUME_RANDOM)
+        self.secure_channel.setup_resumed_keys(
+            secret, client_random + server_random, bool(self.caps & CAP_COUNTER_NONCE), is_server=True
+        )
+
+        reply = Message(version=self.version, msg_type=MessageType.RESUME, payload=server_random + bytes([self.caps]))
+        await self.send_msg(reply, encrypted=False)
+
+        self.resumed = username
+        logger.info(f"Resumed session for {username} from {self.user}, wire v{self.version} :)")
+        return True
+
+    def _agree(self, offered: int):
+        """Settle the capabilities and set up compression if one was agreed"""
+        self.caps = agree(offered & self.capabilities)
+        self.secure_channel.compressor = compressor_for(self.caps, self.compress_min_size, self.max_frame_size)
+
+    def new_ticket(self) -> Optional[Message]:
+        """TICKET for the current session keys, or None if resumption is off or not agreed"""
+        if self.tickets is None or not self.caps & CAP_RESUME:
+            return None
+
+        ticket = self.tickets.issue(self.username, self.secure_channel.resumption_secret(), self.caps)
+        return Message(msg_type=MessageType.TICKET, payload=ticket)
+
+    def _derive_keys(self, client_pubkey: bytes):
+        shared_key = self.key_exchange.derive_shared_key(client_pubkey)
+        if self.caps & CAP_COUNTER_NONCE:
+            self.secure_channel.setup_session_keys(shared_key, is_server=True)
+        else:
+            self.secure_channel.setup_shared_key(shared_key)
+
     async def read_msg(self, encrypted=True) -> Message:
         """Read one message from connection"""
-        length_bytes = await self.reader.readexactly(4)
-        pack_len = int.from_bytes(length_bytes, "big")
-
-        pack = await self.reader.readexactly(pack_len)
+        frame = await self.frames.read_frame()
+        self.last_seen = time.monotonic()
+        FRAMES_IN.inc()
+        BYTES_IN.inc(len(frame) + 4)
 
         channel = self.secure_channel if encrypted else None
-        msg = Message.unpack(pack, secure_channel=channel)
+        start = time.perf_counter_ns()
+        msg = Message.unpack(frame, secure_channel=channel)
+        UNPACK.since(start)
 
         return  msg
 
     async def send_msg(self, msg: Message, encrypted= True):
         """Send one message to connection"""
         channel  = self.secure_channel if encrypted else None
-        packed = msg.pack(secure_channel=channel)
+        size = msg.packed_size(channel, self.version)
+
+        frame = bytearray(4 + size)
+        frame[:4] = size.to_bytes(4, "big")
+        msg.pack_into(frame, 4, secure_channel=channel, version=self.version)
+
+        self.writer.write(frame)
+        await self.writer.drain()
+
+    async def send_batch(self, msgs: list[Message]):
+        """Pack several encrypted messages into one buffer, then one write + drain"""
+        channel = self.secure_channel
+        sizes = [msg.packed_size(channel, self.version) for msg in msgs]
+        frame = bytearray(sum(sizes) + 4 * len(msgs))
+
+        offset = 0
+        for msg, size in zip(msgs, sizes):
+            frame[offset:offset + 4] = size.to_bytes(4, "big")
+            msg.pack_into(frame, offset + 4, secure_channel=channel, version=self.version)
+            offset += 4 + size
 
-        self.writer.write(len(packed).to_bytes(4, "big") + packed)
+        self.writer.write(frame)
         await self.writer.drain()
 
+    def start_writer(self):
+        """Start the task that drains the outbound queue"""
+        if self._writer_task is None:
+            self._writer_task = asyncio.create_task(self._drain_outbox(), name=f"writer-{self.user}")
+
+    async def enqueue(self, msg: Message) -> bool:
+        """Queue message for the writer task, applying the overflow policy when full"""
+        if self.overflow_policy == "block":
+            await self.outbox.put(msg)
+            self._ready.set()
+            return True
+
+        try:
+            self.outbox.put_nowait(msg)
+            self._ready.set()
+            return True
+
+        except asyncio.QueueFull:
+            pass
+
+        if self.overflow_policy == "drop_oldest":
+            if self._drop_oldest_chat():
+                self.outbox.put_nowait(msg)
+                self._ready.set()
+                logger.warning(f"Outbound queue full for {self.user}, dropped oldest ({self.dropped} total) :/")
+                return True
+
+            if msg.msg_type in DROPPABLE_TYPES:
+                # Queue is all control frames, the new chat line is the one to go
+                self.dropped += 1
+                logger.warning(f"Outbound queue full for {self.user}, dropped new message ({self.dropped} total) :/")
+                return False
+
+        logger.warning(f"Outbound queue full for {self.user}, disconnecting :(")
+        self.abort()
+        return False
+
+    def offer(self, msg: Message) -> bool:
+        """Queue msg only if there's room right now: never blocks, drops or disconnects"""
+        try:
+            self.outbox.put_nowait(msg)
+        except asyncio.QueueFull:
+            return False
+
+        self._ready.set()
+        return True
+
+    def _drop_oldest_chat(self) -> bool:
+        """Remove the oldest droppable message from the full outbox, False if there is none"""
+        head = self.outbox.get_nowait()
+        if head.msg_type in DROPPABLE_TYPES:
+            # The usual case, no need to walk the queue
+            self.dropped += 1
+            return True
+
+        kept, dropped = [head], False
+        while not self.outbox.empty():
+            queued = self.outbox.get_nowait()
+            if not dropped and queued.msg_type in DROPPABLE_TYPES:
+                dropped = True
+                self.dropped += 1
+                continue
+            kept.append(queued)
+
+        for queued in kept:
+            self.outbox.put_nowait(queued)
+        return dropped
+
+    async def enqueue_bulk(self, msg: Message):
+        """Queue a file chunk, waits while the bulk queue is full (that's the flow control)"""
+        await self.bulk.put(msg)
+        self._ready.set()
+
+    def discard_bulk(self, match: Callable[[Message], bool]) -> int:
+        """Remove queued file chunks match() picks, returns how many went"""
+        kept, discarded = [], 0
+        while not self.bulk.empty():
+            queued = self.bulk.get_nowait()
+            if match(queued):
+                discarded += 1
+            else:
+                kept.append(queued)
+
+        for queued in kept:
+            self.bulk.put_nowait(queued)
+        return discarded
+
+    async def _next_batch(self) -> list[Message]:
+        """
+        Wait for one queued message, then take whatever else is ready
+
+        Everything queued before the writer wakes up goes out together. With a
+        flush window we also wait up to that long for more, until batch_bytes.
+        A bulk chunk rides along at the end, so a big transfer can't hold chat up.
+        """
+        while self.outbox.empty() and self.bulk.empty():
+            self._ready.clear()
+            await self._ready.wait()
+
+        batch = []
+        if not self.outbox.empty():
+            batch = await self._next_chat()
+
+        if not self.bulk.empty():
+            batch.append(self.bulk.get_nowait())
+        return batch
+
+    async def _next_chat(self) -> list[Message]:
+        msg = self.outbox.get_nowait()
+        batch = [msg]
+        size = msg.packed_size(self.secure_channel, self.version)
+        deadline = None
+
+        while size < self.batch_bytes:
+            if not self.outbox.empty():
+                msg = self.outbox.get_nowait()
+
+            elif self.flush_window > 0:
+                loop = asyncio.get_running_loop()
+                if deadline is None:
+                    deadline = loop.time() + self.flush_window
+
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+
+                try:
+                    msg = await asyncio.wait_for(self.outbox.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+
+            else:
+                break
+
+            batch.append(msg)
+            size += msg.packed_size(self.secure_channel, self.version)
+
+        return batch
+
+    async def _drain_outbox(self):
+        """Writer task: send queued messages in order, coalesced into as few writes as possible"""
+        try:
+            while True:
+                await self.send_batch(await self._next_batch())
+
+        except asyncio.CancelledError:
+            pass
+
+        except Exception as e:
+            logger.error(f"Writer for {self.user} failed: {e} :(")
+            self.abort()
+
+    def abort(self):
+        """Drop the connection without flushing, the read loop notices and cleans up"""
+        self.closed = True
+        transport = getattr(self.writer, "transport", None)
+        if transport is not None:
+            transport.abort()
+        else:
+            self.writer.close()
+
     async def close(self):
         """Close connection"""
+        self.closed = True
+        if self._writer_task and not self._writer_task.done():
+            self._writer_task.cancel()
+            await asyncio.gather(self._writer_task, return_exceptions=True)
+
         try:
             self.writer.close()
             await self.writer.wait_closed()
@@ -1,32 +1,73 @@
-from collections import deque
-from typing import  Dict, Set, Optional, List
+import time
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import  Dict, Set, Optional, List, Iterable
 
+from .cluster import BusKind, WorkerBus
 from .connection import ClientConnection
-from ..protocol.messages import Message
+from .message_log import MessageLog
+from ..protocol.crypto import GroupKey
+from ..protocol.messages import Message, MessageType, history_payload, message_type
 from ..utils.logger import get_logger
+from ..utils.metrics import registry
 
 logger = get_logger("ConnectionManager")
 
+FANOUT = registry.histogram("aronanet_fanout_seconds", "scream_to_channel, from call to last recipient queued")
+RECIPIENTS = registry.histogram("aronanet_fanout_recipients", "Recipients queued per broadcast", seconds=False)
+
+# With workers, each one numbers its channels on its own, so seqs sent to
+# clients carry (worker id + 1) above this bit and catch-up only trusts its own
+SEQ_BITS = 48
+
 class ConnectionManager:
     """Manages all active connections and routing"""
-    def __init__(self):
+    def __init__(self, group_channels: Optional[Iterable[str]] = None, history_size: int = 100,
+                 log: Optional[MessageLog] = None, history_channels: int = 1024):
         self.connections: Dict[str, ClientConnection] = {}
         self.channels: Dict[str, Set[str]] = {"general": set()}
         self.user_channels: Dict[str, str] = {}
-        self.history: Dict[str, deque] = {"general": deque(maxlen=100)}
+        # Where users were when they dropped, a resumed session goes back there
+        self.last_channels: Dict[str, str] = {}
+
+        # Last `history_size` TEXT broadcasts per channel as (seq, type, payload), seqs count from 1.
+        # At most `history_channels` channels, least recently used first, nobody's in the ones dropped
+        self.history_size = history_size
+        self.history_channels = history_channels
+        self.history: "OrderedDict[str, deque]" = OrderedDict(general=deque(maxlen=history_size))
+        self.seqs: Dict[str, int] = {}
+        # On disk copy of the same, so seqs and catch-up survive a restart
+        self.log = log
+        # Users who asked for HISTORY get live broadcasts as seq-tagged HISTORY frames instead of TEXT
+        self.history_readers: Set[str] = set()
+
+        # Channels in group-key mode get one ciphertext per broadcast instead of one per member
+        self.group_channels: Set[str] = set(group_channels or ())
+        self.group_keys: Dict[str, GroupKey] = {}
+
+        # Multi-worker mode: users on other workers, username -> (worker id, channel)
+        self.bus: Optional[WorkerBus] = None
+        self.remote_users: Dict[str, tuple[int, str]] = {}
 
         logger.info("ConnectionManager initialized")
 
-    def add_user(self, username: str, conn: ClientConnection):
-        """Add authenticated user"""
+    def add_user(self, username: str, conn: ClientConnection, resume: bool = False):
+        """Add authenticated user, a resumed session gets its old channel back"""
+        channel = self.user_channels.get(username) or self.last_channels.get(username)
+        self.last_channels.pop(username, None)
+        if not (resume and channel):
+            channel = "general"
+            self.history_readers.discard(username)
+
         if username in self.connections:
             logger.warning(f"User {username} already connected, kicking old session")
-            old_conn = self.connections[username]
-            old_conn.close()
+            # Abort rather than close: this can't wait on the old writer, and its
+            # handle_client teardown sees it no longer owns the name
+            self.connections[username].abort()
 
         self.connections[username] = conn
-        self.join_channel(username, "general")
-        conn.channel = "general"
+        self.join_channel(username, channel)
+        conn.channel = channel
 
         logger.info(f"{username} added to connection pool :)")
 
@@ -35,9 +76,12 @@ class ConnectionManager:
         if username in self.connections:
             if username in self.user_channels:
                 channel = self.user_channels[username]
+                self.last_channels[username] = channel
                 self.leave_channel(username, channel)
 
             del self.connections[username]
+            if self.bus:
+                self.bus.publish(BusKind.PRESENCE, username.encode(), b"")
             logger.info(f"{username} removed from pool :3")
 
     def get_connection(self, username: str) -> Optional[ClientConnection]:
@@ -59,6 +103,8 @@ class ConnectionManager:
         conn = self.get_connection(username)
         if conn:
             conn.channel = channel
+            if self.bus:
+                self.bus.publish(BusKind.PRESENCE, username.encode(), channel.encode())
 
         logger.info(f"{username} joined #{channel} :)")
 
@@ -74,44 +120,199 @@ class ConnectionManager:
         if username in self.user_channels:
             del self.user_channels[username]
 
+        if channel in self.group_keys:
+            # Rotate so the leaver can't read anything sent after this point
+            del self.group_keys[channel]
+
         logger.info(f"{username} left #{channel} :3")
 
-    async def scream_to_channel(self, channel: str, msg: Message, exclude: Optional[str] = None):
-        """Send message to everyone in channel"""
+    def enable_group_key(self, channel: str):
+        """Switch channel to group-key mode"""
+        self.group_channels.add(channel)
+        logger.info(f"Group key mode enabled for #{channel} :3")
+
+    def _group_envelope(self, channel: str, msg: Message) -> tuple[GroupKey, Message]:
+        """Encrypt msg once under the channel key"""
+        key = self.group_keys.get(channel)
+        if key is None:
+            key = self.group_keys[channel] = GroupKey()
+            logger.info(f"New group key for #{channel} :3")
+
+        envelope = Message(msg_type=MessageType.GROUP, payload=key.seal(msg.msg_type, msg.payload))
+        return key, envelope
+
+    async def scream_to_channel(self, channel: str, msg: Message, exclude: Optional[str] = None, relay: bool = True):
+        """Queue message for everyone in channel, on every worker unless relay is off"""
+        start = time.perf_counter_ns()
+        if relay and self.bus:
+            self.bus.publish(
+                BusKind.CHANNEL, channel.encode(), (exclude or "").encode(), bytes((msg.msg_type,)), msg.payload
+            )
+
+        tagged = msg
+        if msg.msg_type == MessageType.TEXT:
+            seq = self._wire_seq(self._record(channel, msg))
+            record = history_payload(seq, [(seq, msg.msg_type, msg.payload)])
+            tagged = Message(msg_type=MessageType.HISTORY, payload=record)
+
         if channel not in self.channels:
-            logger.warning(f"Tried to broadcast to non-existent channel #{channel} :/")
+            if relay:
+                logger.warning(f"Tried to broadcast to non-existent channel #{channel} :/")
             return
 
+        key = None
+        if channel in self.group_channels:
+            plain = msg
+            key, msg = self._group_envelope(channel, msg)
+            tagged = msg if tagged is plain else self._group_envelope(channel, tagged)[1]
+
         sent_count = 0
         for username in list(self.channels[channel]):
             if username == exclude:
                 continue
 
             conn = self.get_connection(username)
-            if conn:
-                try:
-                    await conn.send_msg(msg)
-                    sent_count += 1
+            if not conn:
+                continue
+
+            if key and username not in key.holders:
+                key_msg = Message(msg_type=MessageType.GROUP_KEY, payload=key.to_payload(channel))
+                if not await conn.enqueue(key_msg):
+                    continue
+                key.holders.add(username)
+
+            if await conn.enqueue(tagged if username in self.history_readers else msg):
+                sent_count += 1
+
+        FANOUT.since(start)
+        RECIPIENTS.record(sent_count)
+        logger.debug("Broadcast to #%s: %d users :3", channel, sent_count)
+
+    def _record(self, channel: str, msg: Message) -> int:
+        """Append a broadcast to the channel's ring buffer, returns its seq"""
+        seq = self._head(channel) + 1
+        self.seqs[channel] = seq
 
-                except Exception as e:
-                    logger.error(f"Failed to send to {username}: {e} :(")
+        buf = self.history.get(channel)
+        if buf is None:
+            buf = self.history[channel] = deque(maxlen=self.history_size)
+            self._forget_idle_history()
+        else:
+            self.history.move_to_end(channel)
+        buf.append((seq, msg.msg_type, msg.payload))
 
-        logger.debug(f"Broadcast to #{channel}: {sent_count} users :3")
+        if self.log:
+            try:
+                self.log.append(channel, seq, msg.msg_type, msg.payload)
+            except OSError as e:
+                # Delivery doesn't depend on the disk, the message just won't survive a restart
+                logger.error(f"Couldn't log #{channel} seq {seq}: {e} :(")
+        return seq
+
+    def _forget_idle_history(self):
+        """Drop the least recently used empty channels' history and seqs past history_channels"""
+        excess = len(self.history) - self.history_channels
+        if excess <= 0:
+            return
+
+        for channel in [c for c in self.history if c not in self.channels][:excess]:
+            del self.history[channel]
+            self.seqs.pop(channel, None)
+
+    def _head(self, channel: str) -> int:
+        """Newest seq in channel, picked up from the log after a restart"""
+        if channel not in self.seqs and self.log:
+            self.seqs[channel] = self.log.head(channel)
+        return self.seqs.get(channel, 0)
+
+    def catch_up(self, username: str, since: int) -> Message:
+        """
+        One HISTORY frame with everything in the user's channel after `since`
+
+        A `since` past the head means we restarted without a log and the
+        numbers started over, so they get the whole buffer. So does one
+        another worker handed out, its numbers aren't ours. At most
+        `history_size` messages are sent, from memory when it has them and
+        from the log otherwise. From here on the user also gets live
+        broadcasts as HISTORY so they always know the latest seq.
+        """
+        self.history_readers.add(username)
+        channel = self.user_channels.get(username, "general")
+        head = self._head(channel)
+        buf = self.history.get(channel, ())
+        since = self._local_seq(since)
+
+        if since > head:
+            since = 0
+        since = max(since, head - self.history_size)
+
+        if self.log and (not buf or since + 1 < buf[0][0]):
+            records = self.log.read(channel, since, limit=head - since)
+        else:
+            # Seqs in the buffer are consecutive, so skip straight to the first one we need
+            start = max(0, since - buf[0][0] + 1) if buf else 0
+            records = islice(buf, start, None)
+
+        records = ((self._wire_seq(seq), msg_type, payload) for seq, msg_type, payload in records)
+        return Message(msg_type=MessageType.HISTORY, payload=history_payload(self._wire_seq(head), records))
+
+    def _wire_seq(self, seq: int) -> int:
+        """Seq as clients see it, tagged with this worker when there are several"""
+        if self.bus is None or not seq:
+            return seq
+        return (self.bus.worker_id + 1) << SEQ_BITS | seq
+
+    def _local_seq(self, since: int) -> int:
+        """A client's `since` in our own numbering, 0 (everything) if another worker handed it out"""
+        if self.bus is None:
+            return since
+        if since >> SEQ_BITS != self.bus.worker_id + 1:
+            return 0
+        return since & ((1 << SEQ_BITS) - 1)
 
     async def scream_to_user(self, username: str, msg: Message) -> bool:
-        """Send direct message to specific user"""
+        """Queue direct message for specific user"""
         conn = self.get_connection(username)
         if not conn:
+            if self.bus and username in self.remote_users:
+                self.bus.publish(BusKind.USER, username.encode(), bytes((msg.msg_type,)), msg.payload)
+                return True
+
             logger.warning(f"User {username} not connected")
             return False
 
-        try:
-            await conn.send_msg(msg)
-            return True
+        return await conn.enqueue(msg)
 
-        except Exception as e:
-            logger.error(f"Failed to send DM to {username}: {e}")
-            return False
+    def attach_bus(self, bus: WorkerBus):
+        """Share routing and presence with the other workers"""
+        self.bus = bus
+        bus.on_message = self._on_bus
+
+    async def _on_bus(self, kind: BusKind, origin: int, fields: List[bytes]):
+        """Deliver something another worker published"""
+        if kind == BusKind.CHANNEL:
+            channel, exclude, msg_type, payload = fields
+            msg = Message(msg_type=message_type(msg_type[0]), payload=payload)
+            await self.scream_to_channel(channel.decode(), msg, exclude=exclude.decode() or None, relay=False)
+
+        elif kind == BusKind.USER:
+            username, msg_type, payload = fields
+            conn = self.get_connection(username.decode())
+            if conn:
+                await conn.enqueue(Message(msg_type=message_type(msg_type[0]), payload=payload))
+
+        elif kind == BusKind.PRESENCE:
+            username, channel = fields[0].decode(), fields[1].decode()
+            if channel:
+                self.remote_users[username] = (origin, channel)
+                conn = self.connections.get(username)
+                if conn:
+                    # Same rule as add_user: newest login wins
+                    logger.warning(f"User {username} logged in on worker {origin}, kicking local session")
+                    conn.abort()
+
+            elif self.remote_users.get(username, (None,))[0] == origin:
+                del self.remote_users[username]
 
     def get_channel_users(self, channel: str) -> List[str]:
         """Get list of users in channel"""
@@ -123,6 +324,10 @@ class ConnectionManager:
         """Get all connected users"""
         return list(self.connections.keys())
 
+    def get_online_users(self) -> List[str]:
+        """Get connected users across all workers"""
+        return list(self.connections.keys() | self.remote_users.keys())
+
     def get_user_channel(self, username: str) -> Optional[str]:
         """Get which channel user is in"""
         return self.user_channels.get(username)
\ No newline at end of file
@@ -0,0 +1,127 @@
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Optional
+
+from ..protocol.crypto import KeyExchange
+from ..utils.logger import get_logger
+
+logger = get_logger("Handshake")
+
+class TokenBucket:
+    """`rate` tokens per second, up to `burst` saved up"""
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    @property
+    def full(self) -> bool:
+        return self.tokens + (time.monotonic() - self.stamp) * self.rate >= self.burst
+
+
+def _generate(count: int) -> list[KeyExchange]:
+    return [KeyExchange() for _ in range(count)]
+
+
+class KeyPool:
+    """Ephemeral X25519 keypairs generated ahead of time, off the event loop"""
+    def __init__(self, size: int = 256, executor: Optional[ThreadPoolExecutor] = None, batch: int = 32):
+        self.size = size
+        self.executor = executor
+        self.batch = batch
+        self.keys: deque[KeyExchange] = deque()
+        self.misses = 0
+        self._refill_task: Optional[asyncio.Task] = None
+
+    def take(self) -> KeyExchange:
+        """A fresh keypair, made on the spot if the pool ran dry"""
+        key = self.keys.popleft() if self.keys else None
+        self._kick()
+        if key is not None:
+            return key
+
+        self.misses += 1
+        return KeyExchange()
+
+    def start(self):
+        self._kick()
+
+    def stop(self):
+        if self._refill_task:
+            self._refill_task.cancel()
+
+    def _kick(self):
+        if self.size and len(self.keys) < self.size // 2 and not self._refill_task:
+            self._refill_task = asyncio.get_running_loop().create_task(self._refill())
+
+    async def _refill(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while len(self.keys) < self.size:
+                count = min(self.batch, self.size - len(self.keys))
+                self.keys.extend(await loop.run_in_executor(self.executor, _generate, count))
+
+        finally:
+            self._refill_task = None
+
+
+class HandshakeGate:
+    """
+    Keeps a reconnect storm from starving connected clients
+
+    Per-IP token bucket in front, then at most `concurrency` key agreements
+    at once, with the X25519 work on a small thread pool and keypairs from
+    a KeyPool. A connection only takes a slot once its HI has arrived, so
+    slow or idle sockets can't hold them. threads=0 / pool_size=0 do the
+    crypto inline like before.
+    """
+    def __init__(self, concurrency: int = 64, threads: int = 2, pool_size: int = 256,
+                 rate: float = 10.0, burst: float = 30.0, exempt: Iterable[str] = ()):
+        self.slots = asyncio.Semaphore(concurrency)
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix="handshake") if threads else None
+        self.keys = KeyPool(pool_size, self.executor)
+        self.rate = rate
+        self.burst = burst
+        self.exempt = set(exempt)
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.rejected = 0
+
+    def allow(self, ip: Optional[str]) -> bool:
+        """Spend one handshake token for this IP"""
+        if not self.rate or ip is None or ip in self.exempt:
+            return True
+
+        if len(self.buckets) > 10_000:
+            # Forget IPs that are back to a full bucket, they'd get one anyway
+            self.buckets = {k: b for k, b in self.buckets.items() if not b.full}
+
+        bucket = self.buckets.get(ip)
+        if bucket is None:
+            bucket = self.buckets[ip] = TokenBucket(self.rate, self.burst)
+
+        if bucket.take():
+            return True
+
+        self.rejected += 1
+        return False
+
+    def start(self):
+        self.keys.start()
+
+    def stop(self):
+        self.keys.stop()
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,100 @@
+import asyncio
+import time
+from typing import Dict, Optional
+
+from ..protocol.messages import Message, MessageType
+from ..utils.logger import get_logger
+from .connection import ClientConnection
+from .connection_manager import ConnectionManager
+from .router import router
+
+logger = get_logger("Typing")
+
+class TypingIndicators:
+    """
+    Coalesced "who is typing" per channel
+
+    A TYPING from a client only refreshes its deadline. Every `interval`
+    seconds each channel whose typers changed (someone started, stopped or
+    went quiet for `timeout`) gets one TYPING listing everyone still typing,
+    empty once nobody is. So a channel sees at most one TYPING per interval
+    no matter how many people are hammering keys.
+    """
+    def __init__(self, conn_manager: ConnectionManager, interval: float = 1.0, timeout: float = 5.0):
+        self.conn_manager = conn_manager
+        self.interval = interval
+        self.timeout = timeout
+        self.typers: Dict[str, Dict[str, float]] = {}  # channel -> username -> deadline
+        self.where: Dict[str, str] = {}  # username -> channel they're typing in
+        self.dirty: set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def typing(self, username: str, channel: Optional[str], now: Optional[float] = None):
+        if not channel:
+            return
+
+        if self.where.get(username, channel) != channel:
+            self.stopped(username)
+
+        typers = self.typers.setdefault(channel, {})
+        if username not in typers:
+            self.dirty.add(channel)
+            self.where[username] = channel
+        typers[username] = (now or time.monotonic()) + self.timeout
+
+    def stopped(self, username: str):
+        """Sent a message, switched channel or left, don't wait for the timeout"""
+        channel = self.where.pop(username, None)
+        typers = self.typers.get(channel)
+        if typers is None:
+            return
+
+        typers.pop(username, None)
+        self.dirty.add(channel)
+        if not typers:
+            del self.typers[channel]
+
+    async def flush(self, now: Optional[float] = None):
+        """Expire quiet typers, then one TYPING per changed channel"""
+        now = now or time.monotonic()
+        for channel, typers in list(self.typers.items()):
+            expired = [username for username, deadline in typers.items() if deadline <= now]
+            for username in expired:
+                del typers[username]
+                del self.where[username]
+            if expired:
+                self.dirty.add(channel)
+            if not typers:
+                del self.typers[channel]
+
+        dirty, self.dirty = self.dirty, set()
+        for channel in dirty:
+            names = "\n".join(self.typers.get(channel, ()))
+            # Each worker only knows its own typers, so don't relay a partial list
+            await self.conn_manager.scream_to_channel(
+                channel, Message(msg_type=MessageType.TYPING, payload=names.encode()), relay=False
+            )
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Typing flush failed: {e} :(")
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+@router.route(MessageType.TYPING)
+async def on_typing(server, conn: ClientConnection, msg: Message):
+    """Payload is ignored, the coalesced frame names the typers"""
+    server.typing.typing(conn.username, server.conn_manager.get_user_channel(conn.username))
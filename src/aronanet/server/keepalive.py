@@ -0,0 +1,88 @@
+import time
+
+from ..protocol.messages import Message, MessageType
+from ..utils.logger import get_logger
+from .connection import ClientConnection
+from .router import router
+from .timers import TimerWheel
+
+logger = get_logger("Keepalive")
+
+class Keepalive:
+    """
+    Reaps sockets that stopped talking, on a shared TimerWheel
+
+    Before AUTH a connection gets `handshake_timeout` seconds to finish HI
+    and AUTH. After that, any frame counts as activity (read_msg stamps
+    conn.last_seen). A connection quiet for `interval` gets a PING, and one
+    quiet for `timeout` is aborted, which also catches half-open sockets
+    behind the bore tunnel. Timers don't move on every frame, they check
+    last_seen when they fire and re-arm for the rest.
+    """
+    def __init__(self, wheel: TimerWheel, interval: float = 30.0, timeout: float = 90.0,
+                 handshake_timeout: float = 10.0):
+        self.wheel = wheel
+        self.interval = interval
+        self.timeout = timeout
+        self.handshake_timeout = handshake_timeout
+        self.reaped = 0
+
+    def watch(self, conn: ClientConnection):
+        """New socket, start the handshake + AUTH deadline"""
+        if self.handshake_timeout:
+            conn.timer = self.wheel.schedule(self.handshake_timeout, self._handshake_deadline, conn)
+
+    def authenticated(self, conn: ClientConnection):
+        """Swap the handshake deadline for the idle check"""
+        self.forget(conn)
+        if self.interval or self.timeout:
+            conn.timer = self.wheel.schedule(self.interval or self.timeout, self._check_idle, conn)
+
+    def forget(self, conn: ClientConnection):
+        if conn.timer is not None:
+            conn.timer.cancel()
+            conn.timer = None
+
+    def _handshake_deadline(self, conn: ClientConnection):
+        conn.timer = None
+        if not conn.authenticated and not conn.closed:
+            logger.info(f"{conn.user} didn't finish the handshake in {self.handshake_timeout}s, dropping :/")
+            self.reaped += 1
+            conn.abort()
+
+    def _check_idle(self, conn: ClientConnection):
+        conn.timer = None
+        if conn.closed:
+            return
+
+        idle = time.monotonic() - conn.last_seen
+        if self.timeout and idle >= self.timeout:
+            logger.info(f"{conn.username} silent for {idle:.0f}s, dropping :/")
+            self.reaped += 1
+            conn.abort()
+            return
+
+        waits = []
+        if self.interval:
+            if idle >= self.interval:
+                # Never wait on the outbox here: under the block policy a half-open socket's
+                # queue never drains. A full queue skips the PING and the timeout reaps it
+                if not conn.offer(Message(msg_type=MessageType.PING)):
+                    logger.debug("Outbox full for %s, skipping PING", conn.username)
+                waits.append(self.interval)
+            else:
+                waits.append(self.interval - idle)
+        if self.timeout:
+            waits.append(self.timeout - idle)
+
+        wait = min(waits)
+        conn.timer = self.wheel.schedule(wait, self._check_idle, conn)
+
+
+@router.route(MessageType.PING)
+async def on_ping(server, conn: ClientConnection, msg: Message):
+    await conn.enqueue(Message(msg_type=MessageType.PONG, payload=msg.payload))
+
+@router.route(MessageType.PONG)
+async def on_pong(server, conn: ClientConnection, msg: Message):
+    """Nothing to do, read_msg already stamped last_seen"""
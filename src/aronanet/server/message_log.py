@@ -0,0 +1,329 @@
+import asyncio
+import mmap
+import os
+import struct
+import time
+from bisect import bisect_right
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from ..protocol.messages import Message, MessageType, PROTOCOL_VERSION
+from ..utils.logger import get_logger
+
+logger = get_logger("MessageLog")
+
+# Record on disk: seq(8) timestamp(8) length(4) | Message.pack() body (plaintext, with CRC)
+RECORD = struct.Struct(">QdI")
+# Index slots per segment, each the end offset of one record in the .log file
+INDEX_ENTRIES = 65536
+
+class Segment:
+    """
+    One .log file of records starting at seq `base`, plus its .idx
+
+    The index is mmap'd: slot i holds where record base+i ends, so any seq
+    is one lookup and one read away. Appends only touch memory; flush_sync
+    writes them out and is meant to run off the event loop.
+    """
+    def __init__(self, path: Path, base: int, entries: int = INDEX_ENTRIES):
+        self.base = base
+        self.entries = entries
+        self.log_path = path / f"{base:020d}.log"
+        self.idx_path = path / f"{base:020d}.idx"
+
+        self.fd = os.open(self.log_path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o600)
+        idx_fd = os.open(self.idx_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(idx_fd).st_size < entries * 8:
+                os.ftruncate(idx_fd, entries * 8)
+            self.index = mmap.mmap(idx_fd, entries * 8)
+        finally:
+            os.close(idx_fd)
+        self.ends = memoryview(self.index).cast("Q")
+
+        # Bytes on disk, bytes being written right now, bytes only in memory
+        self.written = os.fstat(self.fd).st_size
+        self.inflight = b""
+        self.tail = bytearray()
+        self.count = self._recover()
+
+    def _recover(self) -> int:
+        """Records that made it to disk, dropping index slots and bytes a crash left half done"""
+        lo, hi = 0, self.entries
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.ends[mid]:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        count = lo
+        while count and self.ends[count - 1] > self.written:
+            count -= 1
+        for i in range(count, lo):
+            self.ends[i] = 0
+
+        end = self.ends[count - 1] if count else 0
+        if self.written > end:
+            os.ftruncate(self.fd, end)
+            self.written = end
+        return count
+
+    @property
+    def size(self) -> int:
+        return self.written + len(self.inflight) + len(self.tail)
+
+    @property
+    def head(self) -> int:
+        return self.base + self.count - 1
+
+    def full(self, max_bytes: int) -> bool:
+        return self.count >= self.entries or self.size >= max_bytes
+
+    def append(self, record: bytes):
+        self.tail += record
+        self.ends[self.count] = self.size
+        self.count += 1
+
+    def record(self, seq: int) -> bytes:
+        """Raw record for seq, from disk or from whatever hasn't been written yet"""
+        i = seq - self.base
+        start = self.ends[i - 1] if i else 0
+        end = self.ends[i]
+
+        if start >= self.written + len(self.inflight):
+            offset = start - self.written - len(self.inflight)
+            return bytes(self.tail[offset:offset + end - start])
+        if start >= self.written:
+            return self.inflight[start - self.written:end - self.written]
+        return os.pread(self.fd, end - start, start)
+
+    def start_flush(self) -> bool:
+        """Hand the in-memory tail to flush_sync, False if there's nothing to write"""
+        if not self.tail:
+            return False
+        self.inflight, self.tail = bytes(self.tail), bytearray()
+        return True
+
+    def flush_sync(self):
+        """Write + fsync the inflight bytes, then the index (blocking)"""
+        view = memoryview(self.inflight)
+        while view:
+            view = view[os.write(self.fd, view):]
+        os.fsync(self.fd)
+        self.index.flush()
+
+    def finish_flush(self):
+        self.written += len(self.inflight)
+        self.inflight = b""
+
+    def close(self):
+        self.ends.release()
+        self.index.close()
+        os.close(self.fd)
+
+    def delete(self):
+        self.close()
+        self.log_path.unlink(missing_ok=True)
+        self.idx_path.unlink(missing_ok=True)
+
+
+class ChannelLog:
+    """Segments of one channel, oldest first"""
+    def __init__(self, path: Path, segment_bytes: int):
+        self.path = path
+        self.segment_bytes = segment_bytes
+        path.mkdir(parents=True, exist_ok=True)
+
+        self.segments: List[Segment] = [Segment(path, int(p.stem)) for p in sorted(path.glob("*.log"))]
+        # A crash can leave an empty segment behind, nothing to read in it
+        while self.segments and not self.segments[-1].count and len(self.segments) > 1:
+            self.segments.pop().delete()
+
+    @property
+    def head(self) -> int:
+        return self.segments[-1].head if self.segments and self.segments[-1].count else 0
+
+    @property
+    def size(self) -> int:
+        return sum(seg.size for seg in self.segments)
+
+    def append(self, seq: int, record: bytes):
+        seg = self.segments[-1] if self.segments else None
+        if seg is None or seg.full(self.segment_bytes) or seq != seg.base + seg.count:
+            if seg is not None and not seg.count:
+                self.segments.pop().delete()
+            seg = Segment(self.path, seq)
+            self.segments.append(seg)
+            logger.info(f"New log segment {seg.log_path.name} in {self.path.name} :3")
+
+        seg.append(record)
+
+    def read(self, since: int, limit: Optional[int] = None) -> List[bytes]:
+        """Raw records with seq > since, at most `limit` of them"""
+        if not self.segments:
+            return []
+
+        first = max(since + 1, self.segments[0].base)
+        last = self.head if limit is None else min(self.head, first + limit - 1)
+        at = bisect_right([seg.base for seg in self.segments], first) - 1
+
+        records = []
+        for seg in self.segments[at:]:
+            stop = min(last, seg.head)
+            records.extend(seg.record(seq) for seq in range(max(first, seg.base), stop + 1))
+            if stop >= last:
+                break
+        return records
+
+    def expire(self, max_bytes: int, max_age: float):
+        """Drop whole segments from the front, never the one being written"""
+        now = time.time()
+        while len(self.segments) > 1:
+            oldest = self.segments[0]
+            too_big = max_bytes and self.size > max_bytes
+            too_old = max_age and now - os.fstat(oldest.fd).st_mtime > max_age
+            if not (too_big or too_old):
+                break
+
+            self.segments.pop(0).delete()
+            logger.info(f"Expired log segment {oldest.log_path.name} in {self.path.name} :3")
+
+    def close(self):
+        for seg in self.segments:
+            seg.close()
+
+
+def _flush_all(segments: List[Segment]):
+    for seg in segments:
+        seg.flush_sync()
+
+
+class MessageLog:
+    """
+    Append-only per-channel history on disk, survives restarts
+
+    append() only buffers, a background task writes and fsyncs every
+    `flush_interval` seconds on a worker thread so the chat path never
+    waits on disk. Channel directories are the hex of the channel name.
+
+    Channel logs are opened on first use and at most `max_open` stay open
+    (each holds an fd and an mmap'd index per segment). The least recently
+    used one is closed past that, after its buffered records are flushed,
+    and reopened from disk when it's needed again. Retention runs on every
+    flush for open channels and when a closed one is reopened.
+    """
+    def __init__(self, root: Path, segment_bytes: int = 8 * 1024 * 1024, retention_bytes: int = 256 * 1024 * 1024,
+                 retention_days: float = 30, flush_interval: float = 1.0, max_open: int = 256):
+        self.root = Path(root)
+        self.segment_bytes = segment_bytes
+        self.retention_bytes = retention_bytes
+        self.retention_age = retention_days * 86400
+        self.flush_interval = flush_interval
+        self.max_open = max(1, max_open)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+        # Open logs, least recently used first
+        self.channels: "OrderedDict[str, ChannelLog]" = OrderedDict()
+        # Evicted logs still holding records that aren't on disk, closed by the next flush
+        self._closing: Dict[str, ChannelLog] = {}
+
+        self._lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        stored = sum(1 for path in self.root.iterdir() if path.is_dir())
+        logger.info(f"Message log at {self.root} with {stored} channels :)")
+
+    def _open(self, channel: str, create: bool = False) -> Optional[ChannelLog]:
+        """The channel's log, opened (or created) if needed, None if there is none"""
+        log = self.channels.get(channel)
+        if log is not None:
+            self.channels.move_to_end(channel)
+            return log
+
+        log = self._closing.pop(channel, None)
+        if log is None:
+            path = self.root / channel.encode().hex()
+            if not create and not path.is_dir():
+                return None
+            log = ChannelLog(path, self.segment_bytes)
+            log.expire(self.retention_bytes, self.retention_age)
+
+        self.channels[channel] = log
+        while len(self.channels) > self.max_open:
+            old_channel, old = self.channels.popitem(last=False)
+            if any(seg.tail or seg.inflight for seg in old.segments):
+                self._closing[old_channel] = old
+            else:
+                old.close()
+        return log
+
+    def head(self, channel: str) -> int:
+        """Newest seq stored for channel, 0 if none"""
+        log = self._open(channel)
+        return log.head if log else 0
+
+    def append(self, channel: str, seq: int, msg_type: MessageType, payload: bytes):
+        log = self._open(channel, create=True)
+        body = Message(version=PROTOCOL_VERSION, msg_type=msg_type, payload=payload).pack()
+        log.append(seq, RECORD.pack(seq, time.time(), len(body)) + body)
+
+    def read(self, channel: str, since: int, limit: Optional[int] = None) -> List[tuple[int, MessageType, bytes]]:
+        """(seq, type, payload) for every stored message after `since`, oldest first"""
+        log = self._open(channel)
+        if log is None:
+            return []
+
+        records = []
+        for raw in log.read(since, limit):
+            seq, _, length = RECORD.unpack_from(raw)
+            msg = Message.unpack(raw[RECORD.size:RECORD.size + length])
+            records.append((seq, msg.msg_type, msg.payload))
+        return records
+
+    def last(self, channel: str, count: int) -> List[tuple[int, MessageType, bytes]]:
+        """The newest `count` messages"""
+        return self.read(channel, max(0, self.head(channel) - count))
+
+    def start(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Message log flush failed: {e} :(")
+
+    async def flush(self):
+        """Write everything buffered so far, close evicted logs, then apply retention"""
+        async with self._lock:
+            logs = [*self.channels.values(), *self._closing.values()]
+            dirty = [seg for log in logs for seg in log.segments if seg.start_flush()]
+            if dirty:
+                await asyncio.to_thread(_flush_all, dirty)
+                for seg in dirty:
+                    seg.finish_flush()
+
+            # One reopened and evicted again during the write may have new records, it waits a round
+            for channel, log in list(self._closing.items()):
+                if not any(seg.tail or seg.inflight for seg in log.segments):
+                    del self._closing[channel]
+                    log.close()
+
+            for log in self.channels.values():
+                log.expire(self.retention_bytes, self.retention_age)
+
+    async def close(self):
+        """Final flush, then close every file"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+
+        await self.flush()
+        for log in self.channels.values():
+            log.close()
+        self.channels.clear()
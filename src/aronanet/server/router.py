@@ -0,0 +1,162 @@
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Awaitable, Callable, Dict, Optional
+
+from rich.console import Console
+
+from ..protocol.messages import Message, MessageType
+from ..utils.logger import get_logger
+from ..utils.metrics import Histogram, registry
+from .connection import ClientConnection
+
+if TYPE_CHECKING:
+    from .server import AronaServer
+
+console = Console()
+logger = get_logger("Router")
+
+# Return False to end the session, anything else keeps reading
+Handler = Callable[["AronaServer", ClientConnection, Message], Awaitable[Optional[bool]]]
+
+@dataclass(slots=True)
+class HandlerStats:
+    """Per-type counters, times in nanoseconds"""
+    count: int = 0
+    total_ns: int = 0
+    max_ns: int = 0
+
+    @property
+    def avg_us(self) -> float:
+        return self.total_ns / self.count / 1000 if self.count else 0.0
+
+
+class Router:
+    """MessageType -> async handler, one dict lookup per message, with timing per type"""
+    def __init__(self):
+        self.handlers: Dict[MessageType, Handler] = {}
+        self.stats: Dict[MessageType, HandlerStats] = {}
+        self.latency: Dict[MessageType, Histogram] = {}
+        self.unhandled = 0
+
+    def route(self, *msg_types: MessageType) -> Callable[[Handler], Handler]:
+        """Decorator: register the handler for these types, replacing any earlier one"""
+        def register(handler: Handler) -> Handler:
+            for msg_type in msg_types:
+                self.handlers[msg_type] = handler
+                self.stats.setdefault(msg_type, HandlerStats())
+                self.latency[msg_type] = registry.histogram(
+                    "aronanet_dispatch_seconds", "Handler time per message", type=msg_type.name
+                )
+            return handler
+        return register
+
+    async def dispatch(self, server: "AronaServer", conn: ClientConnection, msg: Message) -> bool:
+        """Run the handler for msg, False means the session is over"""
+        handler = self.handlers.get(msg.msg_type)
+        if handler is None:
+            self.unhandled += 1
+            logger.debug("No handler for %s from %s", msg.msg_type.name, conn.username)
+            return True
+
+        start = time.perf_counter_ns()
+        try:
+            result = await handler(server, conn, msg)
+        finally:
+            elapsed = time.perf_counter_ns() - start
+            stats = self.stats[msg.msg_type]
+            stats.count += 1
+            stats.total_ns += elapsed
+            if elapsed > stats.max_ns:
+                stats.max_ns = elapsed
+            self.latency[msg.msg_type].record(elapsed)
+
+        return result is not False
+
+    def report(self) -> str:
+        """One line per type that has been handled"""
+        lines = [
+            f"{msg_type.name}: {s.count} msgs, avg {s.avg_us:.1f} us, max {s.max_ns / 1000:.1f} us"
+            for msg_type, s in self.stats.items() if s.count
+        ]
+        if self.unhandled:
+            lines.append(f"unhandled: {self.unhandled} msgs")
+        return "\n".join(lines)
+
+
+# Default handlers, AronaServer uses this router unless given another
+router = Router()
+
+@router.route(MessageType.TEXT)
+async def on_text(server: "AronaServer", conn: ClientConnection, msg: Message):
+    server.typing.stopped(conn.username)
+    channel = server.conn_manager.get_user_channel(conn.username)
+    formatted = f'[{conn.username}] {msg.payload.decode()}'.encode()
+    broadcast_msg = Message(
+        msg_type=MessageType.TEXT,
+        payload=formatted
+    )
+
+    await server.conn_manager.scream_to_channel(channel, broadcast_msg, exclude=conn.username)
+
+@router.route(MessageType.DM)
+async def on_dm(server: "AronaServer", conn: ClientConnection, msg: Message):
+    target, dm = msg.payload.decode().split(':', 1)
+    formatted = f'[{conn.username}] {dm}'.encode()
+    dm_msg = Message(
+        msg_type=MessageType.DM,
+        payload=formatted
+    )
+
+    await server.conn_manager.scream_to_user(target, dm_msg)
+
+def channel_name(payload: bytes, max_bytes: int) -> Optional[str]:
+    """Channel a SUP asks for, None if it's empty, longer than max_bytes or not printable text"""
+    if not payload or len(payload) > max_bytes:
+        return None
+    try:
+        name = payload.decode()
+    except UnicodeDecodeError:
+        return None
+    return name if name.isprintable() else None
+
+@router.route(MessageType.SUP)
+async def on_sup(server: "AronaServer", conn: ClientConnection, msg: Message):
+    username = conn.username
+    new_channel = channel_name(msg.payload, server.max_channel_name)
+    if new_channel is None:
+        logger.info(f"{username} asked for a bad channel name ({len(msg.payload)} bytes), refused :/")
+        await conn.enqueue(Message(msg_type=MessageType.SUP, payload=b"Refused #" + msg.payload))
+        return
+
+    old_channel = server.conn_manager.get_user_channel(username)
+    server.typing.stopped(username)
+
+    if old_channel:
+        leave_msg = Message(
+            msg_type=MessageType.OFFLINE,
+            payload=f'{username} left'.encode()
+        )
+        await server.conn_manager.scream_to_channel(old_channel, leave_msg)
+
+    server.conn_manager.join_channel(username, new_channel)
+    join_msg = Message(
+        msg_type=MessageType.ONLINE,
+        payload=f'{username} joined'.encode()
+    )
+    await server.conn_manager.scream_to_channel(new_channel, join_msg, exclude=username)
+
+    confirm = Message(
+        msg_type=MessageType.SUP,
+        payload=f'Joined #{new_channel}'.encode()
+    )
+    await conn.enqueue(confirm)
+
+@router.route(MessageType.HISTORY)
+async def on_history(server: "AronaServer", conn: ClientConnection, msg: Message):
+    since = int.from_bytes(msg.payload[:8], "big")
+    await conn.enqueue(server.conn_manager.catch_up(conn.username, since))
+
+@router.route(MessageType.ADIOS)
+async def on_adios(server: "AronaServer", conn: ClientConnection, msg: Message):
+    console.print(f"[!] {conn.username} said goodbye")
+    return False
@@ -1,26 +1,103 @@
 import asyncio
+import signal
+import time
+from pathlib import Path
 from rich.console import Console
-from typing import Dict
+from typing import Dict, Optional, Set
 
-from ..utils.logger import get_logger
+from ..utils.logger import get_logger, set_level
 from ..utils.config import AronaSettings
-from ..protocol.messages import Message, MessageType
+from ..utils.loop import run
+from ..utils.metrics import MetricsServer, registry
+from ..protocol.messages import Message, MessageType, CAP_COUNTER_NONCE, CAP_RESUME
+from ..protocol.crypto import TicketKey
+from ..protocol.compression import supported_caps
+from ..protocol.framing import DEFAULT_MAX_FRAME, FrameReader
 from .connection_manager import ConnectionManager
 from .connection import ClientConnection
 from .bore_manager import BoreManager
+from .cluster import AronaCluster, WorkerBus
+from .handshake import HandshakeGate
+from .admission import Admission
+from .message_log import MessageLog
+from .router import Router, router as default_router
+from .transfers import Transfers
+from .indicators import TypingIndicators
+from .keepalive import Keepalive
+from .timers import TimerWheel
 
 console = Console()
 logger = get_logger("AronaServer")
 
+HANDSHAKE = registry.histogram("aronanet_handshake_seconds", "Key exchange or resumption, once a handshake slot is held")
+AUTH = registry.histogram("aronanet_auth_seconds", "Handshake done to session admitted")
+SETUP = registry.histogram("aronanet_setup_seconds", "Accept to session admitted, queueing included")
+
 class AronaServer:
     """Async raw TCP server for AoNET"""
-    def __init__(self, config: AronaSettings):
+    def __init__(self, config: AronaSettings, worker_id: Optional[int] = None, router: Optional[Router] = None):
         self.config = config
+        self.worker_id = worker_id
+        self.router = router or default_router
+        set_level(self.config.get("log_level", "INFO"))
         self.host = self.config.get("host")
         self.port = self.config.get("port")
-        self.max_conn = self.config.get("max_connections")
+        self.admission = Admission(
+            max_pending=self.config.get("max_pending", 64),
+            max_authenticated=self.config.get("max_connections", 10)
+        )
+        self.queue_size = self.config.get("outbound_queue_size", 256)
+        self.overflow_policy = self.config.get("overflow_policy", "drop_oldest")
+        self.capabilities = CAP_COUNTER_NONCE if self.config.get("counter_nonces", True) else 0
+        self.capabilities |= supported_caps(self.config.get("compression", "auto"))
+        self.compress_min_size = self.config.get("compress_min_size", 64)
+        self.flush_window = self.config.get("send_flush_window", 0.0)
+        self.batch_bytes = self.config.get("send_batch_bytes", 64 * 1024)
+        self.max_frame_size = self.config.get("max_frame_size", DEFAULT_MAX_FRAME)
+        self.tickets = self._ticket_key()
+        if self.tickets:
+            self.capabilities |= CAP_RESUME
+        self.engine = self.config.get("engine", "streams")
         self.clients: Dict[str, ClientConnection] = {}
-        self.conn_manager = ConnectionManager()
+        self.max_channel_name = self.config.get("max_channel_name", 64)
+        self.log = self._message_log()
+        self.conn_manager = ConnectionManager(
+            group_channels=self.config.get("group_channels", []),
+            history_size=self.config.get("history_size", 100),
+            history_channels=self.config.get("history_channels", 1024),
+            log=self.log
+        )
+        self.bulk_queue_size = self.config.get("bulk_queue_size", 16)
+        self.transfers = Transfers(
+            self.conn_manager,
+            chunk_size=self.config.get("chunk_size", 64 * 1024),
+            max_size=self.config.get("max_transfer_size", 64 * 1024 * 1024),
+            stall_timeout=self.config.get("transfer_stall_timeout", 10.0)
+        )
+        self.typing = TypingIndicators(
+            self.conn_manager,
+            interval=self.config.get("typing_interval", 1.0),
+            timeout=self.config.get("typing_timeout", 5.0)
+        )
+        self.timers = TimerWheel()
+        self.keepalive = Keepalive(
+            self.timers,
+            interval=self.config.get("heartbeat_interval", 30.0),
+            timeout=self.config.get("idle_timeout", 90.0),
+            handshake_timeout=self.config.get("handshake_timeout", 10.0)
+        )
+        self._client_tasks: Set[asyncio.Task] = set()
+        self.handshakes = HandshakeGate(
+            concurrency=self.config.get("handshake_concurrency", 64),
+            threads=self.config.get("handshake_threads", 2),
+            pool_size=self.config.get("keypool_size", 256),
+            rate=self.config.get("handshake_rate", 10.0),
+            burst=self.config.get("handshake_burst", 30),
+            exempt=self.config.get("handshake_rate_exempt", [])
+        )
+
+        self.metrics = self._metrics_server()
+        self._register_metrics()
 
         self.bore = BoreManager(local_port=self.port, auto_reconn=True, reconn_delay=5.0)
         self.bore.on_url_change = self._handle_url_change
@@ -44,52 +121,113 @@ class AronaServer:
         console.print(f"[!] Bore disconnected")
 
     async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
-        conn = ClientConnection(reader, writer)
-        peer = conn.user
+        accepted = time.perf_counter_ns()
+        peername = writer.get_extra_info("peername")
+        if not self.handshakes.allow(peername[0] if peername else None):
+            logger.warning(f"Handshake rate limit hit by {peername}, rejecting :/")
+            writer.close()
+            await writer.wait_closed()
+            return
 
-        if len(self.clients) >= self.max_conn:
-            logger.warning(f"Too many connections, rejecting {peer} :/")
-            console.print(f"[x] Too many connections, rejecting {peer}")
+        # Before ClientConnection takes a keypair, a rejected socket costs nothing else
+        if not self.admission.admit():
+            logger.warning(f"Too many connections, rejecting {peername} :/")
+            console.print(f"[x] Too many connections, rejecting {peername}")
             writer.close()
             await writer.wait_closed()
             return
 
-        console.print(f"[+] Connection from {peer}")
-        logger.info(f"New connection from {peer} :3")
+        try:
+            conn = ClientConnection(
+                reader, writer,
+                queue_size=self.queue_size,
+                overflow_policy=self.overflow_policy,
+                capabilities=self.capabilities,
+                flush_window=self.flush_window,
+                batch_bytes=self.batch_bytes,
+                max_frame_size=self.max_frame_size,
+                key_exchange=self.handshakes.keys.take(),
+                executor=self.handshakes.executor,
+                tickets=self.tickets,
+                bulk_queue_size=self.bulk_queue_size,
+                compress_min_size=self.compress_min_size,
+                handshake_slots=self.handshakes.slots
+            )
+
+        except Exception as e:
+            # No connection to tear down yet, just hand the admission slot back
+            self.admission.release(False)
+            logger.error(f"Couldn't set up a connection for {peername}: {e} :(")
+            writer.close()
+            return
+
+        peer = conn.user
 
         try:
-            if not await conn.do_handshake():
-                console.print(f"[!] Handshake failed with {peer}")
-                return
+            console.print(f"[+] Connection from {peer}")
+            logger.info(f"New connection from {peer} :3")
+            self.keepalive.watch(conn)
 
-            console.print(f"[✓] Handshake complete with {peer}")
+            start = time.perf_counter_ns()
+            shook = await conn.do_handshake()
+            HANDSHAKE.since(start)
 
-            auth_msg = await conn.read_msg()
-            if auth_msg.msg_type != MessageType.AUTH:
-                console.print(f"[!] Expected AUTH from {peer}")
+            if not shook:
+                console.print(f"[!] Handshake failed with {peer}")
                 return
 
-            username = auth_msg.payload.decode('utf-8').strip()
-            if not username or len(username) < 2:
-                reply = Message(msg_type=MessageType.AUTH_FAIL, payload=b'Invalid username')
+            start = time.perf_counter_ns()
+            if conn.resumed:
+                # The ticket already named the user, no AUTH round-trip
+                username = conn.resumed
+                console.print(f"[✓] Session resumed with {peer}")
+
+            else:
+                console.print(f"[✓] Handshake complete with {peer}")
+
+                auth_msg = await conn.read_msg()
+                if auth_msg.msg_type != MessageType.AUTH:
+                    console.print(f"[!] Expected AUTH from {peer}")
+                    return
+
+                username = auth_msg.payload.decode('utf-8').strip()
+                if not username or len(username) < 2:
+                    reply = Message(msg_type=MessageType.AUTH_FAIL, payload=b'Invalid username')
+                    await conn.send_msg(reply)
+                    console.print(f"[!] Auth failed for {peer}: bad username")
+                    return
+
+            # Taking over our own session (stale socket, RESUME) needs no new slot
+            replacing = self.conn_manager.get_connection(username) is not None
+            if not self.admission.promote(replacing):
+                reply = Message(msg_type=MessageType.AUTH_FAIL, payload=b'Server full')
                 await conn.send_msg(reply)
-                console.print(f"[!] Auth failed for {peer}: bad username")
+                console.print(f"[x] Server full, turned away {username} from {peer}")
                 return
 
             conn.username = username
             conn.authenticated = True
+            AUTH.since(start)
+            SETUP.since(accepted)
+            self.keepalive.authenticated(conn)
             self.clients[username] = conn
 
-            self.conn_manager.add_user(username, conn)
-
+            # Everything after AUTH goes through the outbound queue so order is kept
+            conn.start_writer()
             reply = Message(msg_type=MessageType.AUTH_OK, payload=f'Welcome {username}!'.encode())
-            await conn.send_msg(reply)
+            await conn.enqueue(reply)
+
+            ticket = conn.new_ticket()
+            if ticket:
+                await conn.enqueue(ticket)
+
+            self.conn_manager.add_user(username, conn, resume=bool(conn.resumed))
 
             join_msg = Message(
                 msg_type=MessageType.ONLINE,
                 payload=f'{username} joined'.encode()
             )
-            await self.conn_manager.scream_to_channel('general', join_msg, exclude=username)
+            await self.conn_manager.scream_to_channel(conn.channel, join_msg, exclude=username)
 
             console.print(f"[✓] {username} authenticated from {peer}")
             logger.info(f"{username} authenticated :)")
@@ -97,59 +235,12 @@ class AronaServer:
             while True:
                 msg = await conn.read_msg()
 
-                logger.info(f"{username}: {msg.msg_type.name} (id {msg.msg_id})")
-
-                if msg.msg_type == MessageType.TEXT:
-                    channel = self.conn_manager.get_user_channel(username)
-                    formatted = f'[{username}] {msg.payload.decode()}'.encode()
-                    broadcast_msg = Message(
-                        msg_type=MessageType.TEXT,
-                        payload=formatted
-                    )
-
-                    await self.conn_manager.scream_to_channel(channel, broadcast_msg, exclude=username)
-
-                elif msg.msg_type == MessageType.DM:
-                    target, dm = msg.payload.decode().split(':', 1)
-                    formatted = f'[{username}] {dm}'.encode()
-                    dm_msg = Message(
-                        msg_type=MessageType.DM,
-                        payload=formatted
-                    )
-
-                    await self.conn_manager.scream_to_user(target, dm_msg)
-
-
-                elif msg.msg_type == MessageType.SUP:
-                    new_channel = msg.payload.decode()
-                    old_channel = self.conn_manager.get_user_channel(username)
-
-                    if old_channel:
-                        leave_msg = Message(
-                            msg_type=MessageType.OFFLINE,
-                            payload=f'{username} left'.encode()
-                        )
-                        await self.conn_manager.scream_to_channel(old_channel, leave_msg)
-
-                    self.conn_manager.join_channel(username, new_channel)
-                    join_msg = Message(
-                        msg_type=MessageType.ONLINE,
-                        payload=f'{username} joined'.encode()
-                    )
-                    await self.conn_manager.scream_to_channel(new_channel, join_msg, exclude=username)
-
-                    confirm = Message(
-                        msg_type=MessageType.SUP,
-                        payload=f'Joined #{new_channel}'.encode()
-                    )
-                    await conn.send_msg(confirm)
+                # One line per message, so debug and lazy
+                logger.debug("%s: %s (id %d)", username, msg.msg_type.name, msg.msg_id)
 
-                elif msg.msg_type == MessageType.ADIOS:
-                    console.print(f"[!] {username} said goodbye")
+                if not await self.router.dispatch(self, conn, msg):
                     break
 
-                # TODO: Add/handle other msg types
-
         except asyncio.IncompleteReadError:
             logger.info(f"{peer} disconnected :|")
             console.print(f"[-] {peer} disconnected")
@@ -159,7 +250,14 @@ class AronaServer:
             console.print(f"[!] Error with {peer}: {e}")
 
         finally:
-            if conn.username:
+            self.admission.release(conn.authenticated)
+            if self.clients.get(conn.username) is conn:
+                del self.clients[conn.username]
+            self.keepalive.forget(conn)
+            await self.transfers.drop(conn)
+            # A resumed session may have taken the name over already, leave that one alone
+            if conn.username and self.conn_manager.get_connection(conn.username) is conn:
+                self.typing.stopped(conn.username)
                 channel = self.conn_manager.get_user_channel(conn.username)
                 if channel:
                     leave_msg = Message(
@@ -172,11 +270,103 @@ class AronaServer:
 
             await conn.close()
 
-    async def start(self):
-        server = await asyncio.start_server(
-            self.handle_client, self.host, self.port
+    def counters(self) -> Dict[str, int]:
+        """Live connection counts and rejections, for sizing the box"""
+        return {
+            **self.admission.snapshot(),
+            "rate_limited": self.handshakes.rejected,
+            "reaped": self.keepalive.reaped,
+            "users": len(self.conn_manager.get_all_users()),
+        }
+
+    def _register_metrics(self):
+        """Expose numbers other objects already keep, read only when scraped"""
+        admission = self.admission
+        registry.counter("aronanet_accepted_total", "Sockets admitted to handshake", fn=lambda: admission.accepted)
+        registry.counter("aronanet_rejected_total", "Sockets closed at accept", fn=lambda: admission.rejected_pending,
+                         reason="pending")
+        registry.counter("aronanet_rejected_total", fn=lambda: admission.rejected_full, reason="full")
+        registry.counter("aronanet_rejected_total", fn=lambda: self.handshakes.rejected, reason="rate_limited")
+        registry.counter("aronanet_reaped_total", "Sockets dropped by keepalive", fn=lambda: self.keepalive.reaped)
+        registry.counter("aronanet_unhandled_total", "Messages with no handler", fn=lambda: self.router.unhandled)
+        registry.gauge("aronanet_connections", "Live sockets", fn=lambda: admission.pending, state="pending")
+        registry.gauge("aronanet_connections", fn=lambda: admission.authenticated, state="authenticated")
+
+    def _metrics_server(self) -> Optional[MetricsServer]:
+        """Local Prometheus endpoint, workers each get their own port (or socket) next to the configured one"""
+        port = self.config.get("metrics_port", 0)
+        path = self.config.get("metrics_socket")
+        if not port and not path:
+            return None
+
+        if self.worker_id is not None:
+            port = port and port + self.worker_id
+            path = path and f"{path}.{self.worker_id}"
+
+        return MetricsServer(registry, host=self.config.get("metrics_host", "127.0.0.1"), port=port, path=path)
+
+    def _message_log(self) -> Optional[MessageLog]:
+        """On-disk channel history, one directory per worker since they number seqs separately"""
+        if not self.config.get("message_log", True):
+            return None
+
+        root = Path(self.config.get("log_dir") or Path(self.config.config_path).parent / "history")
+        if self.worker_id is not None:
+            root = root / f"worker{self.worker_id}"
+
+        return MessageLog(
+            root,
+            segment_bytes=self.config.get("log_segment_bytes", 8 * 1024 * 1024),
+            retention_bytes=self.config.get("log_retention_bytes", 256 * 1024 * 1024),
+            retention_days=self.config.get("log_retention_days", 30),
+            flush_interval=self.config.get("log_flush_interval", 1.0),
+            max_open=self.config.get("log_open_channels", 256)
         )
-        logger.info(f"Server listening on {self.host}:{self.port} :3")
+
+    def _ticket_key(self) -> Optional[TicketKey]:
+        """Resumption ticket key, None when ticket_lifetime is 0"""
+        lifetime = self.config.get("ticket_lifetime", 3600)
+        if not lifetime:
+            return None
+
+        key = self.config.get("ticket_key")
+        return TicketKey(bytes.fromhex(key) if key else None, lifetime)
+
+    def _frame_protocol(self) -> FrameReader:
+        """Protocol engine: one FrameReader per socket, acting as both reader and writer"""
+        return FrameReader(self.max_frame_size, on_connect=self._on_frame_connect)
+
+    def _on_frame_connect(self, proto: FrameReader):
+        task = asyncio.ensure_future(self.handle_client(proto, proto))
+        self._client_tasks.add(task)
+        task.add_done_callback(self._client_tasks.discard)
+
+    async def listen(self) -> asyncio.AbstractServer:
+        """Bind the listening socket with the configured engine"""
+        self.handshakes.start()
+        if self.log:
+            self.log.start()
+        self.typing.start()
+        self.timers.start()
+        if self.metrics:
+            await self.metrics.start()
+        # Workers all bind the same port, the kernel spreads accepts between them
+        reuse_port = self.worker_id is not None
+        if self.engine == "protocol":
+            loop = asyncio.get_running_loop()
+            server = await loop.create_server(self._frame_protocol, self.host, self.port, reuse_port=reuse_port)
+
+        elif self.engine == "streams":
+            server = await asyncio.start_server(self.handle_client, self.host, self.port, reuse_port=reuse_port)
+
+        else:
+            raise ValueError(f"Unknown engine: {self.engine} :/")
+
+        logger.info(f"Server listening on {self.host}:{self.port} ({self.engine} engine) :3")
+        return server
+
+    async def start(self):
+        server = await self.listen()
         console.print(f"[*] Server listening on {self.host}:{self.port}")
 
         console.print("[*] Starting bore tunnel...")
@@ -184,6 +374,9 @@ class AronaServer:
 
         if public_url:
             console.print(f"[✓] Public URL: {public_url}")
+            if self.handshakes.rate:
+                # bore doesn't pass on the client's address, every tunnel client is 127.0.0.1
+                logger.info("Clients through bore share one handshake_rate bucket, it's a global limit there :/")
         else:
             console.print("[!] Failed to start bore - server only accessible locally")
 
@@ -199,30 +392,83 @@ class AronaServer:
         finally:
             await self.stop()
 
-    async def stop(self):
-        """Cleanup on shutdown"""
-        console.print("\n[*] Shutting down...")
+    async def serve_worker(self, bus_path: str):
+        """Run as one of the `workers` processes: no bore, routing shared over the bus"""
+        bus = WorkerBus(bus_path, self.worker_id)
+        await bus.connect()
+        self.conn_manager.attach_bus(bus)
 
-        await self.bore.stop()
+        server = await self.listen()
+        # The master stops workers with SIGTERM, which would otherwise skip the cleanup below
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        try:
+            async with server:
+                await server.serve_forever()
 
-        if hasattr(self, 'conn_manager'):
-            for username in list(self.conn_manager.get_all_users()):
-                conn = self.conn_manager.get_connection(username)
+        except asyncio.CancelledError:
+            pass
 
-                if conn:
-                    try:
-                        await conn.close()
+        finally:
+            self.handshakes.stop()
+            await self.typing.close()
+            await self.timers.close()
+            if self.metrics:
+                await self.metrics.stop()
+            await self._close_clients()
+            if self.log:
+                await self.log.close()
+            report = self.router.report()
+            if report:
+                logger.info(f"Worker {self.worker_id} handler timings:\n{report}")
+            logger.info(f"Worker {self.worker_id} connection counters: {self.counters()}")
+            await bus.close()
+
+    async def _close_clients(self) -> int:
+        """Close every local client connection, returns how many there were"""
+        users = list(self.conn_manager.get_all_users())
+        for username in users:
+            conn = self.conn_manager.get_connection(username)
+
+            if conn:
+                try:
+                    await conn.close()
+
+                except Exception as e:
+                    logger.error(f"Error closing {username}: {e}")
+
+        return len(users)
 
-                    except Exception as e:
-                        logger.error(f"Error closing {username}: {e}")
+    async def stop(self):
+        """Cleanup on shutdown"""
+        console.print("\n[*] Shutting down...")
 
-            console.print(f"[*] Closed {len(self.conn_manager.get_all_users())} connections")
+        await self.bore.stop()
+        self.handshakes.stop()
+        await self.typing.close()
+        await self.timers.close()
+        if self.metrics:
+            await self.metrics.stop()
+
+        closed = await self._close_clients()
+        console.print(f"[*] Closed {closed} connections")
+
+        if self.log:
+            await self.log.close()
+
+        report = self.router.report()
+        if report:
+            logger.info(f"Handler timings:\n{report}")
+        logger.info(f"Connection counters: {self.counters()}")
         console.print("[✓] Shutdown complete")
 
 
 def main():
     try:
-        asyncio.run(AronaServer(AronaSettings()).start())
+        config = AronaSettings()
+        if config.get("workers", 1) > 1:
+            run(AronaCluster(config).start(), config.get("loop", "auto"))
+        else:
+            run(AronaServer(config).start(), config.get("loop", "auto"))
     except KeyboardInterrupt:
         console.print("[*] Shutting down…")
     console.print("\n[*] Server stopped")
\ No newline at end of file
@@ -0,0 +1,89 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Any, Callable, List, Optional, Set
+
+from ..utils.logger import get_logger
+
+logger = get_logger("Timers")
+
+@dataclass(slots=True)
+class Timer:
+    callback: Callable[..., Any]
+    args: tuple
+    rounds: int
+    cancelled: bool = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel for per-connection deadlines
+
+    One task ticks every `tick` seconds and fires the timers in the current
+    slot, so thousands of connections cost one sleeping task instead of one
+    each. schedule() and cancel() are O(1), deadlines are rounded up to the
+    next tick. A timer further out than one turn waits `rounds` extra turns.
+    """
+    def __init__(self, tick: float = 1.0, slots: int = 512):
+        self.tick = tick
+        self.slots: List[List[Timer]] = [[] for _ in range(slots)]
+        self.position = 0
+        self._task: Optional[asyncio.Task] = None
+        self._running: Set[asyncio.Task] = set()
+
+    def schedule(self, delay: float, callback: Callable[..., Any], *args) -> Timer:
+        """Call callback(*args) in about `delay` seconds, a coroutine callback runs as its own task"""
+        ticks = max(1, -(-delay // self.tick))
+        rounds, offset = divmod(int(ticks) - 1, len(self.slots))
+        timer = Timer(callback, args, rounds)
+        self.slots[(self.position + 1 + offset) % len(self.slots)].append(timer)
+        return timer
+
+    async def advance(self):
+        """Move one tick forward and fire everything due"""
+        self.position = (self.position + 1) % len(self.slots)
+        slot = self.slots[self.position]
+        due = [t for t in slot if not t.cancelled and t.rounds == 0]
+        slot[:] = [t for t in slot if not t.cancelled and t.rounds > 0]
+        for timer in slot:
+            timer.rounds -= 1
+
+        for timer in due:
+            try:
+                result = timer.callback(*timer.args)
+                if asyncio.iscoroutine(result):
+                    # Not awaited: one callback stuck on a socket mustn't stop every other deadline
+                    task = asyncio.get_running_loop().create_task(result)
+                    self._running.add(task)
+                    task.add_done_callback(self._finished)
+            except Exception as e:
+                logger.error(f"Timer {timer.callback.__name__} failed: {e} :(")
+
+    def _finished(self, task: asyncio.Task):
+        self._running.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.error(f"Timer task failed: {task.exception()} :(")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            # Keep to the schedule even when a tick runs long
+            next_tick += self.tick
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+            await self.advance()
+
+    async def close(self):
+        tasks = list(self._running)
+        if self._task:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
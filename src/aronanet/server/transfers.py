@@ -0,0 +1,133 @@
+import asyncio
+from dataclasses import dataclass, field
+from itertools import count
+from typing import Dict, List
+
+from ..protocol.messages import Message, MessageType
+from ..protocol.transfer import ABORT, chunk_payload, parse_chunk, parse_start, start_payload
+from ..utils.logger import get_logger
+from .connection import ClientConnection
+from .connection_manager import ConnectionManager
+from .router import router
+
+logger = get_logger("Transfers")
+
+@dataclass(slots=True)
+class Relay:
+    """One upload being streamed to the channel, recipients fixed when it starts"""
+    server_id: int
+    size: int
+    chunk_size: int
+    recipients: List[ClientConnection]
+    received: int = 0
+    next_index: int = 0
+
+
+@dataclass
+class Transfers:
+    """
+    Relays IMAGE transfers chunk by chunk, nothing is buffered whole
+
+    Each chunk goes straight into every recipient's bulk queue, all at once.
+    The uploader only gets the CHUNK_ACK once all of them took it, so it never
+    has more than its window in flight and a full queue pushes back on the
+    sender. A recipient that stays full for stall_timeout is dropped from the
+    transfer, and its queued chunks of it are thrown out so ABORT comes last.
+    """
+    conn_manager: ConnectionManager
+    chunk_size: int = 64 * 1024
+    max_size: int = 64 * 1024 * 1024
+    stall_timeout: float = 10.0
+    active: Dict[ClientConnection, Dict[int, Relay]] = field(default_factory=dict)
+    _ids: count = field(default_factory=lambda: count(1))
+
+    async def start(self, conn: ClientConnection, msg: Message):
+        tid, size, digest, chunk_size, name = parse_start(msg.payload)
+        if size > self.max_size or not 0 < chunk_size <= self.chunk_size:
+            logger.warning("Rejected transfer %s from %s (%d bytes, %d chunks)", name, conn.username, size, chunk_size)
+            await self._ack(conn, tid, ABORT)
+            return
+
+        channel = self.conn_manager.get_user_channel(conn.username)
+        recipients = [
+            c for user in self.conn_manager.get_channel_users(channel)
+            if user != conn.username and (c := self.conn_manager.get_connection(user))
+        ]
+        relay = Relay(next(self._ids) % ABORT, size, chunk_size, recipients)
+        self.active.setdefault(conn, {})[tid] = relay
+
+        announce = Message(
+            msg_type=MessageType.IMAGE,
+            payload=start_payload(relay.server_id, size, digest, chunk_size, f"[{conn.username}] {name}")
+        )
+        for c in recipients:
+            await c.enqueue(announce)
+        logger.info(f"{conn.username} is sending {name} ({size} bytes) to #{channel} :3")
+
+        if size == 0:
+            self.active[conn].pop(tid)
+
+    async def chunk(self, conn: ClientConnection, msg: Message):
+        tid, index, data = parse_chunk(msg.payload)
+        relay = self.active.get(conn, {}).get(tid)
+        if relay is None:
+            return
+
+        if (index == ABORT or index != relay.next_index or len(data) > relay.chunk_size
+                or relay.received + len(data) > relay.size):
+            await self._abort(conn, tid)
+            return
+
+        out = Message(msg_type=MessageType.CHUNK, payload=chunk_payload(relay.server_id, index, data))
+        await asyncio.gather(*(self._relay(relay, c, out) for c in list(relay.recipients)))
+
+        relay.received += len(data)
+        relay.next_index += 1
+        await self._ack(conn, tid, index)
+
+        if relay.received == relay.size:
+            del self.active[conn][tid]
+
+    async def _relay(self, relay: Relay, c: ClientConnection, out: Message):
+        if self.conn_manager.get_connection(c.username) is not c:
+            relay.recipients.remove(c)  # left or reconnected, nobody is reading this queue
+            return
+        try:
+            await asyncio.wait_for(c.enqueue_bulk(out), self.stall_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"{c.username} stalled on transfer {relay.server_id}, dropping them from it :/")
+            relay.recipients.remove(c)
+            await self._tell_abort(c, relay.server_id)
+
+    async def drop(self, conn: ClientConnection):
+        """The uploader is gone, tell recipients its transfers won't finish"""
+        for tid in list(self.active.get(conn, {})):
+            await self._abort(conn, tid, notify_sender=False)
+        self.active.pop(conn, None)
+
+    async def _abort(self, conn: ClientConnection, tid: int, notify_sender: bool = True):
+        relay = self.active[conn].pop(tid)
+        for c in relay.recipients:
+            await self._tell_abort(c, relay.server_id)
+        if notify_sender:
+            await self._ack(conn, tid, ABORT)
+
+    @staticmethod
+    async def _tell_abort(c: ClientConnection, server_id: int):
+        # ABORT rides the chat queue, so take this transfer's chunks out of bulk
+        # first or they'd arrive after it
+        c.discard_bulk(lambda queued: parse_chunk(queued.payload)[0] == server_id)
+        await c.enqueue(Message(msg_type=MessageType.CHUNK, payload=chunk_payload(server_id, ABORT)))
+
+    @staticmethod
+    async def _ack(conn: ClientConnection, tid: int, index: int):
+        await conn.enqueue(Message(msg_type=MessageType.CHUNK_ACK, payload=chunk_payload(tid, index)))
+
+
+@router.route(MessageType.IMAGE)
+async def on_image(server, conn: ClientConnection, msg: Message):
+    await server.transfers.start(conn, msg)
+
+@router.route(MessageType.CHUNK)
+async def on_chunk(server, conn: ClientConnection, msg: Message):
+    await server.transfers.chunk(conn, msg)
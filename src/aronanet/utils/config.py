@@ -10,8 +10,52 @@ class AronaSettings:
     DEFAULT_SETTINGS = {
         "host": "127.0.0.1",
         "port": 47500,
-        "max_connections": 10,
-        "log_level": "INFO",
+        "max_connections": 10,  # authenticated sessions (per worker), enforced at AUTH
+        "max_pending": 64,  # sockets still in handshake or AUTH, more are closed at accept
+        "log_level": "INFO",  # DEBUG logs every frame, only for chasing bugs
+        "loop": "auto",  # auto (uvloop if installed) | default | uvloop
+        "workers": 1,  # >1 runs that many processes on the same port (SO_REUSEPORT) with a shared bus
+        "engine": "streams",  # streams (asyncio.start_server) | protocol (BufferedProtocol, parses frames in place)
+        "outbound_queue_size": 256,
+        "overflow_policy": "drop_oldest",  # drop_oldest (chat only, control frames are kept) | disconnect | block
+        "group_channels": [],  # channels broadcast with one shared key
+        "history_size": 100,  # TEXT messages kept per channel for HISTORY catch-up
+        "history_channels": 1024,  # channels with history in memory, the least recently used empty ones are dropped
+        "max_channel_name": 64,  # bytes, longer (or unprintable) names in SUP are refused
+        "typing_interval": 1.0,  # seconds between coalesced TYPING frames per channel
+        "typing_timeout": 5.0,  # a typer without a fresh TYPING for this long is dropped
+        "message_log": True,  # also keep channel history on disk so it survives restarts
+        "log_dir": None,  # defaults to history/ next to this file
+        "log_segment_bytes": 8 * 1024 * 1024,  # start a new segment file past this size
+        "log_retention_bytes": 256 * 1024 * 1024,  # per channel, oldest segments go first, 0 = no limit
+        "log_retention_days": 30,  # 0 = keep forever
+        "log_flush_interval": 1.0,  # seconds between batched write + fsync
+        "log_open_channels": 256,  # channel logs kept open (fds + mmaps), others are reopened on demand
+        "send_flush_window": 0.0,  # seconds to wait for more queued messages before a write, 0 = same tick only
+        "send_batch_bytes": 65536,  # flush as soon as a batch reaches this size
+        "max_frame_size": 16 * 1024 * 1024,  # bigger length prefixes drop the connection
+        "chunk_size": 64 * 1024,  # largest CHUNK the server relays, clients split files to this
+        "transfer_window": 8,  # chunks a client sends before waiting for CHUNK_ACKs
+        "max_transfer_size": 64 * 1024 * 1024,  # bigger IMAGE transfers are refused
+        "bulk_queue_size": 16,  # chunks queued per recipient before the uploader is slowed down
+        "transfer_stall_timeout": 10.0,  # seconds a full recipient may hold up a transfer before it's dropped
+        "counter_nonces": True,  # per-direction keys + implicit nonces for clients that support it
+        "compression": "auto",  # auto (zstd if installed, else zlib) | zstd | zlib | off
+        "compress_min_size": 64,  # payloads shorter than this go out uncompressed
+        "handshake_timeout": 10.0,  # seconds from accept to AUTH before the socket is dropped, 0 = no limit
+        "heartbeat_interval": 30.0,  # PING a client after this many quiet seconds, 0 = never
+        "idle_timeout": 90.0,  # drop a client after this many quiet seconds (half-open sockets), 0 = never
+        "handshake_concurrency": 64,  # key agreements running at once, the rest wait their turn
+        "handshake_threads": 2,  # threads for X25519 work, 0 = on the event loop
+        "keypool_size": 256,  # ephemeral keypairs generated ahead of time, 0 = one per connection
+        "handshake_rate": 10.0,  # new handshakes per second per IP, 0 = unlimited
+        "handshake_burst": 30,
+        "handshake_rate_exempt": [],  # IPs with no limit; bore hides client IPs, so its traffic shares 127.0.0.1's bucket
+        "ticket_lifetime": 3600,  # seconds a resumption ticket is good for, 0 = always full handshake
+        "ticket_key": None,  # hex, random per start when unset (tickets die with the server)
+        "metrics_port": 0,  # Prometheus text on http://metrics_host:port/metrics, 0 = off, workers add their id
+        "metrics_host": "127.0.0.1",  # no auth on the endpoint, keep it local
+        "metrics_socket": None,  # or serve it on this Unix socket path instead (workers append .<id>)
     }
 
     def __init__(self, config_path: Optional[Path] = None):
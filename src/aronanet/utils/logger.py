@@ -1,24 +1,60 @@
 # Same logger as Project-Ibuki lol
+import atexit
 import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
+from typing import Dict, Optional, Union
 
-def get_logger(name: str = "app_logger") -> logging.Logger:
-    logger = logging.getLogger(name)
-    if not logger.hasHandlers():
-        logger.setLevel(logging.DEBUG)
+LOG_PATH = Path.home() / "AronaNET" / "logs" / "AronaNET.log"
 
-        log_dir = Path.home() / "AronaNET" / "logs"
-        log_dir.mkdir(parents=True, exist_ok=True)
-        log_path = str(log_dir / "AronaNET.log")
+_level = logging.INFO
+_loggers: Dict[str, logging.Logger] = {}
+_queue_handler: Optional[QueueHandler] = None
+_listener: Optional[QueueListener] = None
 
-        fh = logging.FileHandler(log_path, mode="a")
-        fh.setLevel(logging.DEBUG)
+def _handler() -> QueueHandler:
+    """
+    One QueueHandler shared by every logger
 
+    Callers only put records on a queue, a QueueListener thread does the
+    formatting and the blocking file writes, off the event loop.
+    """
+    global _queue_handler, _listener
+    if _queue_handler is None:
+        LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
+
+        fh = logging.FileHandler(str(LOG_PATH), mode="a")
         formatter = logging.Formatter(
             "%(asctime)s - %(levelname)s - %(name)s - %(message)s",
             datefmt="%Y-%m-%d %H:%M:%S",
         )
         fh.setFormatter(formatter)
 
-        logger.addHandler(fh)
+        log_queue = queue.SimpleQueue()
+        _queue_handler = QueueHandler(log_queue)
+        _listener = QueueListener(log_queue, fh)
+        _listener.start()
+        # Drain whatever is still queued on exit
+        atexit.register(_listener.stop)
+
+    return _queue_handler
+
+def get_logger(name: str = "app_logger") -> logging.Logger:
+    logger = logging.getLogger(name)
+    if not logger.hasHandlers():
+        logger.setLevel(_level)
+        logger.addHandler(_handler())
+        _loggers[name] = logger
     return logger
+
+def set_level(level: Union[str, int]):
+    """Apply the `log_level` setting to every logger, made already or later"""
+    global _level
+    value = logging.getLevelName(level.upper()) if isinstance(level, str) else level
+    if not isinstance(value, int):
+        raise ValueError(f"Unknown log level: {level} :/")
+
+    _level = value
+    for logger in _loggers.values():
+        logger.setLevel(_level)
@@ -0,0 +1,49 @@
+import asyncio
+import sys
+from typing import Any, Callable, Coroutine, Optional
+
+from .logger import get_logger
+
+logger = get_logger("EventLoop")
+
+LOOPS = ("auto", "default", "uvloop")
+
+def loop_factory(name: str = "auto") -> Optional[Callable[[], asyncio.AbstractEventLoop]]:
+    """
+    Event loop factory for the `loop` setting, None means asyncio's default
+
+    auto: uvloop if it's installed, quietly falls back otherwise
+    uvloop: same, but warns when it isn't there (e.g. on Termux)
+    """
+    if name not in LOOPS:
+        logger.warning(f"Unknown loop '{name}', using default :/")
+        return None
+
+    if name == "default":
+        return None
+
+    try:
+        import uvloop
+
+    except ImportError:
+        if name == "uvloop":
+            logger.warning("uvloop not installed, using default loop :/")
+        return None
+
+    return uvloop.new_event_loop
+
+
+def run(main: Coroutine[Any, Any, Any], loop: str = "auto") -> Any:
+    """asyncio.run() on the event loop picked by `loop`"""
+    factory = loop_factory(loop)
+    if factory is None:
+        return asyncio.run(main)
+
+    logger.info(f"Running on {factory.__module__} :3")
+    if sys.version_info >= (3, 11):
+        with asyncio.Runner(loop_factory=factory) as runner:
+            return runner.run(main)
+
+    import uvloop
+    uvloop.install()
+    return asyncio.run(main)
@@ -0,0 +1,223 @@
+import asyncio
+import time
+from array import array
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .logger import get_logger
+
+logger = get_logger("Metrics")
+
+# Histogram layout, HDR style: 8 linear sub-buckets per power of two (~12% error)
+SUB_BITS = 3
+SUB = 1 << SUB_BITS
+BUCKETS = SUB + (64 - SUB_BITS) * SUB
+
+def bucket_index(value: int) -> int:
+    if value < SUB:
+        return max(value, 0)
+    shift = value.bit_length() - SUB_BITS - 1
+    return SUB + shift * SUB + (value >> shift) - SUB
+
+def bucket_floor(index: int) -> int:
+    """Smallest value that lands in bucket `index`"""
+    if index < SUB:
+        return index
+    shift, sub = divmod(index - SUB, SUB)
+    return (SUB + sub) << shift
+
+
+class Counter:
+    """
+    Bumped with inc(), or read from `fn` at scrape time for totals some
+    other object already keeps, so the hot path doesn't count twice
+    """
+    __slots__ = ("value", "fn")
+
+    def __init__(self, fn: Optional[Callable[[], float]] = None):
+        self.value = 0
+        self.fn = fn
+
+    def inc(self, amount: int = 1):
+        self.value += amount
+
+    def get(self) -> float:
+        return self.fn() if self.fn else self.value
+
+
+class Gauge(Counter):
+    """Like Counter, but may go down"""
+    __slots__ = ()
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Histogram:
+    """
+    Log-linear histogram of non-negative integers (nanoseconds, counts)
+
+    Buckets are one preallocated array, record() is an index computation
+    and three adds. Exported with power-of-two `le` bounds, so a bound is
+    "below 2^k" rather than "at most", close enough at this resolution.
+    """
+    __slots__ = ("counts", "count", "total", "scale")
+
+    def __init__(self, scale: float = 1e-9):
+        self.counts = array("Q", bytes(8 * BUCKETS))
+        self.count = 0
+        self.total = 0
+        self.scale = scale
+
+    def record(self, value: int):
+        self.counts[bucket_index(value)] += 1
+        self.count += 1
+        self.total += value
+
+    def since(self, start_ns: int):
+        """record() the nanoseconds since a perf_counter_ns() reading"""
+        self.record(time.perf_counter_ns() - start_ns)
+
+    def percentile(self, q: float) -> float:
+        """Approximate q-th percentile (0-100), in exported units"""
+        if not self.count:
+            return 0.0
+        target, seen = self.count * q / 100, 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= target:
+                return bucket_floor(index + 1) * self.scale
+        return 0.0
+
+    def cumulative(self, bounds: List[int]) -> List[int]:
+        """Counts below each bound, bounds ascending"""
+        out, seen, index = [], 0, 0
+        for bound in bounds:
+            stop = bucket_index(bound)
+            while index < stop:
+                seen += self.counts[index]
+                index += 1
+            out.append(seen)
+        return out
+
+
+Labels = Tuple[Tuple[str, str], ...]
+
+class Registry:
+    """
+    Named metrics, created up front and rendered in Prometheus text format
+
+    Metrics are created once (at import or setup) and then updated through
+    the returned object, so recording never looks anything up by name.
+    """
+    # Exported bucket bounds: 1us .. ~34s for timings, 1 .. 64k for counts
+    TIME_BOUNDS = [1 << k for k in range(10, 36)]
+    COUNT_BOUNDS = [1 << k for k in range(0, 17)]
+
+    def __init__(self):
+        self.families: Dict[str, Tuple[str, str, Dict[Labels, object]]] = {}
+
+    def _get(self, kind: str, name: str, help_text: str, labels: dict, factory):
+        family = self.families.setdefault(name, (kind, help_text, {}))
+        if family[0] != kind:
+            raise ValueError(f"{name} is already a {family[0]} :/")
+        key = tuple(sorted(labels.items()))
+        metric = family[2].get(key)
+        if metric is None:
+            metric = family[2][key] = factory()
+        return metric
+
+    def counter(self, name: str, help_text: str = "", fn: Optional[Callable[[], float]] = None,
+                **labels) -> Counter:
+        counter = self._get("counter", name, help_text, labels, Counter)
+        if fn is not None:
+            counter.fn = fn
+        return counter
+
+    def gauge(self, name: str, help_text: str = "", fn: Optional[Callable[[], float]] = None, **labels) -> Gauge:
+        gauge = self._get("gauge", name, help_text, labels, Gauge)
+        if fn is not None:
+            gauge.fn = fn
+        return gauge
+
+    def histogram(self, name: str, help_text: str = "", seconds: bool = True, **labels) -> Histogram:
+        """seconds=True: record nanoseconds, export seconds. False: plain counts"""
+        return self._get("histogram", name, help_text, labels, lambda: Histogram(1e-9 if seconds else 1))
+
+    def render(self) -> str:
+        lines = []
+        for name, (kind, help_text, metrics) in self.families.items():
+            if help_text:
+                lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+            for key, metric in metrics.items():
+                if kind != "histogram":
+                    lines.append(f"{name}{_labels(key)} {metric.get()}")
+                else:
+                    bounds = self.TIME_BOUNDS if metric.scale != 1 else self.COUNT_BOUNDS
+                    for bound, seen in zip(bounds, metric.cumulative(bounds)):
+                        lines.append(f"{name}_bucket{_labels(key, le=f'{bound * metric.scale:g}')} {seen}")
+                    lines.append(f"{name}_bucket{_labels(key, le='+Inf')} {metric.count}")
+                    lines.append(f"{name}_sum{_labels(key)} {metric.total * metric.scale:g}")
+                    lines.append(f"{name}_count{_labels(key)} {metric.count}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _labels(key: Labels, **extra) -> str:
+    pairs = list(key) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+# Process-wide registry, each worker process has its own
+registry = Registry()
+
+
+class MetricsServer:
+    """
+    Bare-bones HTTP endpoint serving registry.render() for any GET
+
+    Listens on host:port, or on a Unix socket when `path` is given. Meant
+    for localhost scraping, there is no auth.
+    """
+    def __init__(self, metrics: Registry = registry, host: str = "127.0.0.1", port: int = 0,
+                 path: Optional[str] = None):
+        self.registry = metrics
+        self.host = host
+        self.port = port
+        self.path = path
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        if self.path:
+            self._server = await asyncio.start_unix_server(self._handle, self.path)
+            logger.info(f"Metrics on unix:{self.path} :3")
+        else:
+            self._server = await asyncio.start_server(self._handle, self.host, self.port)
+            self.port = self._server.sockets[0].getsockname()[1]
+            logger.info(f"Metrics on http://{self.host}:{self.port}/metrics :3")
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            # Request line + headers, we answer the same thing whatever was asked
+            while (await asyncio.wait_for(reader.readline(), 5.0)).strip():
+                pass
+            body = self.registry.render().encode()
+            writer.write(
+                b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body
+            )
+            await writer.drain()
+
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+
+        finally:
+            writer.close()
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
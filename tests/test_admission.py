@@ -0,0 +1,43 @@
+from aronanet.server.admission import Admission
+
+
+def test_pending_cap_applies_at_accept():
+    admission = Admission(max_pending=2, max_authenticated=5)
+    assert admission.admit() and admission.admit()
+    assert not admission.admit()
+    assert admission.rejected_pending == 1
+
+    admission.release(authenticated=False)
+    assert admission.admit()
+    assert admission.snapshot()["live"] == 2
+
+
+def test_full_server_refuses_at_auth():
+    """The authenticated cap only applies at AUTH, pending sockets still get in"""
+    admission = Admission(max_pending=5, max_authenticated=1)
+    assert admission.admit() and admission.admit()
+    assert admission.promote()
+    assert not admission.promote()  # the second one is turned away at AUTH
+    admission.release(authenticated=False)
+
+    assert admission.admit()
+    assert admission.rejected_full == 1
+    assert (admission.pending, admission.authenticated, admission.peak) == (1, 1, 2)
+    admission.release(authenticated=False)
+
+    admission.release(authenticated=True)
+    assert admission.live == 0 and admission.admit()
+
+
+def test_reconnect_replaces_own_session_when_full():
+    """A stale session doesn't lock its own user out of a full server"""
+    admission = Admission(max_pending=5, max_authenticated=1)
+    assert admission.admit() and admission.promote()
+
+    assert admission.admit()
+    assert admission.promote(replacing=True)
+    assert admission.rejected_full == 0
+
+    # The kicked session's teardown hands its slot back
+    admission.release(authenticated=True)
+    assert (admission.pending, admission.authenticated) == (0, 1)
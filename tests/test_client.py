@@ -0,0 +1,181 @@
+import asyncio
+import contextlib
+import pytest
+
+from aronanet.clients.client import AronaClient, AuthFailed
+from aronanet.protocol.messages import MessageType
+from aronanet.server.server import AronaServer
+from aronanet.utils.config import AronaSettings
+
+
+@contextlib.asynccontextmanager
+async def local_server(tmp_path, **settings):
+    config = AronaSettings(config_path=tmp_path / "config.yaml")
+    for key, value in {"port": 0, "message_log": False, "keypool_size": 0, **settings}.items():
+        config.set(key, value, save=False)
+
+    arona = AronaServer(config)
+    server = await arona.listen()
+    try:
+        yield arona, server.sockets[0].getsockname()[1]
+    finally:
+        server.close()
+        arona.handshakes.stop()
+        await arona.typing.close()
+        await arona.timers.close()
+
+
+async def next_of(client: AronaClient, msg_type: MessageType):
+    async for msg in client:
+        if msg.msg_type == msg_type:
+            return msg
+
+
+@pytest.mark.asyncio
+async def test_text_dm_and_join(tmp_path):
+    async with local_server(tmp_path) as (_, port):
+        async with AronaClient("127.0.0.1", port, "arona") as arona, \
+                AronaClient("127.0.0.1", port, "plana") as plana:
+            await arona.join("club")
+            await plana.join("club")
+            assert plana.channel == "club"
+
+            # Pipelined: no waiting between sends, order is kept
+            for i in range(50):
+                await arona.send_text(f"msg {i}")
+            for i in range(50):
+                assert (await asyncio.wait_for(next_of(plana, MessageType.TEXT), 5)).payload == f"[arona] msg {i}".encode()
+
+            await plana.dm("arona", "psst")
+            assert (await asyncio.wait_for(next_of(arona, MessageType.DM), 5)).payload == b"[plana] psst"
+
+
+@pytest.mark.asyncio
+async def test_reconnects_and_resumes(tmp_path):
+    async with local_server(tmp_path) as (server, port):
+        async with AronaClient("127.0.0.1", port, "arona", reconnect_delay=0.05) as arona, \
+                AronaClient("127.0.0.1", port, "plana") as plana:
+            await arona.join("club")
+            await plana.join("club")
+            await asyncio.sleep(0.1)  # the TICKET arrives after AUTH_OK
+            assert arona.session
+
+            server.clients["arona"].abort()
+            await asyncio.sleep(0.3)
+            await asyncio.wait_for(arona.connected.wait(), 5)
+            assert arona.reconnects == 1
+            assert server.clients["arona"].resumed == "arona"
+
+            # Resumed into the same channel, and sends still go through
+            await arona.send_text("back")
+            msg = await asyncio.wait_for(next_of(plana, MessageType.TEXT), 5)
+            assert msg.payload == b"[arona] back"
+
+
+@pytest.mark.asyncio
+async def test_refused_name_raises(tmp_path):
+    async with local_server(tmp_path) as (_, port):
+        client = AronaClient("127.0.0.1", port, "x")
+        with pytest.raises(AuthFailed, match="Invalid username"):
+            await client.connect()
+
+        await client.close()
+        assert [msg async for msg in client] == []
+
+
+@pytest.mark.asyncio
+async def test_resume_replaces_live_socket(tmp_path):
+    """Resuming while the old socket is still up: the old one's teardown mustn't undo the new session"""
+    async with local_server(tmp_path) as (server, port):
+        async with AronaClient("127.0.0.1", port, "arona", reconnect=False) as old, \
+                AronaClient("127.0.0.1", port, "plana") as plana:
+            await old.join("club")
+            await plana.join("club")
+            await asyncio.sleep(0.1)
+
+            new = AronaClient("127.0.0.1", port, "arona")
+            new.session = old.session
+            async with new:
+                await asyncio.sleep(0.3)  # the old socket is aborted and torn down meanwhile
+                assert old._closed
+                conn = server.conn_manager.get_connection("arona")
+                assert conn is server.clients["arona"] and conn.resumed == "arona"
+                assert server.conn_manager.get_user_channel("arona") == "club"
+
+                await new.send_text("still here")
+                msg = await asyncio.wait_for(next_of(plana, MessageType.TEXT), 5)
+                assert msg.payload == b"[arona] still here"
+
+
+@pytest.mark.asyncio
+async def test_full_server_lets_a_user_replace_their_session(tmp_path):
+    """A stale session on a full server mustn't lock its own user out"""
+    async with local_server(tmp_path, max_connections=1) as (server, port):
+        async with AronaClient("127.0.0.1", port, "arona", reconnect=False) as old:
+            with pytest.raises(AuthFailed, match="Server full"):
+                await AronaClient("127.0.0.1", port, "plana", reconnect=False).connect()
+
+            async with AronaClient("127.0.0.1", port, "arona") as new:
+                await asyncio.sleep(0.2)  # the old socket is aborted and torn down meanwhile
+                assert old._closed
+                assert server.conn_manager.get_connection("arona") is server.clients["arona"]
+                assert server.admission.authenticated == 1
+
+
+@pytest.mark.asyncio
+async def test_idle_socket_doesnt_hold_a_handshake_slot(tmp_path):
+    """A socket that never sends HI mustn't keep everyone else from shaking hands"""
+    async with local_server(tmp_path, handshake_concurrency=1) as (_, port):
+        _, idle = await asyncio.open_connection("127.0.0.1", port)
+        await asyncio.sleep(0.05)
+
+        client = AronaClient("127.0.0.1", port, "arona")
+        try:
+            await asyncio.wait_for(client.connect(), 2)
+        finally:
+            await client.close()
+            idle.close()
+
+
+@pytest.mark.asyncio
+async def test_loopback_is_rate_limited_by_default(tmp_path):
+    """Tunnel traffic all comes from 127.0.0.1, exempting it would switch the limit off"""
+    async with local_server(tmp_path, handshake_rate=0.0001, handshake_burst=1) as (server, port):
+        async with AronaClient("127.0.0.1", port, "arona"):
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            assert await asyncio.wait_for(reader.read(), 2) == b""
+            writer.close()
+            assert server.handshakes.rejected == 1
+
+
+@pytest.mark.asyncio
+async def test_admission_slot_returned_when_setup_fails(tmp_path, monkeypatch):
+    """A socket whose ClientConnection can't be built still gives its pending slot back"""
+    import aronanet.server.server as server_module
+
+    def broken(*args, **kwargs):
+        raise RuntimeError("no keys today")
+
+    async with local_server(tmp_path) as (server, port):
+        monkeypatch.setattr(server_module, "ClientConnection", broken)
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        assert await asyncio.wait_for(reader.read(), 2) == b""
+        writer.close()
+
+        assert server.admission.accepted == 1
+        assert server.admission.pending == 0
+
+
+@pytest.mark.asyncio
+async def test_bad_channel_name_is_refused(tmp_path):
+    async with local_server(tmp_path, max_channel_name=16) as (server, port):
+        async with AronaClient("127.0.0.1", port, "arona") as arona:
+            with pytest.raises(ValueError, match="refused"):
+                await asyncio.wait_for(arona.join("x" * 17), 5)
+            with pytest.raises(ValueError):
+                await asyncio.wait_for(arona.join("tab\there"), 5)
+
+            assert arona.channel == "general"
+            assert server.conn_manager.get_user_channel("arona") == "general"
+            await asyncio.wait_for(arona.join("club"), 5)
+            assert server.conn_manager.get_user_channel("arona") == "club"
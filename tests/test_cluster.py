@@ -0,0 +1,159 @@
+import asyncio
+import pytest
+from unittest.mock import MagicMock, AsyncMock
+
+from aronanet.server.cluster import BusHub, BusKind, WorkerBus, pack_bus, unpack_bus
+from aronanet.server.connection_manager import ConnectionManager
+from aronanet.server.connection import ClientConnection
+from aronanet.protocol.messages import Message, MessageType
+
+def test_bus_frame_roundtrip():
+    frame = pack_bus(BusKind.CHANNEL, 3, b"general", b"", b"\x10", b"[bob] hi")
+
+    assert int.from_bytes(frame[:4], "big") == len(frame) - 4
+    assert unpack_bus(frame[4:]) == (BusKind.CHANNEL, 3, [b"general", b"", b"\x10", b"[bob] hi"])
+
+
+@pytest.mark.asyncio
+async def test_hub_relays_between_workers(tmp_path):
+    """A broadcast on one worker reaches users on another, presence is shared"""
+    hub = BusHub(str(tmp_path / "bus.sock"))
+    await hub.start()
+
+    managers, buses = [], []
+    for worker_id in range(2):
+        bus = WorkerBus(hub.path, worker_id)
+        await bus.connect()
+        cm = ConnectionManager()
+        cm.attach_bus(bus)
+        managers.append(cm)
+        buses.append(bus)
+
+    alice, bob = MagicMock(spec=ClientConnection), MagicMock(spec=ClientConnection)
+    alice.enqueue, bob.enqueue = AsyncMock(return_value=True), AsyncMock(return_value=True)
+    await asyncio.sleep(0.05)
+    managers[0].add_user("alice", alice)
+    managers[1].add_user("bob", bob)
+    await asyncio.sleep(0.05)
+
+    assert set(managers[0].get_online_users()) == {"alice", "bob"}
+    assert managers[1].remote_users["alice"] == (0, "general")
+
+    await managers[0].scream_to_channel("general", Message(msg_type=MessageType.TEXT, payload=b"hi"), exclude="alice")
+    assert await managers[0].scream_to_user("bob", Message(msg_type=MessageType.DM, payload=b"psst"))
+    await asyncio.sleep(0.05)
+
+    sent = [call.args[0] for call in bob.enqueue.await_args_list]
+    assert [(m.msg_type, m.payload) for m in sent] == [(MessageType.TEXT, b"hi"), (MessageType.DM, b"psst")]
+    alice.enqueue.assert_not_awaited()
+
+    managers[1].remove_user("bob")
+    await asyncio.sleep(0.05)
+    assert "bob" not in managers[0].remote_users
+
+    for bus in buses:
+        await bus.close()
+    await hub.stop()
+
+
+@pytest.mark.asyncio
+async def test_catch_up_ignores_another_workers_seq():
+    """Workers number channels on their own, a resume elsewhere gets the full backlog instead of a wrong slice"""
+    from aronanet.protocol.messages import parse_history
+
+    managers = []
+    for worker_id in range(2):
+        cm = ConnectionManager()
+        cm.attach_bus(MagicMock(spec=WorkerBus, worker_id=worker_id))
+        managers.append(cm)
+
+    # Worker 1 was up for one more message, so its numbers run one ahead
+    await managers[1].scream_to_channel("general", Message(msg_type=MessageType.TEXT, payload=b"zero"), relay=False)
+    for text in (b"one", b"two", b"three"):
+        for cm in managers:
+            await cm.scream_to_channel("general", Message(msg_type=MessageType.TEXT, payload=text), relay=False)
+
+    bob = MagicMock(spec=ClientConnection)
+    bob.enqueue = AsyncMock(return_value=True)
+    managers[0].add_user("bob", bob)
+    seen, _ = parse_history(managers[0].catch_up("bob", 0).payload)
+
+    # Resumed on worker 1: worker 0's head means nothing there
+    managers[1].add_user("bob", bob)
+    head, records = parse_history(managers[1].catch_up("bob", seen).payload)
+    assert [payload for _, _, payload in records] == [b"zero", b"one", b"two", b"three"]
+
+    # Its own seqs still give an exact catch-up
+    await managers[1].scream_to_channel("general", Message(msg_type=MessageType.TEXT, payload=b"four"), relay=False)
+    _, records = parse_history(managers[1].catch_up("bob", head).payload)
+    assert [payload for _, _, payload in records] == [b"four"]
+
+
+@pytest.mark.asyncio
+async def test_restarted_worker_takes_its_users_offline(tmp_path):
+    """A worker that HELLOs again lost its users, the others must not keep them as ghosts"""
+    hub = BusHub(str(tmp_path / "bus.sock"))
+    await hub.start()
+
+    managers, buses = [], []
+    for worker_id in range(2):
+        bus = WorkerBus(hub.path, worker_id)
+        await bus.connect()
+        cm = ConnectionManager()
+        cm.attach_bus(bus)
+        managers.append(cm)
+        buses.append(bus)
+
+    alice = MagicMock(spec=ClientConnection)
+    alice.enqueue = AsyncMock(return_value=True)
+    await asyncio.sleep(0.05)
+    managers[0].add_user("alice", alice)
+    await asyncio.sleep(0.05)
+    assert "alice" in managers[1].remote_users
+
+    # Worker 0 restarts before the hub noticed its old socket was gone
+    restarted = WorkerBus(hub.path, 0)
+    await restarted.connect()
+    await asyncio.sleep(0.05)
+    assert "alice" not in managers[1].remote_users
+    assert "alice" not in hub.presence
+
+    for bus in buses + [restarted]:
+        await bus.close()
+    await hub.stop()
+
+
+@pytest.mark.asyncio
+async def test_worker_closes_clients_on_shutdown(tmp_path):
+    from aronanet.clients.client import AronaClient
+    from aronanet.server.server import AronaServer
+    from aronanet.utils.config import AronaSettings
+
+    hub = BusHub(str(tmp_path / "bus.sock"))
+    await hub.start()
+    config = AronaSettings(config_path=tmp_path / "config.yaml")
+    for key, value in {"port": 0, "message_log": False, "keypool_size": 0}.items():
+        config.set(key, value, save=False)
+    worker = AronaServer(config, worker_id=0)
+
+    listening = asyncio.Event()
+    listen = worker.listen
+
+    async def listen_and_tell():
+        server = await listen()
+        worker.port = server.sockets[0].getsockname()[1]
+        listening.set()
+        return server
+
+    worker.listen = listen_and_tell
+    task = asyncio.create_task(worker.serve_worker(hub.path))
+    await asyncio.wait_for(listening.wait(), 5)
+
+    async with AronaClient("127.0.0.1", worker.port, "arona", reconnect=False) as arona:
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.wait_for(task, 5)
+        await asyncio.sleep(0.1)
+        assert arona._closed
+
+    await hub.stop()
@@ -62,10 +62,10 @@ async def test_scream_to_channel():
 
     # Mock connections
     alice = MagicMock(spec=ClientConnection)
-    alice.send_msg = AsyncMock()
+    alice.enqueue = AsyncMock()
 
     bob = MagicMock(spec=ClientConnection)
-    bob.send_msg = AsyncMock()
+    bob.enqueue = AsyncMock()
 
     cm.add_user("alice", alice)
     cm.add_user("bob", bob)
@@ -75,8 +75,8 @@ async def test_scream_to_channel():
     await cm.scream_to_channel("general", msg)
 
     # Both should receive
-    alice.send_msg.assert_called_once()
-    bob.send_msg.assert_called_once()
+    alice.enqueue.assert_called_once()
+    bob.enqueue.assert_called_once()
 
 
 @pytest.mark.asyncio
@@ -85,10 +85,10 @@ async def test_scream_excludes_sender():
     cm = ConnectionManager()
 
     alice = MagicMock(spec=ClientConnection)
-    alice.send_msg = AsyncMock()
+    alice.enqueue = AsyncMock()
 
     bob = MagicMock(spec=ClientConnection)
-    bob.send_msg = AsyncMock()
+    bob.enqueue = AsyncMock()
 
     cm.add_user("alice", alice)
     cm.add_user("bob", bob)
@@ -98,5 +98,140 @@ async def test_scream_excludes_sender():
     await cm.scream_to_channel("general", msg, exclude="alice")
 
     # Only bob receives
-    alice.send_msg.assert_not_called()
-    bob.send_msg.assert_called_once()
\ No newline at end of file
+    alice.enqueue.assert_not_called()
+    bob.enqueue.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_scream_group_key_mode():
+    """Group channels send the key once, then one shared GROUP envelope"""
+    cm = ConnectionManager(group_channels=["general"])
+
+    alice = MagicMock(spec=ClientConnection)
+    alice.enqueue = AsyncMock(return_value=True)
+    bob = MagicMock(spec=ClientConnection)
+    bob.enqueue = AsyncMock(return_value=True)
+
+    cm.add_user("alice", alice)
+    cm.add_user("bob", bob)
+
+    await cm.scream_to_channel("general", Message(msg_type=MessageType.TEXT, payload=b"one"))
+    await cm.scream_to_channel("general", Message(msg_type=MessageType.TEXT, payload=b"two"))
+
+    sent = [call.args[0] for call in alice.enqueue.call_args_list]
+    assert [m.msg_type for m in sent] == [MessageType.GROUP_KEY, MessageType.GROUP, MessageType.GROUP]
+    assert bob.enqueue.call_args_list[1].args[0] is sent[1]
+
+    # Leaving rotates the key, so the next broadcast hands out a new one
+    cm.leave_channel("bob", "general")
+    await cm.scream_to_channel("general", Message(msg_type=MessageType.TEXT, payload=b"three"))
+    assert alice.enqueue.call_args_list[-2].args[0].msg_type == MessageType.GROUP_KEY
+
+
+def test_resume_restores_channel():
+    """A resumed session goes back to its old channel, a fresh login starts in general"""
+    cm = ConnectionManager()
+
+    cm.add_user("alice", MagicMock(spec=ClientConnection))
+    cm.join_channel("alice", "memes")
+    cm.remove_user("alice")
+
+    conn = MagicMock(spec=ClientConnection)
+    cm.add_user("alice", conn, resume=True)
+    assert cm.user_channels["alice"] == "memes"
+    assert conn.channel == "memes"
+
+    cm.remove_user("alice")
+    cm.add_user("alice", MagicMock(spec=ClientConnection))
+    assert cm.user_channels["alice"] == "general"
+
+
+@pytest.mark.asyncio
+async def test_history_catch_up():
+    """TEXT broadcasts are numbered per channel and replayed after a given seq"""
+    from aronanet.protocol.messages import parse_history
+
+    cm = ConnectionManager(history_size=3)
+    alice = MagicMock(spec=ClientConnection)
+    alice.enqueue = AsyncMock(return_value=True)
+    bob = MagicMock(spec=ClientConnection)
+    bob.enqueue = AsyncMock(return_value=True)
+    cm.add_user("alice", alice)
+    cm.add_user("bob", bob)
+
+    for text in (b"one", b"two", b"three", b"four"):
+        await cm.scream_to_channel("general", Message(msg_type=MessageType.TEXT, payload=text), exclude="alice")
+
+    head, records = parse_history(cm.catch_up("bob", 2).payload)
+    assert head == 4
+    assert [(seq, payload) for seq, _, payload in records] == [(3, b"three"), (4, b"four")]
+
+    # Past the head: the server restarted, send everything we have
+    assert len(parse_history(cm.catch_up("bob", 99).payload)[1]) == 3
+
+    # Bob asked, so live broadcasts now carry their seq; alice still gets TEXT
+    await cm.scream_to_channel("general", Message(msg_type=MessageType.TEXT, payload=b"five"))
+    live = bob.enqueue.call_args_list[-1].args[0]
+    assert live.msg_type == MessageType.HISTORY
+    assert parse_history(live.payload) == (5, [(5, MessageType.TEXT, b"five")])
+    assert alice.enqueue.call_args_list[-1].args[0].msg_type == MessageType.TEXT
+
+
+@pytest.mark.asyncio
+async def test_history_survives_restart_with_log(tmp_path):
+    """Seqs carry on and catch-up is served from disk after a restart"""
+    from aronanet.protocol.messages import parse_history
+    from aronanet.server.message_log import MessageLog
+
+    cm = ConnectionManager(log=MessageLog(tmp_path))
+    alice = MagicMock(spec=ClientConnection)
+    alice.enqueue = AsyncMock(return_value=True)
+    cm.add_user("alice", alice)
+    for text in (b"one", b"two", b"three"):
+        await cm.scream_to_channel("general", Message(msg_type=MessageType.TEXT, payload=text))
+    await cm.log.close()
+
+    cm = ConnectionManager(log=MessageLog(tmp_path))
+    cm.add_user("alice", alice)
+    head, records = parse_history(cm.catch_up("alice", 1).payload)
+    assert head == 3
+    assert [payload for _, _, payload in records] == [b"two", b"three"]
+
+    await cm.scream_to_channel("general", Message(msg_type=MessageType.TEXT, payload=b"four"))
+    assert parse_history(alice.enqueue.call_args_list[-1].args[0].payload)[0] == 4
+    await cm.log.close()
+
+
+@pytest.mark.asyncio
+async def test_history_of_empty_channels_is_bounded():
+    """Past history_channels, the least recently used channel nobody is in loses its history"""
+    from aronanet.protocol.messages import parse_history
+
+    cm = ConnectionManager(history_channels=3)
+    alice = MagicMock(spec=ClientConnection)
+    alice.enqueue = AsyncMock(return_value=True)
+    cm.add_user("alice", alice)
+
+    for channel in ("one", "two", "three", "four"):
+        cm.join_channel("alice", channel)
+        await cm.scream_to_channel(channel, Message(msg_type=MessageType.TEXT, payload=channel.encode()))
+    cm.join_channel("alice", "general")
+
+    # general always exists, so only the emptied channels go
+    assert list(cm.history) == ["general", "three", "four"]
+    assert "one" not in cm.seqs and "two" not in cm.seqs
+    cm.join_channel("alice", "four")
+    assert parse_history(cm.catch_up("alice", 0).payload)[1] == [(1, MessageType.TEXT, b"four")]
+
+
+@pytest.mark.asyncio
+async def test_log_errors_dont_stop_delivery():
+    cm = ConnectionManager(log=MagicMock())
+    cm.log.head.return_value = 0
+    cm.log.append.side_effect = OSError(36, "File name too long")
+    alice = MagicMock(spec=ClientConnection)
+    alice.enqueue = AsyncMock(return_value=True)
+    cm.add_user("alice", alice)
+
+    await cm.scream_to_channel("general", Message(msg_type=MessageType.TEXT, payload=b"hi"))
+    assert alice.enqueue.await_args.args[0].payload == b"hi"
+    assert cm.seqs["general"] == 1
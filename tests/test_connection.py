@@ -0,0 +1,146 @@
+import asyncio
+import pytest
+from unittest.mock import MagicMock, AsyncMock
+
+from aronanet.server.connection import ClientConnection
+from aronanet.protocol.messages import Message, MessageType
+
+def make_conn(**kwargs):
+    reader = MagicMock(spec=asyncio.StreamReader)
+    writer = MagicMock(spec=asyncio.StreamWriter)
+    writer.get_extra_info.return_value = ("127.0.0.1", 1234)
+    return ClientConnection(reader, writer, **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_enqueue_drop_oldest():
+    """Full queue drops the oldest message and keeps the new one"""
+    conn = make_conn(queue_size=2, overflow_policy="drop_oldest")
+    msgs = [Message(msg_type=MessageType.TEXT, payload=bytes([i])) for i in range(3)]
+
+    for msg in msgs:
+        assert await conn.enqueue(msg)
+
+    assert conn.dropped == 1
+    assert conn.outbox.get_nowait() is msgs[1]
+    assert conn.outbox.get_nowait() is msgs[2]
+
+
+@pytest.mark.asyncio
+async def test_drop_oldest_keeps_control_frames():
+    """GROUP_KEY, TICKET and friends survive overflow, chat goes instead"""
+    conn = make_conn(queue_size=3, overflow_policy="drop_oldest")
+    key = Message(msg_type=MessageType.GROUP_KEY, payload=b"k")
+    text = Message(msg_type=MessageType.TEXT, payload=b"a")
+    ticket = Message(msg_type=MessageType.TICKET, payload=b"t")
+    for msg in (key, text, ticket):
+        assert await conn.enqueue(msg)
+
+    newer = Message(msg_type=MessageType.TEXT, payload=b"b")
+    assert await conn.enqueue(newer)
+    assert [conn.outbox.get_nowait() for _ in range(3)] == [key, ticket, newer]
+
+    # Nothing left to drop: new chat is refused, new control frames cost the connection
+    for msg in (key, ticket, Message(msg_type=MessageType.SUP)):
+        await conn.enqueue(msg)
+    assert not await conn.enqueue(Message(msg_type=MessageType.TEXT, payload=b"c"))
+    assert conn.dropped == 2
+    conn.writer.transport.abort.assert_not_called()
+
+    assert not await conn.enqueue(Message(msg_type=MessageType.PONG))
+    conn.writer.transport.abort.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_enqueue_disconnect():
+    """Full queue aborts the connection under the disconnect policy"""
+    conn = make_conn(queue_size=1, overflow_policy="disconnect")
+
+    assert await conn.enqueue(Message(payload=b"a"))
+    assert not await conn.enqueue(Message(payload=b"b"))
+    conn.writer.transport.abort.assert_called_once()
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        make_conn(overflow_policy="yeet")
+
+
+@pytest.mark.asyncio
+async def test_writer_task_drains_in_order():
+    """Writer task sends queued messages in the order they were queued"""
+    conn = make_conn()
+    sent = []
+
+    async def fake_send(msgs):
+        sent.extend(msgs)
+
+    conn.send_batch = fake_send
+    msgs = [Message(payload=bytes([i])) for i in range(5)]
+    for msg in msgs:
+        await conn.enqueue(msg)
+
+    conn.start_writer()
+    await asyncio.sleep(0)
+    await conn.close()
+
+    assert sent == msgs
+
+
+@pytest.mark.asyncio
+async def test_writer_coalesces_into_one_write():
+    """Messages queued in the same tick go out in a single write + drain"""
+    conn = make_conn()
+    conn.secure_channel.setup_shared_key(b"k" * 32)
+    conn.writer.drain = AsyncMock()
+
+    for i in range(5):
+        await conn.enqueue(Message(msg_type=MessageType.TEXT, payload=bytes([i])))
+
+    conn.start_writer()
+    await asyncio.sleep(0)
+    await conn.close()
+
+    conn.writer.write.assert_called_once()
+    conn.writer.drain.assert_awaited_once()
+
+    data = bytes(conn.writer.write.call_args.args[0])
+    payloads = []
+    while data:
+        size = int.from_bytes(data[:4], "big")
+        payloads.append(Message.unpack(data[4:4 + size], conn.secure_channel).payload)
+        data = data[4 + size:]
+    assert payloads == [bytes([i]) for i in range(5)]
+
+
+@pytest.mark.asyncio
+async def test_writer_puts_chat_ahead_of_bulk():
+    """Queued chat goes out before file chunks, one chunk per write"""
+    conn = make_conn(bulk_queue_size=4)
+    batches = []
+
+    async def fake_send(msgs):
+        batches.append([m.payload for m in msgs])
+
+    conn.send_batch = fake_send
+    for i in range(3):
+        await conn.enqueue_bulk(Message(msg_type=MessageType.CHUNK, payload=b"chunk%d" % i))
+    await conn.enqueue(Message(payload=b"hi"))
+    await conn.enqueue(Message(payload=b"there"))
+
+    conn.start_writer()
+    await asyncio.sleep(0)
+    await conn.close()
+
+    assert batches == [[b"hi", b"there", b"chunk0"], [b"chunk1"], [b"chunk2"]]
+
+
+@pytest.mark.asyncio
+async def test_enqueue_bulk_waits_for_room():
+    """A full bulk queue holds the producer back instead of dropping chunks"""
+    conn = make_conn(bulk_queue_size=1)
+    await conn.enqueue_bulk(Message(msg_type=MessageType.CHUNK, payload=b"a"))
+
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(conn.enqueue_bulk(Message(msg_type=MessageType.CHUNK, payload=b"b")), 0.05)
+    assert conn.bulk.qsize() == 1
@@ -0,0 +1,96 @@
+import asyncio
+import pytest
+
+from aronanet.protocol.framing import FrameDecoder, FrameTooLarge, FrameReader, StreamFrames
+
+def frame(data: bytes) -> bytes:
+    return len(data).to_bytes(4, "big") + data
+
+
+def test_pipelined_frames_from_one_read():
+    """Several frames in one chunk come out one by one"""
+    dec = FrameDecoder()
+    dec.feed(frame(b"one") + frame(b"two") + frame(b"three"))
+
+    assert bytes(dec.next_frame()) == b"one"
+    assert bytes(dec.next_frame()) == b"two"
+    assert bytes(dec.next_frame()) == b"three"
+    assert dec.next_frame() is None
+
+
+def test_frame_split_across_reads():
+    """Partial frames wait for the rest, including a split length prefix"""
+    dec = FrameDecoder(buffer_size=16)
+    data = frame(b"x" * 100)
+
+    dec.feed(data[:2])
+    assert dec.next_frame() is None
+    dec.feed(data[2:50])
+    assert dec.next_frame() is None
+    dec.feed(data[50:])
+    assert bytes(dec.next_frame()) == b"x" * 100
+
+
+def test_held_frame_survives_buffer_growth():
+    """A frame handed out stays intact while more data arrives behind it"""
+    dec = FrameDecoder(buffer_size=16)
+    dec.feed(frame(b"first"))
+    first = dec.next_frame()
+
+    dec.feed(frame(b"y" * 200))
+    assert bytes(first) == b"first"
+    assert bytes(dec.next_frame()) == b"y" * 200
+
+
+def test_oversized_prefix_rejected():
+    """Bogus length prefix raises before anything gets allocated"""
+    dec = FrameDecoder(max_frame_size=1024)
+    dec.feed((2 ** 32 - 1).to_bytes(4, "big"))
+
+    with pytest.raises(FrameTooLarge):
+        dec.next_frame()
+
+
+@pytest.mark.asyncio
+async def test_stream_frames_eof():
+    reader = asyncio.StreamReader()
+    reader.feed_data(frame(b"hi") + frame(b"yo")[:3])
+    reader.feed_eof()
+    frames = StreamFrames(reader)
+
+    assert bytes(await frames.read_frame()) == b"hi"
+    with pytest.raises(asyncio.IncompleteReadError):
+        await frames.read_frame()
+
+
+@pytest.mark.asyncio
+async def test_frame_reader_over_socket():
+    """FrameReader as server protocol and client connection"""
+    loop = asyncio.get_running_loop()
+    received = asyncio.Queue()
+
+    async def consume(proto: FrameReader):
+        while True:
+            try:
+                received.put_nowait(bytes(await proto.read_frame()))
+            except asyncio.IncompleteReadError:
+                return
+
+    server = await loop.create_server(
+        lambda: FrameReader(on_connect=lambda p: asyncio.ensure_future(consume(p))),
+        "127.0.0.1", 0
+    )
+    port = server.sockets[0].getsockname()[1]
+
+    _, client = await loop.create_connection(FrameReader, "127.0.0.1", port)
+    client.write(frame(b"a") + frame(b"b" * 70000) + frame(b"c"))
+    await client.drain()
+
+    assert await received.get() == b"a"
+    assert await received.get() == b"b" * 70000
+    assert await received.get() == b"c"
+
+    client.close()
+    await client.wait_closed()
+    server.close()
+    await server.wait_closed()
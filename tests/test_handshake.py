@@ -0,0 +1,42 @@
+import asyncio
+import pytest
+
+from aronanet.server.handshake import HandshakeGate, KeyPool, TokenBucket
+
+def test_token_bucket_burst():
+    bucket = TokenBucket(rate=0.0001, burst=3)
+
+    assert [bucket.take() for _ in range(4)] == [True, True, True, False]
+
+
+def test_gate_rate_limits_per_ip():
+    gate = HandshakeGate(threads=0, pool_size=0, rate=0.0001, burst=2, exempt=["127.0.0.1"])
+
+    assert gate.allow("10.0.0.1") and gate.allow("10.0.0.1")
+    assert not gate.allow("10.0.0.1")
+    assert gate.allow("10.0.0.2")
+    assert all(gate.allow("127.0.0.1") for _ in range(10))
+    assert gate.rejected == 1
+
+
+@pytest.mark.asyncio
+async def test_key_pool_refills_in_background():
+    pool = KeyPool(size=8, batch=4)
+    pool.start()
+    while len(pool.keys) < 8:
+        await asyncio.sleep(0.01)
+
+    keys = [pool.take() for _ in range(5)]
+    assert pool.misses == 0
+    assert len({k.get_public_bytes() for k in keys}) == 5
+
+    while len(pool.keys) < 8:
+        await asyncio.sleep(0.01)
+    pool.stop()
+
+
+def test_empty_pool_generates_inline():
+    pool = KeyPool(size=0)
+
+    assert pool.take().get_public_bytes()
+    assert pool.misses == 1
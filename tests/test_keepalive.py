@@ -0,0 +1,127 @@
+import asyncio
+import time
+import pytest
+from unittest.mock import MagicMock
+
+from aronanet.protocol.messages import Message, MessageType
+from aronanet.server.connection import ClientConnection
+from aronanet.server.keepalive import Keepalive
+from aronanet.server.timers import TimerWheel
+
+def make_conn(authenticated: bool = False, idle: float = 0.0):
+    conn = MagicMock(spec=ClientConnection)
+    conn.user = ("127.0.0.1", 1234)
+    conn.username = "alice"
+    conn.authenticated = authenticated
+    conn.closed = False
+    conn.timer = None
+    conn.last_seen = time.monotonic() - idle
+    conn.offer = MagicMock(return_value=True)
+    return conn
+
+async def run_ticks(wheel: TimerWheel, ticks: int):
+    for _ in range(ticks):
+        await wheel.advance()
+
+
+@pytest.mark.asyncio
+async def test_wheel_fires_on_time_across_turns():
+    wheel = TimerWheel(tick=1.0, slots=4)
+    fired = []
+    wheel.schedule(2, fired.append, "soon")
+    wheel.schedule(9, fired.append, "later")
+    wheel.schedule(3, fired.append, "never").cancel()
+
+    await run_ticks(wheel, 2)
+    assert fired == ["soon"]
+    await run_ticks(wheel, 6)
+    assert fired == ["soon"]
+    await run_ticks(wheel, 1)
+    assert fired == ["soon", "later"]
+    assert not any(wheel.slots)
+
+
+@pytest.mark.asyncio
+async def test_unauthenticated_socket_is_dropped():
+    wheel = TimerWheel()
+    keepalive = Keepalive(wheel, handshake_timeout=3)
+    slow, quick = make_conn(), make_conn()
+    keepalive.watch(slow)
+    keepalive.watch(quick)
+    quick.authenticated = True
+    keepalive.authenticated(quick)
+
+    await run_ticks(wheel, 3)
+    slow.abort.assert_called_once()
+    quick.abort.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_idle_client_is_pinged_then_reaped():
+    wheel = TimerWheel()
+    keepalive = Keepalive(wheel, interval=2, timeout=4)
+    conn = make_conn(authenticated=True)
+    keepalive.authenticated(conn)
+
+    conn.last_seen -= 2
+    await run_ticks(wheel, 2)
+    assert conn.offer.call_args.args[0].msg_type == MessageType.PING
+    conn.abort.assert_not_called()
+
+    conn.last_seen -= 2
+    await run_ticks(wheel, 2)
+    conn.abort.assert_called_once()
+    assert keepalive.reaped == 1
+
+
+@pytest.mark.asyncio
+async def test_active_client_is_left_alone():
+    wheel = TimerWheel()
+    keepalive = Keepalive(wheel, interval=2, timeout=4)
+    conn = make_conn(authenticated=True)
+    keepalive.authenticated(conn)
+
+    for _ in range(5):
+        conn.last_seen = time.monotonic()
+        await run_ticks(wheel, 2)
+
+    conn.offer.assert_not_called()
+    conn.abort.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_blocked_outbox_doesnt_stall_the_wheel():
+    """Block policy + a half-open socket that never drains: the PING is skipped, the wheel keeps going"""
+    reader, writer = MagicMock(spec=asyncio.StreamReader), MagicMock(spec=asyncio.StreamWriter)
+    writer.get_extra_info.return_value = ("127.0.0.1", 1234)
+    stuck = ClientConnection(reader, writer, queue_size=1, overflow_policy="block")
+    stuck.username, stuck.authenticated = "alice", True
+    stuck.offer(Message(msg_type=MessageType.TEXT, payload=b"never sent"))
+
+    wheel = TimerWheel()
+    keepalive = Keepalive(wheel, interval=2, timeout=4, handshake_timeout=3)
+    keepalive.authenticated(stuck)
+    late = make_conn()
+    keepalive.watch(late)
+
+    stuck.last_seen -= 2
+    await asyncio.wait_for(run_ticks(wheel, 3), 1)
+    assert stuck.outbox.qsize() == 1
+    late.abort.assert_called_once()
+
+    stuck.last_seen -= 2
+    await asyncio.wait_for(run_ticks(wheel, 2), 1)
+    writer.transport.abort.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_coroutine_timers_run_as_tasks():
+    wheel = TimerWheel()
+    hang = asyncio.Event()
+    fired = []
+    wheel.schedule(1, hang.wait)
+    wheel.schedule(1, fired.append, "next")
+
+    await asyncio.wait_for(wheel.advance(), 1)
+    assert fired == ["next"]
+    await wheel.close()
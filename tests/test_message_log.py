@@ -0,0 +1,89 @@
+import pytest
+
+from aronanet.protocol.messages import MessageType
+from aronanet.server.message_log import MessageLog, Segment
+
+def fill(log: MessageLog, channel: str, first: int, last: int):
+    for seq in range(first, last + 1):
+        log.append(channel, seq, MessageType.TEXT, f"msg {seq}".encode())
+
+
+@pytest.mark.asyncio
+async def test_read_before_and_after_flush(tmp_path):
+    log = MessageLog(tmp_path)
+    fill(log, "general", 1, 5)
+
+    assert [r[0] for r in log.read("general", 2)] == [3, 4, 5]
+    await log.flush()
+    fill(log, "general", 6, 6)
+    assert log.read("general", 4) == [(5, MessageType.TEXT, b"msg 5"), (6, MessageType.TEXT, b"msg 6")]
+    assert [r[0] for r in log.last("general", 2)] == [5, 6]
+
+    await log.close()
+
+
+@pytest.mark.asyncio
+async def test_survives_restart_and_rotates(tmp_path):
+    log = MessageLog(tmp_path, segment_bytes=200)
+    fill(log, "general", 1, 10)
+    fill(log, "../sneaky", 1, 1)
+    await log.close()
+
+    log = MessageLog(tmp_path, segment_bytes=200)
+    assert log.head("general") == 10
+    assert len(log.channels["general"].segments) > 1
+    assert [r[0] for r in log.read("general", 0, limit=4)] == [1, 2, 3, 4]
+    assert log.read("../sneaky", 0)[0][2] == b"msg 1"
+    assert all(p.parent == tmp_path for p in tmp_path.iterdir())
+
+    await log.close()
+
+
+@pytest.mark.asyncio
+async def test_retention_drops_oldest_segments(tmp_path):
+    log = MessageLog(tmp_path, segment_bytes=200, retention_bytes=400)
+    fill(log, "general", 1, 30)
+    await log.flush()
+
+    assert log.channels["general"].size <= 400 + 200
+    assert log.read("general", 0)[0][0] > 1
+    assert log.head("general") == 30
+
+    await log.close()
+
+
+@pytest.mark.asyncio
+async def test_idle_channels_are_closed_and_reopened(tmp_path):
+    """Only max_open channel logs hold files, the rest come back from disk on read"""
+    log = MessageLog(tmp_path, max_open=2)
+    for channel in ("a", "b", "c", "d"):
+        fill(log, channel, 1, 3)
+    assert list(log.channels) == ["c", "d"]
+
+    # Evicted before their records hit the disk: still readable, closed once flushed
+    assert [r[0] for r in log.read("a", 1)] == [2, 3]
+    await log.flush()
+    assert len(log.channels) == 2 and not log._closing
+
+    assert log.head("b") == 3
+    assert log.read("b", 0)[2] == (3, MessageType.TEXT, b"msg 3")
+    assert log.read("nowhere", 0) == [] and not (tmp_path / "nowhere".encode().hex()).exists()
+
+    await log.close()
+
+
+def test_recovers_index_ahead_of_data(tmp_path):
+    """A crash after the index was updated but before the write leaves slots pointing past the file"""
+    seg = Segment(tmp_path, 1, entries=16)
+    seg.append(b"a" * 10)
+    seg.start_flush()
+    seg.flush_sync()
+    seg.finish_flush()
+    seg.append(b"b" * 10)  # never written
+    seg.close()
+
+    seg = Segment(tmp_path, 1, entries=16)
+    assert seg.count == 1
+    assert seg.record(1) == b"a" * 10
+    assert seg.ends[1] == 0
+    seg.close()
@@ -0,0 +1,64 @@
+import asyncio
+import pytest
+
+from aronanet.utils.metrics import MetricsServer, Registry, bucket_floor, bucket_index
+
+
+def test_buckets_cover_values_within_an_eighth():
+    for value in (0, 1, 7, 8, 9, 100, 1_000, 123_456_789, 2**63):
+        index = bucket_index(value)
+        assert bucket_floor(index) <= value < bucket_floor(index + 1)
+        assert bucket_floor(index + 1) - bucket_floor(index) <= max(1, value // 8)
+
+
+def test_histogram_percentiles_and_render():
+    metrics = Registry()
+    latency = metrics.histogram("test_seconds", "Made up", stage="read")
+    for us in range(1, 101):
+        latency.record(us * 1000)
+
+    assert latency.count == 100
+    assert 45e-6 <= latency.percentile(50) <= 57e-6
+    assert 95e-6 <= latency.percentile(99) <= 113e-6
+
+    text = metrics.render()
+    assert "# TYPE test_seconds histogram" in text
+    assert 'test_seconds_bucket{stage="read",le="+Inf"} 100' in text
+    assert 'test_seconds_count{stage="read"} 100' in text
+    # Cumulative bucket counts never go down
+    counts = [int(line.rsplit(" ", 1)[1]) for line in text.splitlines() if line.startswith("test_seconds_bucket")]
+    assert counts == sorted(counts)
+
+
+def test_counters_and_gauges_read_at_scrape():
+    metrics = Registry()
+    live = {"n": 3}
+    metrics.counter("test_total", "Things").inc(2)
+    metrics.gauge("test_live", fn=lambda: live["n"])
+    live["n"] = 5
+
+    text = metrics.render()
+    assert "test_total 2" in text
+    assert "test_live 5" in text
+
+    with pytest.raises(ValueError):
+        metrics.gauge("test_total")
+
+
+@pytest.mark.asyncio
+async def test_endpoint_serves_prometheus_text():
+    metrics = Registry()
+    metrics.counter("test_total").inc()
+    server = MetricsServer(metrics, port=0)
+    await server.start()
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        response = await reader.read()
+        writer.close()
+
+    finally:
+        await server.stop()
+
+    assert response.startswith(b"HTTP/1.0 200 OK")
+    assert response.endswith(b"test_total 1\n")
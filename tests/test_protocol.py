@@ -71,3 +71,218 @@ def test_unpack_length_mismatch():
     # unpack should either error on slicing or checksum mismatch
     with pytest.raises(Exception):
         Message.unpack(bytes(packed))
+
+
+def test_pack_reuses_header_for_broadcast():
+    """Same message packed for two recipients shares the header but not the ciphertext."""
+    from src.aronanet.protocol.crypto import SecureChannel
+
+    a, b = SecureChannel(), SecureChannel()
+    a.setup_shared_key(b"a" * 32)
+    b.setup_shared_key(b"b" * 32)
+
+    msg = Message(msg_type=MessageType.TEXT, payload=b"hello everyone")
+    packed_a, packed_b = msg.pack(a), msg.pack(b)
+
+    assert packed_a[:8] == packed_b[:8]
+    assert Message.unpack(packed_a, a).payload == b"hello everyone"
+    assert Message.unpack(packed_b, b).payload == b"hello everyone"
+
+
+def test_group_key_roundtrip():
+    """GROUP payload sealed with a channel key opens with the distributed copy."""
+    from src.aronanet.protocol.crypto import GroupKey
+
+    key = GroupKey()
+    client_key, channel = GroupKey.from_payload(key.to_payload("general"))
+    assert channel == "general"
+
+    sealed = key.seal(MessageType.TEXT, b"[alice] hi")
+    msg = Message.unpack(Message(msg_type=MessageType.GROUP, payload=sealed).pack())
+    assert client_key.open(msg.payload) == (MessageType.TEXT, b"[alice] hi")
+
+
+def test_pack_into_matches_pack():
+    """pack_into writes the same frame as pack() at any offset, and unpack reads it from a view."""
+    from src.aronanet.protocol.crypto import SecureChannel
+
+    msg = Message(msg_type=MessageType.SUP, payload=b"general")
+    buf = bytearray(4 + msg.packed_size())
+    written = msg.pack_into(buf, 4)
+
+    assert written == len(buf) - 4
+    assert bytes(buf[4:]) == msg.pack()
+
+    channel = SecureChannel()
+    channel.setup_shared_key(b"k" * 32)
+    secret = Message(msg_type=MessageType.TEXT, payload=b"x" * 1000)
+    buf = bytearray(secret.packed_size(channel))
+    secret.pack_into(buf, secure_channel=channel)
+
+    assert Message.unpack(memoryview(buf), channel).payload == b"x" * 1000
+
+
+def test_small_and_large_frames_roundtrip():
+    """Bodies either side of SMALL_WRITE / SMALL_FRAME take different pack paths, all must read back at v1 and v2."""
+    from src.aronanet.protocol.crypto import SecureChannel
+    from src.aronanet.protocol.messages import SMALL_FRAME, SMALL_WRITE
+
+    channel = SecureChannel()
+    channel.setup_shared_key(b"k" * 32)
+    for size in (SMALL_WRITE - 1, SMALL_WRITE, SMALL_FRAME - 1, SMALL_FRAME, 4 * SMALL_FRAME):
+        for version in (1, 2):
+            msg = Message(msg_type=MessageType.TEXT, payload=b"y" * size)
+            frame = msg.pack(channel, version)
+            assert len(frame) == msg.packed_size(channel, version)
+            assert Message.unpack(frame, channel).payload == b"y" * size
+
+            buf = bytearray(3 + msg.packed_size(channel, version))
+            assert msg.pack_into(buf, 3, channel, version) == len(buf) - 3
+            assert Message.unpack(memoryview(buf)[3:], channel).payload == b"y" * size
+
+            plain = Message(msg_type=MessageType.SUP, payload=b"z" * size)
+            buf = bytearray(plain.packed_size(version=version))
+            plain.pack_into(buf, version=version)
+            assert bytes(buf) == plain.pack(version=version)
+
+
+def test_v2_frame_drops_length_and_crc():
+    """Encrypted v2 frames have a 5 byte header, no CRC, and the header is authenticated."""
+    from src.aronanet.protocol.crypto import SecureChannel
+
+    channel = SecureChannel()
+    channel.setup_shared_key(b"k" * 32)
+
+    msg = Message(msg_type=MessageType.TEXT, payload=b"smol")
+    v1, v2 = msg.pack(channel, version=1), msg.pack(channel, version=2)
+    assert len(v1) - len(v2) == 7
+
+    unpacked = Message.unpack(v2, channel)
+    assert (unpacked.version, unpacked.payload, unpacked.msg_id) == (2, b"smol", msg.msg_id)
+
+    tampered = bytearray(v2)
+    tampered[3] ^= 0x01  # flip a msg_id bit
+    with pytest.raises(Exception):
+        Message.unpack(bytes(tampered), channel)
+
+
+def test_v2_hi_keeps_v1_layout():
+    """HI advertises the version but any peer can still parse it."""
+    msg = Message(version=2, msg_type=MessageType.HI, payload=b"k" * 32)
+    packed = msg.pack()
+
+    assert int.from_bytes(packed[2:6], "big") == 32
+    assert Message.unpack(packed).version == 2
+
+
+def test_counter_nonces_roundtrip_and_replay():
+    """Counter mode sends no nonce, uses a key per direction and rejects replays."""
+    from src.aronanet.protocol.crypto import SecureChannel
+
+    server, client = SecureChannel(), SecureChannel()
+    server.setup_session_keys(b"s" * 32, is_server=True)
+    client.setup_session_keys(b"s" * 32, is_server=False)
+
+    first = Message(msg_type=MessageType.TEXT, payload=b"one").pack(client, version=3)
+    second = Message(msg_type=MessageType.TEXT, payload=b"two").pack(client, version=3)
+    assert len(first) == 5 + 3 + 16
+
+    assert Message.unpack(first, server).payload == b"one"
+    with pytest.raises(Exception):
+        Message.unpack(first, server)  # replay
+    assert Message.unpack(second, server).payload == b"two"
+
+    # Server -> client uses the other key, so a reflected frame doesn't decrypt
+    with pytest.raises(Exception):
+        Message.unpack(Message(msg_type=MessageType.TEXT, payload=b"x").pack(client, version=3), client)
+
+
+def test_resumption_ticket_roundtrip_and_expiry():
+    """Tickets open only under the key that sealed them and only until they expire."""
+    from src.aronanet.protocol.crypto import TicketKey
+
+    tickets = TicketKey(lifetime=60)
+    ticket = tickets.issue("alice", b"r" * 32, 0x03)
+
+    assert tickets.open(ticket) == ("alice", b"r" * 32, 0x03)
+    with pytest.raises(ValueError):
+        TicketKey().open(ticket)
+    with pytest.raises(ValueError):
+        TicketKey(tickets.key, lifetime=-1).open(ticket)
+
+
+def test_resumed_keys_match_both_sides():
+    """Both sides turn the old session into the same ticket secret and the same fresh keys."""
+    from src.aronanet.protocol.crypto import SecureChannel
+
+    old_server, old_client = SecureChannel(), SecureChannel()
+    old_server.setup_session_keys(b"s" * 32, is_server=True)
+    old_client.setup_session_keys(b"s" * 32, is_server=False)
+    secret = old_server.resumption_secret()
+    assert secret == old_client.resumption_secret()
+
+    server, client = SecureChannel(), SecureChannel()
+    server.setup_resumed_keys(secret, b"c" * 32 + b"s" * 32, True, is_server=True)
+    client.setup_resumed_keys(secret, b"c" * 32 + b"s" * 32, True, is_server=False)
+
+    packed = Message(msg_type=MessageType.TEXT, payload=b"back").pack(client, version=3)
+    assert Message.unpack(packed, server).payload == b"back"
+    with pytest.raises(Exception):
+        Message.unpack(Message(msg_type=MessageType.TEXT, payload=b"x").pack(old_client, version=3), server)
+
+
+def test_unknown_type_byte_rejected():
+    """Type bytes go through the lookup table, anything unassigned is a ValueError like the enum gave."""
+    packed = bytearray(Message(version=3, msg_type=MessageType.TEXT, payload=b"x").pack())
+    packed[1] = 0x7E
+
+    with pytest.raises(ValueError):
+        Message.unpack(bytes(packed))
+
+
+def test_compressed_roundtrip_and_flag():
+    """Agreed compression shrinks big payloads, sets the header flag, and small ones go out as they are."""
+    from src.aronanet.protocol.crypto import SecureChannel
+    from src.aronanet.protocol.compression import ZlibCompressor
+    from src.aronanet.protocol.messages import FLAG_COMPRESSED
+
+    server, client = SecureChannel(), SecureChannel()
+    server.setup_session_keys(b"k" * 32, is_server=True)
+    client.setup_session_keys(b"k" * 32, is_server=False)
+    server.compressor = client.compressor = ZlibCompressor(min_size=64)
+
+    big = Message(msg_type=MessageType.TEXT, payload=b"[alice] thanks, it works now :) " * 8)
+    frame = big.pack(server, version=3)
+    assert frame[2] & FLAG_COMPRESSED
+    assert len(frame) < len(big.payload)
+    assert Message.unpack(frame, client).payload == big.payload
+
+    small = Message(msg_type=MessageType.TEXT, payload=b"[alice] hi")
+    frame = small.pack(server, version=3)
+    assert not frame[2] & FLAG_COMPRESSED
+    assert Message.unpack(frame, client).payload == b"[alice] hi"
+
+
+def test_compressed_frame_needs_agreement():
+    from src.aronanet.protocol.crypto import SecureChannel
+    from src.aronanet.protocol.compression import ZlibCompressor
+
+    sender, receiver = SecureChannel(), SecureChannel()
+    sender.setup_shared_key(b"k" * 32)
+    receiver.setup_shared_key(b"k" * 32)
+    sender.compressor = ZlibCompressor(min_size=0)
+
+    frame = Message(msg_type=MessageType.TEXT, payload=b"lol " * 50).pack(sender, version=3)
+    with pytest.raises(ValueError):
+        Message.unpack(frame, receiver)
+
+
+def test_zlib_decompress_is_bounded():
+    """A tiny payload that inflates past max_size is refused, not expanded."""
+    from src.aronanet.protocol.compression import ZlibCompressor
+
+    compressor = ZlibCompressor(min_size=0, max_size=1024)
+    bomb = ZlibCompressor(min_size=0).compress(bytes(100_000))
+    assert len(bomb) < 1024
+    with pytest.raises(ValueError):
+        compressor.decompress(bomb)
@@ -0,0 +1,73 @@
+import time
+import pytest
+from unittest.mock import MagicMock, AsyncMock
+
+from aronanet.server.connection import ClientConnection
+from aronanet.server.connection_manager import ConnectionManager
+from aronanet.server.router import Router, router
+from aronanet.server.indicators import TypingIndicators
+from aronanet.protocol.messages import Message, MessageType
+
+def make_server():
+    server = MagicMock()
+    server.conn_manager = ConnectionManager()
+    return server
+
+def make_conn(username: str):
+    conn = MagicMock(spec=ClientConnection)
+    conn.username = username
+    conn.enqueue = AsyncMock(return_value=True)
+    return conn
+
+
+@pytest.mark.asyncio
+async def test_dispatch_counts_and_times():
+    r = Router()
+    seen = []
+
+    @r.route(MessageType.TEXT, MessageType.DM)
+    async def handler(server, conn, msg):
+        seen.append(msg.msg_type)
+
+    assert await r.dispatch(None, make_conn("alice"), Message(msg_type=MessageType.TEXT))
+    assert await r.dispatch(None, make_conn("alice"), Message(msg_type=MessageType.DM))
+    assert await r.dispatch(None, make_conn("alice"), Message(msg_type=MessageType.IMAGE))
+
+    assert seen == [MessageType.TEXT, MessageType.DM]
+    assert r.stats[MessageType.TEXT].count == 1
+    assert r.stats[MessageType.TEXT].max_ns > 0
+    assert r.unhandled == 1
+    assert "TEXT: 1 msgs" in r.report()
+
+
+@pytest.mark.asyncio
+async def test_adios_ends_session():
+    assert not await router.dispatch(make_server(), make_conn("alice"), Message(msg_type=MessageType.ADIOS))
+
+
+@pytest.mark.asyncio
+async def test_typing_is_coalesced_per_channel():
+    """Keystrokes from two typers become one TYPING naming both, then one empty one once they stop"""
+    server = make_server()
+    server.typing = TypingIndicators(server.conn_manager, timeout=5.0)
+    alice, bob, carol = make_conn("alice"), make_conn("bob"), make_conn("carol")
+    for conn in (alice, bob, carol):
+        server.conn_manager.add_user(conn.username, conn)
+
+    for _ in range(10):
+        await router.dispatch(server, alice, Message(msg_type=MessageType.TYPING))
+        await router.dispatch(server, bob, Message(msg_type=MessageType.TYPING))
+    carol.enqueue.assert_not_called()
+
+    await server.typing.flush()
+    assert carol.enqueue.call_count == 1
+    assert set(carol.enqueue.call_args.args[0].payload.split(b"\n")) == {b"alice", b"bob"}
+
+    await server.typing.flush()
+    assert carol.enqueue.call_count == 1  # nothing changed, nothing sent
+
+    server.typing.stopped("alice")
+    await server.typing.flush(now=time.monotonic() + 10)
+    assert carol.enqueue.call_count == 2
+    assert carol.enqueue.call_args.args[0].payload == b""
+    assert not server.typing.typers
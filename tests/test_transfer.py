@@ -0,0 +1,159 @@
+import asyncio
+import hashlib
+import pytest
+from unittest.mock import MagicMock, AsyncMock
+
+from aronanet.protocol.messages import Message, MessageType
+from aronanet.protocol.transfer import (
+    ABORT, IncomingTransfer, OutgoingTransfer, chunk_payload, parse_chunk, parse_start, start_payload
+)
+from aronanet.server.connection import ClientConnection
+from aronanet.server.connection_manager import ConnectionManager
+from aronanet.server.transfers import Transfers
+
+def make_conn(username: str):
+    conn = MagicMock(spec=ClientConnection)
+    conn.username = username
+    conn.enqueue = AsyncMock()
+    conn.enqueue_bulk = AsyncMock()
+    return conn
+
+
+def test_round_trip(tmp_path):
+    """A file split into windowed chunks comes back identical"""
+    src = tmp_path / "cat.png"
+    src.write_bytes(bytes(range(256)) * 41)
+    upload = OutgoingTransfer(7, src, chunk_size=1000, window=3)
+
+    tid, size, digest, chunk_size, name = parse_start(upload.start_message().payload)
+    assert (tid, size, name) == (7, src.stat().st_size, "cat.png")
+    download = IncomingTransfer(tmp_path / "out" / name, size, digest, chunk_size)
+
+    done = False
+    while not done:
+        chunks = upload.ready_chunks()
+        assert len(chunks) <= 3
+        for msg in chunks:
+            _, index, data = parse_chunk(msg.payload)
+            done = download.write(index, data)
+            upload.ack(index)
+
+    assert upload.done
+    assert (tmp_path / "out" / "cat.png").read_bytes() == src.read_bytes()
+
+
+def test_hash_mismatch_discards(tmp_path):
+    path = tmp_path / "x.bin"
+    download = IncomingTransfer(path, 4, hashlib.sha256(b"abcd").digest(), 2)
+    download.write(0, b"ab")
+
+    with pytest.raises(ValueError):
+        download.write(1, b"zz")
+    assert not path.exists()
+    assert not list(tmp_path.iterdir())
+
+
+@pytest.mark.asyncio
+async def test_relay_acks_after_every_recipient():
+    """Chunks go to every other member's bulk queue before the uploader is acked"""
+    manager = ConnectionManager()
+    alice, bob, carol = make_conn("alice"), make_conn("bob"), make_conn("carol")
+    for conn in (alice, bob, carol):
+        manager.add_user(conn.username, conn)
+    transfers = Transfers(manager, chunk_size=4)
+
+    start = Message(msg_type=MessageType.IMAGE, payload=start_payload(3, 6, bytes(32), 4, "a.txt"))
+    await transfers.start(alice, start)
+
+    announce = bob.enqueue.call_args.args[0]
+    server_id, size, _, _, name = parse_start(announce.payload)
+    assert (size, name) == (6, "[alice] a.txt")
+
+    await transfers.chunk(alice, Message(msg_type=MessageType.CHUNK, payload=chunk_payload(3, 0, b"abcd")))
+    for conn in (bob, carol):
+        assert parse_chunk(conn.enqueue_bulk.call_args.args[0].payload) == (server_id, 0, b"abcd")
+    assert parse_chunk(alice.enqueue.call_args.args[0].payload)[:2] == (3, 0)
+
+    await transfers.drop(alice)
+    assert parse_chunk(bob.enqueue.call_args.args[0].payload)[:2] == (server_id, ABORT)
+    assert not transfers.active
+
+
+async def start_transfer(transfers: Transfers, sender, chunk_size: int, size: int = 64) -> int:
+    start = Message(msg_type=MessageType.IMAGE, payload=start_payload(3, size, bytes(32), chunk_size, "a.bin"))
+    await transfers.start(sender, start)
+    return transfers.active[sender][3].server_id
+
+
+def chunk(index: int, data: bytes) -> Message:
+    return Message(msg_type=MessageType.CHUNK, payload=chunk_payload(3, index, data))
+
+
+@pytest.mark.asyncio
+async def test_chunk_over_negotiated_size_aborts():
+    manager = ConnectionManager()
+    alice, bob = make_conn("alice"), make_conn("bob")
+    for conn in (alice, bob):
+        manager.add_user(conn.username, conn)
+    transfers = Transfers(manager, chunk_size=16)
+
+    server_id = await start_transfer(transfers, alice, chunk_size=4)
+    await transfers.chunk(alice, chunk(0, b"abcde"))
+
+    bob.enqueue_bulk.assert_not_called()
+    assert parse_chunk(alice.enqueue.call_args.args[0].payload)[:2] == (3, ABORT)
+    assert parse_chunk(bob.enqueue.call_args.args[0].payload)[:2] == (server_id, ABORT)
+    assert not transfers.active[alice]
+
+
+@pytest.mark.asyncio
+async def test_stalled_recipients_wait_together():
+    """Two stuck recipients cost one stall_timeout, and the rest get the chunk right away"""
+    manager = ConnectionManager()
+    alice, bob, carol, dave = (make_conn(name) for name in ("alice", "bob", "carol", "dave"))
+    for conn in (alice, bob, carol, dave):
+        manager.add_user(conn.username, conn)
+
+    async def full(msg):
+        await asyncio.sleep(10)
+
+    for stuck in (bob, carol):
+        stuck.enqueue_bulk = AsyncMock(side_effect=full)
+    transfers = Transfers(manager, chunk_size=4, stall_timeout=0.2)
+
+    server_id = await start_transfer(transfers, alice, chunk_size=4)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    await transfers.chunk(alice, chunk(0, b"abcd"))
+
+    assert loop.time() - started < 0.35
+    assert parse_chunk(dave.enqueue_bulk.call_args.args[0].payload) == (server_id, 0, b"abcd")
+    assert transfers.active[alice][3].recipients == [dave]
+    for stuck in (bob, carol):
+        assert parse_chunk(stuck.enqueue.call_args.args[0].payload)[:2] == (server_id, ABORT)
+
+
+@pytest.mark.asyncio
+async def test_abort_comes_after_queued_chunks():
+    """A dropped recipient's queued chunks are thrown out, so nothing of the transfer follows ABORT"""
+    reader = MagicMock(spec=asyncio.StreamReader)
+    writer = MagicMock(spec=asyncio.StreamWriter)
+    writer.get_extra_info.return_value = ("127.0.0.1", 1234)
+    bob = ClientConnection(reader, writer, bulk_queue_size=2)
+    bob.username = "bob"
+    other = Message(msg_type=MessageType.CHUNK, payload=chunk_payload(99, 0, b"x"))
+    await bob.enqueue_bulk(other)
+
+    manager = ConnectionManager()
+    alice = make_conn("alice")
+    for conn in (alice, bob):
+        manager.add_user(conn.username, conn)
+    transfers = Transfers(manager, chunk_size=4, stall_timeout=0.05)
+
+    server_id = await start_transfer(transfers, alice, chunk_size=4)
+    await transfers.chunk(alice, chunk(0, b"abcd"))
+    await transfers.chunk(alice, chunk(1, b"efgh"))  # bulk is full, bob stalls and is dropped
+
+    assert [bob.bulk.get_nowait()] == [other] and bob.bulk.empty()
+    queued = [bob.outbox.get_nowait() for _ in range(bob.outbox.qsize())]
+    assert parse_chunk(queued[-1].payload)[:2] == (server_id, ABORT)